@@ -0,0 +1,90 @@
+"""闭式理论成功率基准：对数域向量化核 vs 原 comb 逐项求和实现
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_closed_form.py
+
+- 小 n：对比两种实现的结果差异和耗时
+- 大 n：只运行新实现（原实现的 comb 大整数和逐项求和在此规模下不可用）
+"""
+import os
+import sys
+import time
+from math import comb
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import calculate_theoretical_success_rate  # noqa: E402
+
+
+def reference_success_rate(n: int, f: int, p: float) -> float:
+    """原实现（comb 浮点乘积 + < 1e-15 剪枝），仅用于对比"""
+    def binom_prob(n_trials, k_success, prob):
+        if k_success > n_trials or k_success < 0:
+            return 0.0
+        return comb(n_trials, k_success) * (prob ** k_success) * ((1 - prob) ** (n_trials - k_success))
+
+    def binom_tail_ge(m, k, prob):
+        if k <= 0:
+            return 1.0
+        if m < 0 or k > m:
+            return 0.0
+        return sum(binom_prob(m, i, prob) for i in range(k, m + 1))
+
+    nc_required = n - f
+    k_prepare = 2 * f - 1
+    k_commit = 2 * f
+    total_prob = 0.0
+    for x in range(nc_required, n + 1):
+        p_pp = binom_prob(n - 1, x - 1, p)
+        if p_pp < 1e-15:
+            continue
+        q0 = binom_tail_ge(x - 1, k_prepare, p)
+        q1 = binom_tail_ge(x - 2, k_prepare, p)
+        for y in range(nc_required, x + 1):
+            p_p_y_given_x = q0 * binom_prob(x - 1, y - 1, q1) + (1 - q0) * binom_prob(x - 1, y, q1)
+            if p_p_y_given_x < 1e-15:
+                continue
+            q2 = binom_tail_ge(y - 1, k_commit, p)
+            p_c_ge = sum(binom_prob(y, z, q2) for z in range(nc_required, y + 1))
+            total_prob += p_pp * p_p_y_given_x * p_c_ge
+    return total_prob
+
+
+def timed(func, *args, repeat: int = 3):
+    best = float("inf")
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return value, best
+
+
+def main():
+    p_values = [0.5, 0.7, 0.8, 0.9, 0.95, 0.99]
+
+    print("=== 小 n：精度与耗时对比 ===")
+    print(f"{'n':>5} {'f':>4} {'max|Δ|':>10} {'原实现(ms)':>12} {'新实现(ms)':>12}")
+    for n in [4, 7, 10, 16, 25, 40, 70, 100]:
+        f = (n - 1) // 3
+        max_diff = 0.0
+        t_ref = t_new = 0.0
+        for p in p_values:
+            ref, t1 = timed(reference_success_rate, n, f, p)
+            new, t2 = timed(calculate_theoretical_success_rate, n, f, p)
+            max_diff = max(max_diff, abs(ref - new))
+            t_ref += t1
+            t_new += t2
+        print(f"{n:>5} {f:>4} {max_diff:>10.2e} {t_ref / len(p_values) * 1000:>12.2f} {t_new / len(p_values) * 1000:>12.2f}")
+
+    print("\n=== 大 n：仅新实现 ===")
+    print(f"{'n':>5} {'f':>4} {'p':>6} {'成功率':>12} {'耗时(ms)':>10}")
+    for n in [500, 1000, 2000, 4000]:
+        f = (n - 1) // 3
+        for p in [0.8, 0.83, 0.85, 0.9]:
+            value, t = timed(calculate_theoretical_success_rate, n, f, p, repeat=1)
+            print(f"{n:>5} {f:>4} {p:>6} {value:>12.4e} {t * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""多路径路由基准：k 条不相交路径（连续最短增广路）的正确性与全节点对 P_comm 的耗时
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_disjoint_paths.py
+
+- 正确性：路径数等于 min(k, 最大流)（scipy maximum_flow，节点不相交时拆点），路径互不相交且沿真实边；
+  环形拓扑 k=2 时不相邻节点的 P_comm 与原来的顺时针 + 逆时针模型一致；
+  逐链路抽样的蒙特卡洛（任一路径成功即送达）与精确 P_comm 一致
+- 耗时：calculate_comm_reliability_matrix_disjoint_paths 计算全部节点对
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np  # noqa: E402
+from scipy.sparse import csr_matrix  # noqa: E402
+from scipy.sparse.csgraph import maximum_flow  # noqa: E402
+
+from main import (  # noqa: E402
+    calculate_comm_reliability_matrix_disjoint_paths,
+    calculate_comm_reliability_matrix_shortest_path,
+    disjoint_paths,
+    generate_random_regular_edges,
+    generate_small_world_edges,
+    get_disjoint_path_router,
+    register_custom_topology,
+)
+
+
+def max_flow_value(graph, src: int, dst: int, mode: str) -> int:
+    """src→dst 的不相交路径数上限：单位容量最大流（节点不相交时中间节点拆成 入点→出点）"""
+    n = graph.shape[0]
+    coo = graph.tocoo()
+    if mode == "edge":
+        rows, cols, size = coo.row, coo.col, n
+    else:
+        rows = np.concatenate([coo.row + n, np.arange(n)])
+        cols = np.concatenate([coo.col, np.arange(n) + n])
+        size = 2 * n
+        src = src + n
+    capacity = csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(size, size))
+    return int(maximum_flow(capacity, src, dst).flow_value)
+
+
+def check_router(n: int, topology: str, graph, k: int, mode: str):
+    router = get_disjoint_path_router(n, topology, 2, k, mode)
+    for src in range(n):
+        for dst in range(n):
+            if src == dst:
+                continue
+            paths = disjoint_paths(router, src, dst)
+            assert len(paths) == min(k, max_flow_value(graph, src, dst, mode)), (src, dst)
+            for path in paths:
+                assert path[0] == src and path[-1] == dst and len(set(path)) == len(path)
+                assert all(graph[a, b] != 0 for a, b in zip(path, path[1:]))
+            if mode == "node":
+                inner = [v for path in paths for v in path[1:-1]]
+                assert len(inner) == len(set(inner))
+            else:
+                links = [link for path in paths for link in zip(path, path[1:])]
+                assert len(links) == len(set(links))
+
+
+def monte_carlo_delivery(router, src: int, dst: int, p: float, trials: int, rng) -> float:
+    """每轮独立抽取所有链路的状态，任一路径的链路全部可用即送达"""
+    paths = disjoint_paths(router, src, dst)
+    delivered = 0
+    for _ in range(trials):
+        up = {}
+        for path in paths:
+            if all(up.setdefault(link, rng.random() < p) for link in zip(path, path[1:])):
+                delivered += 1
+                break
+    return delivered / trials
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print("=== 正确性 ===")
+    cases = [("ring", 12, None), ("star", 9, None), ("tree", 15, None), ("full", 7, None)]
+    for name, edges in [("random-regular", generate_random_regular_edges(30, 4, rng)),
+                        ("small-world", generate_small_world_edges(30, 4, 0.3, rng))]:
+        record = register_custom_topology(30, edges, source=name)
+        cases.append((f"custom:{record['id']}", 30, name))
+    arcs = rng.integers(0, 20, (80, 2))
+    directed = register_custom_topology(20, arcs[arcs[:, 0] != arcs[:, 1]], directed=True, source="directed")
+    cases.append((f"custom:{directed['id']}", 20, "有向随机图"))
+    for topology, n, label in cases:
+        graph = get_disjoint_path_router(n, topology, 2, 1, "node")["graph"]
+        for k in [1, 2, 3]:
+            for mode in ["node", "edge"]:
+                check_router(n, topology, graph, k, mode)
+        print(f"  {label or topology:>14} (n={n}): 通过")
+
+    n, p = 16, 0.8
+    disjoint = calculate_comm_reliability_matrix_disjoint_paths(n, "ring", 2, p)
+    legacy = calculate_comm_reliability_matrix_shortest_path(n, "ring", 2, p)
+    gap = np.array([[min((i - j) % n, (j - i) % n) for j in range(n)] for i in range(n)])
+    print(f"  环形 k=2 与原双路径模型（不相邻节点）max|Δ|: {np.abs(disjoint - legacy)[gap > 1].max():.2e}")
+
+    mc_rng = random.Random(0)
+    router = get_disjoint_path_router(30, cases[4][0], 2, 3, "node")
+    P_comm = calculate_comm_reliability_matrix_disjoint_paths(30, cases[4][0], 2, 0.7, 3)
+    for src, dst in [(0, 15), (3, 27)]:
+        estimate = monte_carlo_delivery(router, src, dst, 0.7, 20000, mc_rng)
+        print(f"  蒙特卡洛 {src}→{dst}: {estimate:.4f}，精确 {P_comm[src, dst]:.4f}")
+
+    print("\n=== 全节点对 P_comm 耗时 ===")
+    print(f"{'拓扑':>15} {'n':>4} {'k':>2} {'方式':>5} {'耗时(ms)':>10}")
+    large = [("ring", 100, "ring"), ("tree", 200, "tree"), ("full", 60, "full")]
+    for degree, size in [(6, 100), (6, 200)]:
+        record = register_custom_topology(size, generate_random_regular_edges(size, degree, rng))
+        large.append((f"custom:{record['id']}", size, "random-regular"))
+    for topology, size, label in large:
+        for k, mode in [(2, "node"), (3, "edge")]:
+            start = time.perf_counter()
+            calculate_comm_reliability_matrix_disjoint_paths(size, topology, 2, 0.9, k, mode)
+            elapsed = time.perf_counter() - start
+            print(f"{label:>15} {size:>4} {k:>2} {mode:>5} {elapsed * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
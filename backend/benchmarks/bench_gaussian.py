@@ -0,0 +1,62 @@
+"""“fast” 精度（高斯/平均场近似）基准：与精确计算的误差和耗时对比
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_gaussian.py
+
+- 均匀可靠度：整条 p 曲线的正态近似 vs 对数域闭式精确解
+- 自定义矩阵：theory_engine_gaussian vs 精确引擎（随机矩阵、星形/树形/环形拓扑）
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import (  # noqa: E402
+    calculate_comm_reliability_matrix_shortest_path,
+    calculate_theoretical_success_rate_sweep,
+    calculate_theoretical_success_rate_sweep_gaussian,
+    theory_engine_gaussian,
+    theory_engine_with_symmetry,
+)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    value = func(*args)
+    return value, time.perf_counter() - start
+
+
+def main():
+    p_values = np.linspace(0.5, 0.999, 100)
+    print("=== 均匀可靠度曲线（100 个 p） ===")
+    print(f"{'n':>6} {'max|Δ|':>10} {'精确(ms)':>10} {'近似(ms)':>10}")
+    for n in [31, 100, 301, 1000, 3001]:
+        f = (n - 1) // 3
+        exact, t_exact = timed(calculate_theoretical_success_rate_sweep, n, f, p_values)
+        approx, t_approx = timed(calculate_theoretical_success_rate_sweep_gaussian, n, f, p_values)
+        print(f"{n:>6} {np.abs(exact - approx).max():>10.2e} {t_exact * 1000:>10.1f} {t_approx * 1000:>10.1f}")
+
+    print("\n=== 自定义矩阵 ===")
+    print(f"{'矩阵':>10} {'n':>4} {'精确':>8} {'近似':>8} {'|Δ|':>9} {'近似(ms)':>10}")
+    rng = np.random.default_rng(0)
+    cases = []
+    for n in [10, 13]:
+        P = rng.uniform(0.8, 1.0, (n, n))
+        np.fill_diagonal(P, 1.0)
+        cases.append(("随机", n, P))
+    for topology in ["star", "tree", "ring"]:
+        cases.append((topology, 13, calculate_comm_reliability_matrix_shortest_path(13, topology, 2, 0.95)))
+    cases.append(("star", 100, calculate_comm_reliability_matrix_shortest_path(100, "star", 2, 0.9)))
+    for name, n, P in cases:
+        f = (n - 1) // 3
+        exact = theory_engine_with_symmetry(n, f, P, 1)['success_rate']
+        approx, t_approx = timed(theory_engine_gaussian, n, f, P, 1)
+        rate = approx['success_rate']
+        print(f"{name:>10} {n:>4} {exact:>8.4f} {rate:>8.4f} {abs(exact - rate):>9.2e} {t_approx * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""路径预言机基准：逐源 BFS + 下一跳数组 vs 原纯 Python Floyd-Warshall
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_path_oracle.py
+
+- 正确性：跳数与 Floyd-Warshall 一致，还原出的路径都是沿真实边的最短路径
+- 耗时：构建一次全源最短路径；以及会话历史接口的访问模式
+  （每条广播消息 × 每个目标节点调用 is_connection_allowed + 取路径）
+- 自定义拓扑（n=500 的生成器图）：注册、路径预言机和 P_comm 的耗时
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np  # noqa: E402
+
+from main import (  # noqa: E402
+    calculate_comm_reliability_matrix_shortest_path,
+    generate_random_regular_edges,
+    generate_scale_free_edges,
+    generate_small_world_edges,
+    get_path_oracle,
+    is_connection_allowed,
+    is_direct_connection,
+    oracle_path,
+    path_oracle_cache,
+    register_custom_topology,
+)
+
+
+def reference_floyd_warshall(n: int, topology: str, n_value: int):
+    """原实现（纯 Python Floyd-Warshall），仅用于对比"""
+    INF = float('inf')
+    dist = [[INF] * n for _ in range(n)]
+    for i in range(n):
+        dist[i][i] = 0
+        for j in range(n):
+            if i != j and is_direct_connection(i, j, n, topology, n_value):
+                dist[i][j] = 1
+    for k in range(n):
+        for i in range(n):
+            for j in range(n):
+                if dist[i][k] + dist[k][j] < dist[i][j]:
+                    dist[i][j] = dist[i][k] + dist[k][j]
+    return dist
+
+
+def check(n: int, topology: str, n_value: int):
+    reference = reference_floyd_warshall(n, topology, n_value)
+    oracle = get_path_oracle(n, topology, n_value)
+    for i in range(n):
+        for j in range(n):
+            expected = reference[i][j]
+            actual = int(oracle['dist'][i, j])
+            if expected == float('inf'):
+                assert actual == -1, (i, j)
+                continue
+            assert actual == expected, (i, j, actual, expected)
+            if i != j:
+                path = oracle_path(oracle, i, j)
+                assert len(path) - 1 == expected and path[0] == i and path[-1] == j
+                assert all(is_direct_connection(a, b, n, topology, n_value) for a, b in zip(path, path[1:]))
+
+
+def history_pattern(n: int, topology: str, n_value: int, messages: int):
+    """模拟 get_session_history：每条广播消息展开到所有可达目标"""
+    oracle = get_path_oracle(n, topology, n_value)
+    hops = 0
+    for m in range(messages):
+        src = m % n
+        for dst in range(n):
+            if dst != src and is_connection_allowed(src, dst, n, topology, n_value):
+                hops += len(oracle_path(oracle, src, dst))
+    return hops
+
+
+def main():
+    print("=== 正确性（与 Floyd-Warshall 对比） ===")
+    for topology, n_value in [("full", 2), ("ring", 2), ("star", 2), ("tree", 2), ("tree", 3)]:
+        for n in [4, 9, 16, 31]:
+            check(n, topology, n_value)
+        print(f"  {topology:>5} (分支数 {n_value}): 通过")
+
+    print("\n=== 构建全源最短路径 ===")
+    print(f"{'拓扑':>6} {'n':>5} {'Floyd(ms)':>11} {'BFS(ms)':>9}")
+    for topology in ["ring", "star", "tree"]:
+        for n in [50, 100, 200]:
+            start = time.perf_counter()
+            reference_floyd_warshall(n, topology, 2)
+            t_ref = time.perf_counter() - start
+            path_oracle_cache.clear()
+            start = time.perf_counter()
+            get_path_oracle(n, topology, 2)
+            t_new = time.perf_counter() - start
+            print(f"{topology:>6} {n:>5} {t_ref * 1000:>11.1f} {t_new * 1000:>9.1f}")
+
+    print("\n=== 会话历史访问模式（n=200，3n 条广播消息） ===")
+    for topology in ["ring", "star", "tree"]:
+        start = time.perf_counter()
+        history_pattern(200, topology, 2, 600)
+        print(f"{topology:>6}: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    print("\n=== 自定义拓扑（n=500） ===")
+    print(f"{'生成器':>15} {'边数':>6} {'注册(ms)':>9} {'预言机(ms)':>11} {'P_comm(ms)':>11} {'直径':>5}")
+    rng = np.random.default_rng(0)
+    generators = [
+        ("random-regular", lambda: generate_random_regular_edges(500, 6, rng)),
+        ("small-world", lambda: generate_small_world_edges(500, 6, 0.1, rng)),
+        ("scale-free", lambda: generate_scale_free_edges(500, 3, rng)),
+    ]
+    for name, generate in generators:
+        start = time.perf_counter()
+        record = register_custom_topology(500, generate(), source=name)
+        t_register = time.perf_counter() - start
+        topology = f"custom:{record['id']}"
+        start = time.perf_counter()
+        oracle = get_path_oracle(500, topology, 2)
+        t_oracle = time.perf_counter() - start
+        start = time.perf_counter()
+        calculate_comm_reliability_matrix_shortest_path(500, topology, 2, 0.95)
+        t_matrix = time.perf_counter() - start
+        print(f"{name:>15} {record['graph'].nnz // 2:>6} {t_register * 1000:>9.1f} {t_oracle * 1000:>11.1f} "
+              f"{t_matrix * 1000:>11.1f} {int(oracle['dist'].max()):>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""主节点选择指标 P_prep 基准：批量精确 Poisson-binomial vs 原"平均概率 + 二项求和"近似
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_prepare_quorum.py
+
+- 精度：原近似与精确值的最大误差（异质性越强误差越大），以及新实现与逐节点标量 DP 的差异
+- 耗时：原实现逐节点 Python 循环 vs 新实现 (n-1)×(n-2) 二维数组一次批量计算
+"""
+import os
+import sys
+import time
+from math import comb
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import prepare_stage_quorum_probs  # noqa: E402
+
+
+def reference_approx_p_prep(n: int, f: int, P_comm, v: int):
+    """原实现（发送者概率取平均后按二项分布求和），仅用于对比"""
+    k_prepare = 2 * f
+    w = np.zeros(n)
+    w[v] = 1.0
+    for j in range(n):
+        if j != v:
+            w[j] = P_comm[v, j]
+    P_prep = np.zeros(n)
+    for i in range(n):
+        if i == v:
+            P_prep[i] = 1.0
+            continue
+        senders = [j for j in range(n) if j != i and j != v]
+        prob_success = [w[j] * P_comm[j, i] for j in senders]
+        if len(prob_success) > 0:
+            avg_p = np.mean(prob_success)
+            m = len(senders)
+            for k in range(k_prepare, m + 1):
+                P_prep[i] += comb(m, k) * (avg_p ** k) * ((1 - avg_p) ** (m - k))
+    return P_prep
+
+
+def reference_exact_p_prep(n: int, f: int, P_comm, v: int):
+    """逐节点标量 DP 的精确 Poisson-binomial 尾概率，用于校验"""
+    k_prepare = 2 * f
+    P_prep = np.ones(n)
+    for i in range(n):
+        if i == v:
+            continue
+        dp = [1.0]
+        for j in range(n):
+            if j == i or j == v:
+                continue
+            p = P_comm[v, j] * P_comm[j, i]
+            dp = [a * (1 - p) + b * p for a, b in zip(dp + [0.0], [0.0] + dp)]
+        P_prep[i] = sum(dp[k_prepare:])
+    return P_prep
+
+
+def make_matrix(kind: str, n: int, rng):
+    if kind == "近均匀":
+        P = rng.uniform(0.88, 0.92, (n, n))
+    elif kind == "随机":
+        P = rng.uniform(0.5, 1.0, (n, n))
+    else:  # 分簇：两个簇内可靠、簇间不可靠
+        cluster = np.arange(n) < n // 2
+        P = np.where(cluster[:, None] == cluster[None, :], 0.98, 0.4)
+        P = np.clip(P + rng.normal(0, 0.02, (n, n)), 0.0, 1.0)
+    np.fill_diagonal(P, 1.0)
+    return P
+
+
+def timed(func, *args, repeat: int = 3):
+    best = float("inf")
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return value, best
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print("=== 精度：原近似的误差 / 新实现与标量 DP 的差异 ===")
+    print(f"{'矩阵':>6} {'n':>5} {'近似 max|Δ|':>12} {'新实现 max|Δ|':>14}")
+    for kind in ["近均匀", "随机", "分簇"]:
+        for n in [7, 16, 40]:
+            f = (n - 1) // 3
+            P = make_matrix(kind, n, rng)
+            approx_err = exact_err = 0.0
+            for v in range(n):
+                exact = reference_exact_p_prep(n, f, P, v)
+                approx_err = max(approx_err, np.abs(reference_approx_p_prep(n, f, P, v) - exact).max())
+                exact_err = max(exact_err, np.abs(prepare_stage_quorum_probs(n, f, P, v) - exact).max())
+            print(f"{kind:>6} {n:>5} {approx_err:>12.2e} {exact_err:>14.2e}")
+
+    print("\n=== 耗时：所有主节点的 P_prep ===")
+    print(f"{'n':>5} {'原实现(ms)':>12} {'新实现(ms)':>12} {'加速比':>8}")
+    for n in [16, 40, 100, 200]:
+        f = (n - 1) // 3
+        P = make_matrix("随机", n, rng)
+        _, t_ref = timed(lambda: [reference_approx_p_prep(n, f, P, v) for v in range(n)], repeat=1)
+        _, t_new = timed(lambda: [prepare_stage_quorum_probs(n, f, P, v) for v in range(n)])
+        print(f"{n:>5} {t_ref * 1000:>12.1f} {t_new * 1000:>12.1f} {t_ref / t_new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""精确两端可靠度（前沿 BDD）基准：与穷举链路状态对比，以及与 shortest-path / all-paths 模型的差异和耗时
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_two_terminal.py
+
+- 正确性：小图上穷举 2^链路数 种链路状态（scipy connected_components）得到的精确值
+- 模型差异：shortest-path 忽略备用路径（偏低），all-paths 按 A^k 计数所有游走并当作相互独立（偏高，常饱和到 1）
+- 耗时：calculate_comm_reliability_matrix_two_terminal 计算全部节点对；过稠密的拓扑报错所需的时间
+"""
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np  # noqa: E402
+from scipy.sparse import csr_matrix  # noqa: E402
+from scipy.sparse.csgraph import connected_components  # noqa: E402
+
+from main import (  # noqa: E402
+    calculate_comm_reliability_matrix_all_paths,
+    calculate_comm_reliability_matrix_shortest_path,
+    calculate_comm_reliability_matrix_two_terminal,
+    generate_random_regular_edges,
+    generate_scale_free_edges,
+    generate_small_world_edges,
+    register_custom_topology,
+)
+
+
+def brute_force(n: int, edges, probs):
+    """穷举所有链路状态，按连通分量累加每对节点连通的概率"""
+    P_comm = np.zeros((n, n))
+    for states in itertools.product([False, True], repeat=len(edges)):
+        weight = np.prod([prob if up else 1 - prob for up, prob in zip(states, probs)])
+        up_edges = [edge for edge, up in zip(edges, states) if up]
+        rows, cols = (list(x) for x in zip(*up_edges)) if up_edges else ([], [])
+        graph = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+        _, labels = connected_components(graph, directed=False)
+        P_comm += weight * (labels[:, None] == labels[None, :])
+    return P_comm
+
+
+def grid_edges(rows: int, cols: int):
+    return ([(i * cols + j, i * cols + j + 1) for i in range(rows) for j in range(cols - 1)]
+            + [(i * cols + j, (i + 1) * cols + j) for i in range(rows - 1) for j in range(cols)])
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print("=== 正确性（与穷举链路状态对比） ===")
+    print(f"{'图':>14} {'n':>3} {'链路':>4} {'max|Δ|':>10}")
+    all_pairs = lambda n: [(i, j) for i in range(n) for j in range(i + 1, n)]  # noqa: E731
+    for trial in range(8):
+        n = int(rng.integers(5, 9))
+        candidates = all_pairs(n)
+        edges = [candidates[i] for i in rng.choice(len(candidates), min(14, len(candidates) - 2), replace=False)]
+        weights = rng.uniform(0.3, 0.99, len(edges)) if trial % 2 else None
+        record = register_custom_topology(n, edges, weights=weights)
+        exact = calculate_comm_reliability_matrix_two_terminal(n, f"custom:{record['id']}", 2, 0.7)
+        expected = brute_force(n, edges, weights if weights is not None else [0.7] * len(edges))
+        label = "随机带权图" if weights is not None else "随机图"
+        print(f"{label:>14} {n:>3} {len(edges):>4} {np.abs(exact - expected).max():>10.2e}")
+
+    print("\n=== 模型差异（p=0.9，非对角元素的平均值） ===")
+    print(f"{'拓扑':>15} {'shortest-path':>14} {'two-terminal':>13} {'all-paths':>10}")
+    cases = [("ring", 12, "ring"), ("tree", 15, "tree")]
+    record = register_custom_topology(16, grid_edges(4, 4), source="grid")
+    cases.append((f"custom:{record['id']}", 16, "grid 4×4"))
+    record = register_custom_topology(20, generate_random_regular_edges(20, 3, rng))
+    cases.append((f"custom:{record['id']}", 20, "random-regular"))
+    for topology, n, label in cases:
+        off_diagonal = ~np.eye(n, dtype=bool)
+        values = [calculate_comm_reliability_matrix_shortest_path(n, topology, 2, 0.9)[off_diagonal].mean(),
+                  calculate_comm_reliability_matrix_two_terminal(n, topology, 2, 0.9)[off_diagonal].mean(),
+                  calculate_comm_reliability_matrix_all_paths(n, topology, 2, 0.9)[off_diagonal].mean()]
+        print(f"{label:>15} {values[0]:>14.4f} {values[1]:>13.4f} {values[2]:>10.4f}")
+
+    print("\n=== 耗时 ===")
+    print(f"{'拓扑':>15} {'n':>4} {'耗时(ms)':>10}  结果")
+    large = [("ring", 300, "ring"), ("tree", 500, "tree"), ("full", 8, "full"), ("full", 10, "full")]
+    for label, n, edges in [("grid 5×5", 25, grid_edges(5, 5)), ("grid 6×6", 36, grid_edges(6, 6)),
+                            ("small-world", 40, generate_small_world_edges(40, 4, 0.05, rng)),
+                            ("scale-free m=1", 300, generate_scale_free_edges(300, 1, rng)),
+                            ("scale-free m=2", 50, generate_scale_free_edges(50, 2, rng))]:
+        record = register_custom_topology(n, edges, source=label)
+        large.append((f"custom:{record['id']}", n, label))
+    for topology, n, label in large:
+        start = time.perf_counter()
+        try:
+            calculate_comm_reliability_matrix_two_terminal(n, topology, 2, 0.9)
+            outcome = "完成"
+        except ValueError as e:
+            outcome = f"报错：{e}"
+        print(f"{label:>15} {n:>4} {(time.perf_counter() - start) * 1000:>10.1f}  {outcome}")
+
+
+if __name__ == "__main__":
+    main()
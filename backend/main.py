@@ -1,16 +1,17 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import socketio
 import uuid
 import random
 import asyncio
+import multiprocessing
 from datetime import datetime
+from collections import OrderedDict
 import json
-import networkx as nx  # 用于介数中心性计算
 from scipy.stats import norm  # 用于正态分布计算
 import os
 
@@ -48,6 +49,8 @@ class SessionConfig(BaseModel):
     allowTampering: bool
     messageDeliveryRate: int = 100
     proposerId: Optional[int] = 0  # 主节点ID，默认为0
+    routingPaths: Optional[int] = None  # 多路径路由：每对节点最多使用的不相交路径数，None 为原有路由（环形双路径，其他最短路径）
+    routingDisjoint: Optional[str] = "node"  # 不相交方式：node（节点不相交）或 edge（边不相交）
 
 class SessionInfo(BaseModel):
     sessionId: str
@@ -65,6 +68,89 @@ node_sockets: Dict[str, Dict[int, str]] = {}
 # 节点级别的消息可靠性配置 {session_id: {node_id: {target_node_id: reliability_percentage}}}
 node_reliability: Dict[str, Dict[int, Dict[int, int]]] = {}
 
+# 理论计算单次时间预算（秒）：超出后自定义矩阵引擎返回带证书误差的区间中点
+THEORY_TIME_BUDGET = float(os.environ.get("THEORY_TIME_BUDGET", "20"))
+# "bounds" 精度模式下默认的误差区间宽度
+THEORY_BOUNDS_EPSILON = 1e-3
+# 自定义矩阵理论计算的自动选择：预估枚举分支数超过上限时改用蒙特卡洛估计
+THEORY_EXACT_MAX_BRANCHES = int(os.environ.get("THEORY_EXACT_MAX_BRANCHES", "2000000"))
+THEORY_MC_TRIALS = int(os.environ.get("THEORY_MC_TRIALS", "200000"))
+# 结果为精确值的理论计算方法；其余（monte-carlo / bounds / gaussian / approximation）在响应中标记 "exact": false
+EXACT_THEORY_METHODS = ("exact", "closed-form")
+# 链路灵敏度（梯度）同样按分支枚举，每个分支的代价约为求成功率的数十倍，上限单独设置
+THEORY_GRADIENT_MAX_BRANCHES = int(os.environ.get("THEORY_GRADIENT_MAX_BRANCHES", "200000"))
+# "fast" 精度（高斯/平均场近似）：请求 errorCheck 且问题足够小时顺带做一次精确计算，报告近似误差；
+# 误差检查使用单独的小时间预算，calculate-all 中每个主节点各检查一次
+THEORY_FAST_CHECK_MAX_BRANCHES = int(os.environ.get("THEORY_FAST_CHECK_MAX_BRANCHES", "200000"))
+THEORY_FAST_CHECK_TIME_BUDGET = float(os.environ.get("THEORY_FAST_CHECK_TIME_BUDGET", "2"))
+THEORY_FAST_CHECK_MAX_N = int(os.environ.get("THEORY_FAST_CHECK_MAX_N", "1000"))
+
+# 理论计算进程池：CPU 密集的理论/主节点选择计算在独立进程中执行，避免阻塞事件循环
+THEORY_WORKERS = int(os.environ.get("THEORY_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+THEORY_JOB_TIMEOUT = float(os.environ.get("THEORY_JOB_TIMEOUT", "120"))
+theory_pool: Dict[str, Any] = {"condition": None, "workers": [], "affinity": {}}
+
+# "目标节点从发送者集合收到 ≥k 条消息"概率的 LRU 缓存
+# 键: (目标节点所在列的摘要, 发送者位掩码, 目标节点, k)，只依赖 P_comm 的第 target 列，
+# 因此不同主节点、不同请求以及只改动其他列的矩阵之间都可以复用
+RECEIVE_PROB_CACHE_SIZE = int(os.environ.get("RECEIVE_PROB_CACHE_SIZE", "500000"))
+receive_prob_cache: "OrderedDict[tuple, float]" = OrderedDict()
+receive_prob_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+# 理论结果缓存：按输入的规范化哈希缓存 /api/theory/calculate(-all) 的完整响应
+# 内存层按字节数做 LRU；设置 THEORY_RESULT_CACHE_DB 时额外写入 SQLite，重启后仍可命中
+THEORY_RESULT_CACHE_VERSION = 5  # 计算逻辑变化时递增，使旧的磁盘缓存失效
+THEORY_RESULT_CACHE_BYTES = int(os.environ.get("THEORY_RESULT_CACHE_BYTES", str(64 * 1024 * 1024)))
+THEORY_RESULT_CACHE_DB = os.environ.get("THEORY_RESULT_CACHE_DB")
+theory_result_cache: "OrderedDict[str, str]" = OrderedDict()
+theory_result_cache_state: Dict[str, Any] = {
+    "bytes": 0, "db": None,
+    "memoryHits": 0, "diskHits": 0, "misses": 0, "evictions": 0
+}
+
+# 理论矩阵句柄：增量编辑可靠度矩阵时保留中间状态（Q_out/Q_in、commit 阶段上下界等），
+# 主进程记录每个句柄的当前请求（用于工作进程丢失状态后重建），工作进程内保存计算状态
+THEORY_MAX_HANDLES = int(os.environ.get("THEORY_MAX_HANDLES", "32"))
+# 句柄每次修改都要重算全部 n 个主节点，超出精确计算上限时的蒙特卡洛默认轮数低于 THEORY_MC_TRIALS
+THEORY_HANDLE_MC_TRIALS = int(os.environ.get("THEORY_HANDLE_MC_TRIALS", "20000"))
+# 句柄的理论计算方式：bounds（默认，实时）/ auto（精确或蒙特卡洛，按需）/ none（只算主节点选择指标）
+THEORY_HANDLE_MODES = ("bounds", "auto", "none")
+theory_handle_requests: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+theory_handle_states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# 节点能力表（Q_out / Q_in / w_u / 介数中心性）缓存：与主节点无关，按 (n, f, 矩阵摘要) 在请求之间复用
+PRIMARY_CONTEXT_CACHE_SIZE = int(os.environ.get("PRIMARY_CONTEXT_CACHE_SIZE", "16"))
+primary_context_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+# 介数中心性缓存：按矩阵摘要保存结果向量（句柄修改后改回原值等情况可直接命中）
+BETWEENNESS_CACHE_SIZE = int(os.environ.get("BETWEENNESS_CACHE_SIZE", "64"))
+betweenness_cache: "OrderedDict[bytes, Any]" = OrderedDict()
+
+# 路径预言机缓存：按 (n, 拓扑, 分支数) 保存逐源 BFS 得到的跳数 / 下一跳数组，会话与理论计算共用
+PATH_ORACLE_CACHE_SIZE = int(os.environ.get("PATH_ORACLE_CACHE_SIZE", "32"))
+path_oracle_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+# 多路径路由缓存：按 (n, 拓扑, 分支数, 路径数 k, 不相交方式) 保存路由器，节点对的不相交路径在首次查询时计算并保存
+DISJOINT_PATH_CACHE_SIZE = int(os.environ.get("DISJOINT_PATH_CACHE_SIZE", "16"))
+disjoint_path_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+DISJOINT_MODES = ("node", "edge")
+
+# 精确两端可靠度（前沿 BDD）整个 P_comm 矩阵的状态总数上限（约 30 秒）：问题是 #P 难的，
+# 前沿过宽的稠密拓扑按第一个源节点的状态数预估，超过上限时报错而不是长时间计算。
+# 接口中的展开在理论计算进程池中执行（topology_reliability_matrix），同时受请求的 timeout 约束
+TWO_TERMINAL_MAX_STATES = int(os.environ.get("TWO_TERMINAL_MAX_STATES", "1000000"))
+
+# 用户自定义拓扑：边表或生成器得到的图以 CSR 稀疏矩阵保存（权重为链路可靠度，无权图为 1），
+# 会话和理论接口用 "custom:<id>" 引用。注册在主进程；需要在理论计算进程中展开 P_comm 时记录随任务发送，
+# 工作进程按 id 保存一份（同样是 LRU，见 remember_custom_topology）
+MAX_CUSTOM_TOPOLOGIES = int(os.environ.get("MAX_CUSTOM_TOPOLOGIES", "64"))
+custom_topologies: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# 按拓扑展开的 P_comm 缓存（主进程）：按 (n, 拓扑, 分支数, pcommSource, p, 模型参数) 保存，
+# 展开本身在理论计算进程池中执行（disjoint-paths / two-terminal 在几百个节点的图上需要数秒以上）
+PCOMM_MATRIX_CACHE_SIZE = int(os.environ.get("PCOMM_MATRIX_CACHE_SIZE", "16"))
+pcomm_matrix_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+
 # 会话管理
 def create_session(config: SessionConfig) -> SessionInfo:
     session_id = str(uuid.uuid4())
@@ -76,8 +162,8 @@ def create_session(config: SessionConfig) -> SessionInfo:
         'proposalValue': config.proposalValue
     })
     
-    # 计算最短路径（用于多跳路由）
-    shortest_paths = calculate_shortest_paths(
+    # 计算最短路径（用于多跳路由），同一拓扑的会话共用缓存的路径预言机
+    oracle = get_path_oracle(
         config.nodeCount, 
         config.topology, 
         config.branchCount
@@ -88,14 +174,19 @@ def create_session(config: SessionConfig) -> SessionInfo:
     print(f"拓扑类型: {config.topology}, 节点数: {config.nodeCount}")
     if config.topology != "full":
         print(f"示例路径:")
-        sample_count = 0
-        for (src, dst), path in shortest_paths.items():
-            if sample_count < 5 and len(path) > 2:  # 只显示多跳路径
-                print(f"  节点{src}→节点{dst}: {' → '.join(map(str, path))} (跳数: {len(path)-1})")
-                sample_count += 1
-    print(f"总路径数: {len(shortest_paths)}")
+        import numpy as np
+        for src, dst in np.argwhere(oracle["dist"] > 1)[:5]:  # 只显示多跳路径
+            path = oracle_path(oracle, int(src), int(dst))
+            print(f"  节点{src}→节点{dst}: {' → '.join(map(str, path))} (跳数: {len(path)-1})")
+    print(f"总路径数: {int((oracle['dist'] > 0).sum())}")
     print(f"===================\n")
     
+    # 多路径路由：会话持有路由器本身，拓扑被删除或路由器被 LRU 淘汰后会话仍可继续投递消息
+    router = None
+    if config.routingPaths:
+        router = get_disjoint_path_router(config.nodeCount, config.topology, config.branchCount,
+                                          config.routingPaths, config.routingDisjoint or "node")
+    
     # 将元组键转换为字符串键以支持JSON序列化（但在Python中仍使用元组）
     # 注意：这里不需要转换，因为session不会被JSON序列化，保持为字典
     
@@ -120,7 +211,8 @@ def create_session(config: SessionConfig) -> SessionInfo:
         "node_states": {},
         "consensus_result": None,
         "consensus_history": [],  # 共识历史记录
-        "shortest_paths": shortest_paths,  # 缓存的最短路径
+        "path_oracle": oracle,  # 最短路径（跳数 / 下一跳数组）
+        "disjoint_router": router,  # 多路径路由器（未配置 routingPaths 时为 None）
         "created_at": datetime.now().isoformat()
     }
     
@@ -150,7 +242,9 @@ def create_session(config: SessionConfig) -> SessionInfo:
             "proposalContent": config.proposalContent,
             "maliciousProposer": config.maliciousProposer,
             "allowTampering": config.allowTampering,
-            "messageDeliveryRate": config.messageDeliveryRate
+            "messageDeliveryRate": config.messageDeliveryRate,
+            "routingPaths": config.routingPaths,
+            "routingDisjoint": config.routingDisjoint
         },
         "status": "waiting",
         "createdAt": session["created_at"]
@@ -159,10 +253,22 @@ def create_session(config: SessionConfig) -> SessionInfo:
 def get_session(session_id: str) -> Optional[Dict[str, Any]]:
     return sessions.get(session_id)
 
+def get_custom_topology(topology: str) -> Optional[Dict[str, Any]]:
+    """拓扑名为 "custom:<id>" 时返回注册的自定义拓扑，内置拓扑返回 None，id 不存在时抛出 ValueError"""
+    if not isinstance(topology, str) or not topology.startswith("custom:"):
+        return None
+    record = custom_topologies.get(topology[len("custom:"):])
+    if record is None:
+        raise ValueError(f"自定义拓扑 {topology} 不存在")
+    return record
+
 def is_direct_connection(i: int, j: int, n: int, topology: str, n_value: int) -> bool:
     """检查两个节点之间是否有直接物理连接（边）"""
     if i == j:
         return False
+    record = get_custom_topology(topology)
+    if record is not None:
+        return bool(record["graph"][i, j] != 0)
     if topology == "full":
         return True
     elif topology == "ring":
@@ -179,47 +285,287 @@ def is_direct_connection(i: int, j: int, n: int, topology: str, n_value: int) ->
         return (i == parent_of_j and j < n) or (j == parent_of_i and i < n)
     return False
 
-def calculate_shortest_paths(n: int, topology: str, n_value: int) -> Dict[tuple, List[int]]:
-    """使用Floyd-Warshall算法计算所有节点对之间的最短路径
+def expand_shortest_path_tree(predecessors):
+    """由全源前驱矩阵得到跳数和第一跳（指针跳跃 / 列表排名，O(n² log 直径)）
     
-    返回: {(src, dst): [path]} 例如 {(0, 2): [0, 1, 2]} 表示从0到2的路径是0→1→2
+    jump[s, j] 初始为 j 的前驱，每一轮同时令 hops += hops[s, jump]、first = first[s, jump]、jump = jump[s, jump]，
+    跳到源点 s 即停止；first[s, j] 最终是路径上紧挨着 s 的节点。环形拓扑的直径约为 n/2，逐层展开需要 n/2 轮。
+    
+    Args:
+        predecessors: (n, n) 前驱矩阵（scipy.sparse.csgraph 格式，不可达/对角线为负数）
+    
+    Returns:
+        (dist int16（不可达为 -1）, next_hop int32（不可达/对角线为 -1）)
     """
-    # 初始化距离矩阵和路径矩阵
-    INF = float('inf')
-    dist = [[INF] * n for _ in range(n)]
-    next_node = [[None] * n for _ in range(n)]
+    import numpy as np
     
-    # 初始化：自己到自己距离为0，直接连接的边距离为1
-    for i in range(n):
-        dist[i][i] = 0
-        for j in range(n):
-            if i != j and is_direct_connection(i, j, n, topology, n_value):
-                dist[i][j] = 1
-                next_node[i][j] = j
+    n = len(predecessors)
+    sources = np.broadcast_to(np.arange(n)[:, None], (n, n))
+    reachable = predecessors >= 0
+    jump = np.where(reachable, predecessors, sources)
+    hops = reachable.astype(np.int32)
+    first = np.where(reachable, np.arange(n)[None, :], -1).astype(np.int32)
+    active = reachable & (jump != sources)
+    while True:
+        rows, cols = np.nonzero(active)
+        if len(rows) == 0:
+            break
+        parents = jump[rows, cols]
+        hops[rows, cols] += hops[rows, parents]
+        first[rows, cols] = first[rows, parents]
+        jump[rows, cols] = jump[rows, parents]
+        active[rows, cols] = jump[rows, cols] != rows
     
-    # Floyd-Warshall算法
-    for k in range(n):
-        for i in range(n):
-            for j in range(n):
-                if dist[i][k] + dist[k][j] < dist[i][j]:
-                    dist[i][j] = dist[i][k] + dist[k][j]
-                    next_node[i][j] = next_node[i][k]
+    dist = np.where(reachable, hops, -1).astype(np.int16)
+    np.fill_diagonal(dist, 0)
+    return dist, first
+
+def get_path_oracle(n: int, topology: str, n_value: int) -> Dict[str, Any]:
+    """路径预言机：每个拓扑只计算一次全源最短路径，之后的路径查询都是数组下标
     
-    # 重建路径
-    paths = {}
-    for i in range(n):
-        for j in range(n):
-            if i != j and dist[i][j] < INF:
-                path = [i]
-                current = i
-                while current != j:
-                    current = next_node[current][j]
-                    if current is None:
-                        break
-                    path.append(current)
-                if current == j:
-                    paths[(i, j)] = path
+    无权图用 scipy.sparse.csgraph 的逐源 BFS（shortest_path(unweighted=True)）一次得到全源前驱矩阵，
+    带链路可靠度的自定义拓扑改为取最可靠路径（代价 -log(w) 上的 Dijkstra）；
+    再由 expand_shortest_path_tree 向量化地展开为跳数和第一跳，取代原先纯 Python 的 O(n³) Floyd-Warshall。
+    结果按 (n, topology, n_value) 缓存在 path_oracle_cache 中（LRU），数组只读，可在会话之间共享。
+    
+    Returns:
+        {
+            'dist': (n, n) int16，跳数，不可达为 -1（对角线为 0）,
+            'next_hop': (n, n) int32，从 i 到 j 的路径上 i 之后的第一个节点，不可达/对角线为 -1,
+            'graph': CSR 图（build_topology_graph）, 'weighted': 是否带链路可靠度,
+            'path_reliability': 带权时为 (n, n) 路径可靠度（不可达为 0），否则为 None
+        }
+    """
+    import numpy as np
+    from scipy.sparse.csgraph import dijkstra, shortest_path
+    
+    key = (int(n), topology, int(n_value))
+    cached = path_oracle_cache.get(key)
+    if cached is not None:
+        path_oracle_cache.move_to_end(key)
+        return cached
+    
+    graph = build_topology_graph(n, topology, n_value)
+    record = get_custom_topology(topology)
+    weighted = bool(record is not None and record["weighted"])
+    path_reliability = None
+    if weighted:
+        # 可靠度为 1 的链路取极小的正代价，避免等代价的环
+        cost = graph.copy()
+        cost.data = np.maximum(-np.log(cost.data), 1e-12)
+        costs, predecessors = dijkstra(cost, directed=True, return_predecessors=True)
+        path_reliability = np.where(np.isfinite(costs), np.exp(-costs), 0.0)
+        np.fill_diagonal(path_reliability, 1.0)
+        path_reliability.setflags(write=False)
+    else:
+        _, predecessors = shortest_path(graph, directed=True, unweighted=True, return_predecessors=True)
+    dist, next_hop = expand_shortest_path_tree(predecessors)
+    
+    dist.setflags(write=False)
+    next_hop.setflags(write=False)
+    oracle = {'dist': dist, 'next_hop': next_hop, 'graph': graph, 'weighted': weighted,
+              'path_reliability': path_reliability}
+    path_oracle_cache[key] = oracle
+    while len(path_oracle_cache) > PATH_ORACLE_CACHE_SIZE:
+        path_oracle_cache.popitem(last=False)
+    return oracle
+
+def oracle_path(oracle: Dict[str, Any], src: int, dst: int) -> Optional[List[int]]:
+    """沿 next_hop 还原 src 到 dst 的最短路径节点列表，不可达时返回 None"""
+    if src == dst:
+        return [src]
+    next_hop = oracle['next_hop']
+    if next_hop[src, dst] < 0:
+        return None
+    path = [src]
+    current = src
+    while current != dst:
+        current = int(next_hop[current, dst])
+        path.append(current)
+    return path
+
+def calculate_shortest_paths(n: int, topology: str, n_value: int) -> Dict[tuple, List[int]]:
+    """所有可达节点对之间的最短路径（由 get_path_oracle 展开）
+    
+    返回: {(src, dst): [path]} 例如 {(0, 2): [0, 1, 2]} 表示从0到2的路径是0→1→2
+    只需要查询个别节点对时直接用 get_path_oracle / oracle_path，避免构造 O(n²) 个列表。
+    """
+    import numpy as np
     
+    oracle = get_path_oracle(n, topology, n_value)
+    return {(int(i), int(j)): oracle_path(oracle, int(i), int(j)) for i, j in np.argwhere(oracle['dist'] > 0)}
+
+def get_disjoint_path_router(n: int, topology: str, n_value: int, k: int, mode: str = "node") -> Dict[str, Any]:
+    """多路径路由器：任意拓扑上每对节点最多 k 条节点不相交（mode="node"）或边不相交（mode="edge"）的路径
+
+    路由器按 (n, topology, n_value, k, mode) 缓存在 disjoint_path_cache 中（LRU），
+    只保存残量网络模板，节点对的路径由 disjoint_paths 在首次查询时计算并记在路由器的 pairs 中。
+    无权图的链路代价为 1（总跳数最少），带链路可靠度的自定义拓扑为 -log(w)（各路径可靠度之积最大）。
+
+    Raises:
+        ValueError: k 不是正整数、mode 不合法，或自定义拓扑不存在/节点数不一致
+    """
+    import numpy as np
+
+    if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+        raise ValueError("路径数 k 必须为正整数")
+    if mode not in DISJOINT_MODES:
+        raise ValueError(f"不相交方式只能是 {'、'.join(DISJOINT_MODES)}")
+    key = (int(n), topology, int(n_value), k, mode)
+    cached = disjoint_path_cache.get(key)
+    if cached is not None:
+        disjoint_path_cache.move_to_end(key)
+        return cached
+
+    graph = build_topology_graph(n, topology, n_value)
+    record = get_custom_topology(topology)
+    weighted = bool(record is not None and record["weighted"])
+    costs = np.maximum(-np.log(graph.data), 1e-12) if weighted else np.ones(graph.nnz)
+    # 残量网络模板（所有节点对共用，查询时只复制容量）：弧 a 与反向弧 a ^ 1 成对存放，
+    # 节点不相交时节点 v 拆成入点 v 和出点 v + n，链路为 u 出点 → v 入点
+    split = mode == "node"
+    num_nodes = 2 * n if split else n
+    head = [[] for _ in range(num_nodes)]
+    arc_to, arc_cap, arc_cost = [], [], []
+
+    def add_arc(u, v, cost):
+        head[u].append(len(arc_to))
+        arc_to.extend([v, u])
+        arc_cap.extend([1, 0])
+        arc_cost.extend([cost, -cost])
+        head[v].append(len(arc_to) - 1)
+
+    rows = np.repeat(np.arange(n), np.diff(graph.indptr))
+    for u, v, cost in zip(rows.tolist(), graph.indices.tolist(), costs.tolist()):
+        add_arc(u + n if split else u, v, cost)
+    if split:
+        for v in range(n):
+            add_arc(v, v + n, 0.0)
+    router = {'n': int(n), 'k': k, 'mode': mode, 'graph': graph, 'weighted': weighted,
+              'symmetric': bool((graph != graph.T).nnz == 0), 'num_nodes': num_nodes,
+              'head': head, 'arc_to': arc_to, 'arc_cap': arc_cap, 'arc_cost': arc_cost, 'pairs': {}}
+    disjoint_path_cache[key] = router
+    while len(disjoint_path_cache) > DISJOINT_PATH_CACHE_SIZE:
+        disjoint_path_cache.popitem(last=False)
+    return router
+
+def residual_dijkstra(router: Dict[str, Any], arc_cap: List[int], potential: List[float], source: int,
+                      sink: Optional[int] = None):
+    """残量网络上按约化代价 cost + π(u) - π(v) 的 Dijkstra，sink 出堆即停止（sink=None 时算完全部节点）
+
+    Returns:
+        (dist, parent_arc, touched)：touched 为所有被松弛过的节点
+    """
+    import heapq
+
+    head, arc_to, arc_cost = router['head'], router['arc_to'], router['arc_cost']
+    inf = float('inf')
+    dist = [inf] * router['num_nodes']
+    parent_arc = [-1] * router['num_nodes']
+    dist[source] = 0.0
+    touched = [source]
+    heap = [(0.0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if u == sink:
+            break
+        for a in head[u]:
+            if arc_cap[a] == 0:
+                continue
+            v = arc_to[a]
+            nd = d + arc_cost[a] + potential[u] - potential[v]
+            if nd < dist[v] - 1e-15:
+                if dist[v] == inf:
+                    touched.append(v)
+                dist[v] = nd
+                parent_arc[v] = a
+                heapq.heappush(heap, (nd, v))
+    return dist, parent_arc, touched
+
+def disjoint_path_source_tree(router: Dict[str, Any], src: int):
+    """src 的全源最短路径树（第一次增广），同一源点的所有目标节点共用，见 disjoint_paths"""
+    source = src + router['n'] if router['mode'] == "node" else src
+    dist, parent_arc, _ = residual_dijkstra(router, router['arc_cap'], [0.0] * router['num_nodes'], source)
+    return dist, parent_arc
+
+def disjoint_paths(router: Dict[str, Any], src: int, dst: int, source_tree=None) -> List[List[int]]:
+    """src 到 dst 的不相交路径（按代价从小到大，不可达时为空列表），结果记在 router['pairs'] 中
+
+    连续最短增广路（Suurballe 算法推广到 k 条路径）：单位容量网络上做 k 次最小费用增广，
+    每次在残量网络上用带势能的 Dijkstra（约化代价非负）找最短增广路，得到总代价最小的 k 条不相交路径，
+    再沿有流量的弧分解成路径。节点不相交时从 src 出点到 dst 入点增广，中间节点的 入点→出点 容量为 1；
+    边不相交时直接在原图上计算。连通度不足 k 时返回最大数量的不相交路径（如树形拓扑只有 1 条）。
+    
+    source_tree 为 disjoint_path_source_tree(router, src) 的结果时，第一次增广直接沿这棵最短路径树进行，
+    并以树上的距离作为势能（逐源计算全部节点对时每对少一次 Dijkstra）。
+    """
+    src, dst = int(src), int(dst)
+    if src == dst:
+        return [[src]]
+    pairs = router['pairs']
+    cached = pairs.get((src, dst))
+    if cached is not None:
+        return cached
+
+    n = router['n']
+    split = router['mode'] == "node"
+    arc_to = router['arc_to']
+    arc_cap = list(router['arc_cap'])
+    source = src + n if split else src
+    sink = dst
+
+    inf = float('inf')
+    potential = [0.0] * router['num_nodes']
+    augmented = set()
+    for step in range(router['k']):
+        if step == 0 and source_tree is not None:
+            dist, parent_arc = source_tree
+            d_sink = dist[sink]
+            if d_sink != inf:
+                potential = [d if d != inf else 0.0 for d in dist]  # 不可达的节点在残量网络中仍不可达
+        else:
+            dist, parent_arc, touched = residual_dijkstra(router, arc_cap, potential, source, sink)
+            d_sink = dist[sink]
+            if d_sink != inf:
+                # 势能取 min(dist, dist[sink])（再整体减去常数 dist[sink]），只有距离小于 dist[sink] 的节点需要更新
+                for v in touched:
+                    if dist[v] < d_sink:
+                        potential[v] += dist[v] - d_sink
+        if d_sink == inf:
+            break
+        v = sink
+        while v != source:
+            a = parent_arc[v]
+            arc_cap[a] -= 1
+            arc_cap[a ^ 1] += 1
+            augmented.add(a & ~1)
+            v = arc_to[a ^ 1]
+
+    # 流量分解：增广过的正向弧（偶数下标）残量为 0 即有 1 单位流量
+    flow_arcs = {}
+    for a in augmented:
+        if arc_cap[a] == 0:
+            flow_arcs.setdefault(arc_to[a ^ 1], []).append(a)
+    arc_cost = router['arc_cost']
+    costed_paths = []
+    while flow_arcs.get(source):
+        path, cost = [src], 0.0
+        u = source
+        while u != sink:
+            a = flow_arcs[u].pop()
+            cost += arc_cost[a]
+            u = arc_to[a]
+            path.append(u)
+            if split and u != dst:
+                u += n  # 入点 → 出点，同一节点
+        costed_paths.append((cost, path))
+
+    paths = [path for _, path in sorted(costed_paths)]
+    pairs[(src, dst)] = paths
+    if router['symmetric']:
+        pairs[(dst, src)] = [path[::-1] for path in paths]
     return paths
 
 def is_connection_allowed(i: int, j: int, n: int, topology: str, n_value: int) -> bool:
@@ -229,9 +575,8 @@ def is_connection_allowed(i: int, j: int, n: int, topology: str, n_value: int) -
     """
     if i == j:
         return False
-    # 计算路径（会被缓存在session中）
-    paths = calculate_shortest_paths(n, topology, n_value)
-    return (i, j) in paths
+    # 路径预言机按拓扑缓存，查询为 O(1)
+    return bool(get_path_oracle(n, topology, n_value)['dist'][i, j] > 0)
 
 def is_honest(node_id: int, n: int, m: int, faulty_proposer: bool, proposer_id: int = 0) -> bool:
     """判断节点是否为诚实节点
@@ -254,13 +599,14 @@ def is_honest(node_id: int, n: int, m: int, faulty_proposer: bool, proposer_id:
             return True
         return node_id < n - m
 
-def try_path(session_id: str, path: list, delivery_rate: float) -> bool:
+def try_path(session_id: str, path: list, delivery_rate: float, link_graph=None) -> bool:
     """尝试通过指定路径发送消息
     
     Args:
         session_id: 会话ID
         path: 路径列表，如 [0, 1, 2] 表示 0→1→2
         delivery_rate: 链路可靠性（百分比）
+        link_graph: 带链路可靠度的自定义拓扑（CSR），给定时每一跳使用边上的可靠度
     
     Returns:
         bool: 路径是否成功
@@ -271,7 +617,7 @@ def try_path(session_id: str, path: list, delivery_rate: float) -> bool:
         hop_to = path[i + 1]
         
         # 检查节点级别配置
-        hop_reliability = delivery_rate
+        hop_reliability = delivery_rate if link_graph is None else float(link_graph[hop_from, hop_to]) * 100
         if session_id in node_reliability:
             if hop_from in node_reliability[session_id]:
                 if hop_to in node_reliability[session_id][hop_from]:
@@ -320,6 +666,8 @@ def should_deliver_message(session_id: str, from_node: int = None, to_node: int
     
     路由策略：
     - 自定义矩阵：直接使用矩阵中的概率
+    - 会话配置了 routingPaths=k（多路径路由，任意拓扑）：最多 k 条不相交路径（会话创建时取得的路由器），
+      每条路径独立尝试，至少一条成功即可
     - 星形拓扑：使用最短路径（1条）
     - 环形拓扑：
       * 相邻节点：使用最短路径（1条）
@@ -335,6 +683,11 @@ def should_deliver_message(session_id: str, from_node: int = None, to_node: int
     if not session:
         return True
     
+    # 节点掉线模式（批量实验）：本轮离线的节点既不发送也不接收
+    offline_nodes = session.get("offline_nodes")
+    if offline_nodes and (from_node in offline_nodes or to_node in offline_nodes):
+        return False
+    
     # 如果没有指定from_node和to_node，使用全局配置
     if from_node is None or to_node is None:
         delivery_rate = session["config"].get("messageDeliveryRate", 100)
@@ -354,6 +707,23 @@ def should_deliver_message(session_id: str, from_node: int = None, to_node: int
     n = config["nodeCount"]
     delivery_rate = config.get("messageDeliveryRate", 100)
     
+    # 多路径路由：k 条不相交路径，至少一条成功
+    router = session.get("disjoint_router")
+    if router is not None:
+        paths = disjoint_paths(router, int(from_node), int(to_node))
+        if not paths:
+            print(f"⚠️  节点{from_node}到节点{to_node}不可达")
+            return False
+        link_graph = router["graph"] if router["weighted"] else None
+        succeeded = [try_path(session_id, path, delivery_rate, link_graph) for path in paths]
+        success = any(succeeded)
+        if len(paths) > 1 or len(paths[0]) > 2:
+            if success:
+                print(f"  ✅ 多路径成功: {from_node}→{to_node} ({sum(succeeded)}/{len(paths)} 条路径成功)")
+            else:
+                print(f"  ❌ 多路径失败: {from_node}→{to_node} ({len(paths)} 条路径都失败)")
+        return success
+    
     # 全连接拓扑：直接通信
     if topology == "full":
         if delivery_rate >= 100:
@@ -389,16 +759,15 @@ def should_deliver_message(session_id: str, from_node: int = None, to_node: int
             
             return success
     
-    # 其他拓扑（星形、树形等）：使用最短路径
-    shortest_paths = session.get("shortest_paths", {})
-    path_key = (int(from_node), int(to_node))
+    # 其他拓扑（星形、树形、自定义拓扑等）：使用最短路径（带链路可靠度时为最可靠路径）
+    oracle = session.get("path_oracle") or get_path_oracle(n, topology, config.get("branchCount", 2))
+    path = oracle_path(oracle, int(from_node), int(to_node))
     
-    if path_key not in shortest_paths:
+    if path is None:
         print(f"⚠️  节点{from_node}到节点{to_node}不可达")
         return False
     
-    path = shortest_paths[path_key]
-    success = try_path(session_id, path, delivery_rate)
+    success = try_path(session_id, path, delivery_rate, oracle["graph"] if oracle["weighted"] else None)
     
     if success and len(path) > 2:
         print(f"  ✅ 多跳成功: {from_node}→{to_node} 路径{path}")
@@ -417,15 +786,15 @@ def calculate_effective_reliability(n: int, topology: str, n_value: int, p: floa
     }
     """
     # 计算最短路径
-    paths = calculate_shortest_paths(n, topology, n_value)
+    dist = get_path_oracle(n, topology, n_value)['dist']
+    hop_counts = dist[dist > 0]
     
-    if not paths:
+    if len(hop_counts) == 0:
         return {'avg_hops': 1.0, 'p_effective': p, 'max_hops': 1}
     
     # 统计跳数
-    hop_counts = [len(path) - 1 for path in paths.values()]
-    avg_hops = sum(hop_counts) / len(hop_counts)
-    max_hops = max(hop_counts)
+    avg_hops = float(hop_counts.mean())
+    max_hops = int(hop_counts.max())
     
     # 有效传输概率：p^(平均跳数)
     p_effective = p ** avg_hops
@@ -436,26 +805,245 @@ def calculate_effective_reliability(n: int, topology: str, n_value: int, p: floa
         'max_hops': max_hops
     }
 
+def build_topology_graph(n: int, topology: str, n_value: int):
+    """拓扑的 CSR 稀疏图，graph[i, j] 为 i→j 链路的权重（内置拓扑与无权自定义拓扑为 1）
+    
+    内置拓扑直接按规则生成边表，O(边数)，不再对 n² 个节点对逐一调用 is_direct_connection。
+    
+    Raises:
+        ValueError: 自定义拓扑不存在或节点数不一致
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    
+    record = get_custom_topology(topology)
+    if record is not None:
+        if record["n"] != n:
+            raise ValueError(f"自定义拓扑 {topology} 有 {record['n']} 个节点，与 nodeCount={n} 不一致")
+        return record["graph"]
+    
+    nodes = np.arange(n)
+    if topology == "full":
+        rows, cols = np.nonzero(~np.eye(n, dtype=bool))
+    elif topology == "ring":
+        rows = np.concatenate([nodes, nodes])
+        cols = np.concatenate([(nodes + 1) % n, (nodes - 1) % n])
+    elif topology == "star":
+        rows = np.concatenate([np.zeros(n - 1, dtype=int), nodes[1:]])
+        cols = np.concatenate([nodes[1:], np.zeros(n - 1, dtype=int)])
+    elif topology == "tree":
+        children = nodes[1:]
+        parents = (children - 1) // n_value
+        rows = np.concatenate([parents, children])
+        cols = np.concatenate([children, parents])
+    else:
+        rows = cols = np.zeros(0, dtype=int)
+    keep = rows != cols
+    graph = csr_matrix((np.ones(int(keep.sum())), (rows[keep], cols[keep])), shape=(n, n))
+    graph.sum_duplicates()
+    graph.data[:] = 1.0  # n ≤ 2 的环形拓扑两个方向会重合
+    return graph
+
 def build_adjacency_matrix(n: int, topology: str, n_value: int):
     """构建邻接矩阵
     
     Args:
         n: 节点数
-        topology: 拓扑类型
+        topology: 拓扑类型（内置拓扑或 "custom:<id>"）
         n_value: 分支数（用于树形拓扑）
     
     Returns:
         n×n的邻接矩阵，A[i][j]=1表示i和j之间有直接连接
     """
+    return (build_topology_graph(n, topology, n_value).toarray() != 0).astype(int)
+
+def generate_random_regular_edges(n: int, degree: int, rng) -> "np.ndarray":
+    """随机 d-正则图（无向、无自环和重边）的边表
+    
+    逐对连接剩余"端点"，只在合法（不成环、不重复）的端点对中随机选择，卡住时重新开始
+    （Steger-Wormald 算法，与配置模型整体拒绝相比，d 较大时也能很快成功）。
+    """
     import numpy as np
-    A = np.zeros((n, n), dtype=int)
     
-    for i in range(n):
-        for j in range(n):
-            if i != j and is_direct_connection(i, j, n, topology, n_value):
-                A[i][j] = 1
+    if not 0 <= degree < n or (n * degree) % 2 != 0:
+        raise ValueError("random-regular 要求 0 ≤ degree < nodeCount 且 nodeCount·degree 为偶数")
+    for _ in range(100):
+        edges = set()
+        stubs = [node for node in range(n) for _ in range(degree)]
+        while stubs:
+            remaining = {}
+            rng.shuffle(stubs)
+            stub_iter = iter(stubs)
+            for u, v in zip(stub_iter, stub_iter):
+                if u > v:
+                    u, v = v, u
+                if u != v and (u, v) not in edges:
+                    edges.add((u, v))
+                else:
+                    remaining[u] = remaining.get(u, 0) + 1
+                    remaining[v] = remaining.get(v, 0) + 1
+            # 剩余端点之间还有合法的配对才继续，否则从头开始
+            if remaining and not any(u != v and (min(u, v), max(u, v)) not in edges
+                                     for u in remaining for v in remaining):
+                break
+            stubs = [node for node, count in remaining.items() for _ in range(count)]
+        else:
+            return np.array(sorted(edges), dtype=int).reshape(-1, 2)
+    raise ValueError("random-regular 生成失败，请调整 degree 或 seed")
+
+def generate_small_world_edges(n: int, k: int, beta: float, rng) -> "np.ndarray":
+    """Watts-Strogatz 小世界图的边表：每个节点连接环上最近的 k 个邻居（每侧 k/2），
+    每条边以概率 beta 把远端重连到随机节点（避免自环和重边）"""
+    import numpy as np
+    
+    if k % 2 != 0 or not 0 < k < n:
+        raise ValueError("small-world 要求 k 为偶数且 0 < k < nodeCount")
+    if not 0 <= beta <= 1:
+        raise ValueError("small-world 要求 0 ≤ beta ≤ 1")
+    edges = {(u, (u + j) % n) for j in range(1, k // 2 + 1) for u in range(n)}
+    neighbors = {u: set() for u in range(n)}
+    for u, v in edges:
+        neighbors[u].add(v)
+        neighbors[v].add(u)
+    for j in range(1, k // 2 + 1):
+        for u in range(n):
+            v = (u + j) % n
+            if rng.random() >= beta or len(neighbors[u]) >= n - 1:
+                continue
+            w = int(rng.integers(n))
+            while w == u or w in neighbors[u]:
+                w = int(rng.integers(n))
+            neighbors[u].discard(v)
+            neighbors[v].discard(u)
+            neighbors[u].add(w)
+            neighbors[w].add(u)
+    return np.array(sorted({(min(u, v), max(u, v)) for u in neighbors for v in neighbors[u]}), dtype=int).reshape(-1, 2)
+
+def generate_scale_free_edges(n: int, m: int, rng) -> "np.ndarray":
+    """Barabási-Albert 无标度图的边表：从 m 个节点开始，每个新节点按度数比例连接 m 个不同的已有节点"""
+    import numpy as np
+    
+    if not 1 <= m < n:
+        raise ValueError("scale-free 要求 1 ≤ m < nodeCount")
+    edges = []
+    repeated = []  # 每个节点按度数重复出现，均匀抽样即按度数比例抽样
+    targets = list(range(m))
+    for source in range(m, n):
+        edges.extend((target, source) for target in targets)
+        repeated.extend(targets)
+        repeated.extend([source] * m)
+        chosen = set()
+        while len(chosen) < m:
+            chosen.add(repeated[int(rng.integers(len(repeated)))])
+        targets = list(chosen)
+    return np.array(edges, dtype=int).reshape(-1, 2)
+
+def register_custom_topology(n: int, edges, weights=None, directed: bool = False,
+                             name: Optional[str] = None, source: str = "edges",
+                             params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """把边表保存为 CSR 稀疏图并注册为自定义拓扑
     
-    return A
+    Args:
+        n: 节点数
+        edges: (E, 2) 边表，节点编号 0..n-1
+        weights: 每条边的链路可靠度 (0, 1]，None 表示无权（链路可靠度使用会话/请求中的 p）
+        directed: False 时每条边双向可用；重复给出的边保留第一次出现的权重
+    
+    Raises:
+        ValueError: 边表不合法
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    
+    edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+    weighted = weights is not None
+    weights = np.ones(len(edges)) if weights is None else np.asarray(weights, dtype=float)
+    if n < 1:
+        raise ValueError("nodeCount 必须为正整数")
+    if len(weights) != len(edges):
+        raise ValueError("weights 与 edges 长度不一致")
+    if len(edges) and (edges.min() < 0 or edges.max() >= n):
+        raise ValueError(f"边的端点必须在 0..{n - 1} 之间")
+    if np.any(edges[:, 0] == edges[:, 1]):
+        raise ValueError("边表中不能有自环")
+    if np.any(~(weights > 0) | (weights > 1)):
+        raise ValueError("链路可靠度必须在 (0, 1] 之间")
+    
+    rows, cols = edges[:, 0], edges[:, 1]
+    if not directed:
+        rows, cols, weights = np.concatenate([rows, cols]), np.concatenate([cols, rows]), np.concatenate([weights, weights])
+    _, first = np.unique(rows * n + cols, return_index=True)
+    graph = csr_matrix((weights[first], (rows[first], cols[first])), shape=(n, n))
+    
+    topology_id = uuid.uuid4().hex[:12]
+    record = {
+        "id": topology_id,
+        "name": name or f"{source}-{topology_id}",
+        "n": int(n),
+        "graph": graph,
+        "directed": bool(directed),
+        "weighted": weighted,
+        "source": source,
+        "params": params or {},
+        "createdAt": datetime.now().isoformat()
+    }
+    remember_custom_topology(record)
+    return record
+
+def remember_custom_topology(record: Dict[str, Any]):
+    """把自定义拓扑记录放入本进程的注册表（LRU，最多 MAX_CUSTOM_TOPOLOGIES 个），淘汰时清除对应缓存"""
+    custom_topologies[record["id"]] = record
+    custom_topologies.move_to_end(record["id"])
+    while len(custom_topologies) > MAX_CUSTOM_TOPOLOGIES:
+        evicted_id, _ = custom_topologies.popitem(last=False)
+        evict_custom_topology_caches(evicted_id)
+
+def evict_custom_topology_caches(topology_id: str):
+    """删除自定义拓扑后清除对应的路径预言机、多路径路由和 P_comm 矩阵缓存"""
+    for key in [key for key in path_oracle_cache if key[1] == f"custom:{topology_id}"]:
+        del path_oracle_cache[key]
+    for key in [key for key in disjoint_path_cache if key[1] == f"custom:{topology_id}"]:
+        del disjoint_path_cache[key]
+    for key in [key for key in pcomm_matrix_cache if key[1] == f"custom:{topology_id}"]:
+        del pcomm_matrix_cache[key]
+
+def summarize_custom_topology(record: Dict[str, Any]) -> Dict[str, Any]:
+    """自定义拓扑的摘要：边数、度数、连通性、直径和平均跳数（来自路径预言机）"""
+    import numpy as np
+    
+    n = record["n"]
+    graph = record["graph"]
+    dist = get_path_oracle(n, f"custom:{record['id']}", 2)['dist']
+    hops = dist[dist > 0]
+    out_degree = np.diff(graph.indptr)
+    return {
+        "topologyId": record["id"],
+        "topology": f"custom:{record['id']}",
+        "name": record["name"],
+        "nodeCount": n,
+        "edgeCount": int(graph.nnz if record["directed"] else graph.nnz // 2),
+        "directed": record["directed"],
+        "weighted": record["weighted"],
+        "source": record["source"],
+        "params": record["params"],
+        "degree": {"min": int(out_degree.min()), "max": int(out_degree.max()), "mean": float(out_degree.mean())},
+        "connected": bool(len(hops) == n * (n - 1)),  # 有向图为强连通
+        "unreachablePairs": int(n * (n - 1) - len(hops)),
+        "diameter": int(hops.max()) if len(hops) else 0,
+        "avgHops": float(hops.mean()) if len(hops) else 0.0,
+        "createdAt": record["createdAt"]
+    }
+
+def reliability_matrix_from_oracle(oracle: Dict[str, Any], p: float):
+    """按路径预言机的最短路径得到 P_comm：无权图为 p^跳数，带权图为路径可靠度，不可达为 0"""
+    import numpy as np
+    
+    if oracle['weighted']:
+        return np.array(oracle['path_reliability'])
+    dist = oracle['dist']
+    P_comm = np.where(dist > 0, float(p) ** dist.astype(float), 0.0)
+    np.fill_diagonal(P_comm, 1.0)
+    return P_comm
 
 def calculate_comm_reliability_matrix_shortest_path(n: int, topology: str, n_value: int, p: float):
     """计算通信路径可靠性矩阵（正确的路径枚举方法）
@@ -468,6 +1056,7 @@ def calculate_comm_reliability_matrix_shortest_path(n: int, topology: str, n_val
       * 相邻节点：1条路径（1跳），P_comm = p
       * 不相邻节点：2条路径（顺时针+逆时针），P_comm = 1 - (1-p^k1) × (1-p^k2)
     - 其他拓扑：使用最短路径，P_comm = p^k
+    - 带链路可靠度的自定义拓扑：最可靠路径上各链路可靠度之积（忽略 p）
     
     Args:
         n: 节点数
@@ -522,25 +1111,12 @@ def calculate_comm_reliability_matrix_shortest_path(n: int, topology: str, n_val
                     P_comm[i,j] = p ** 2
     
     else:
-        # 其他拓扑：使用最短路径
-        shortest_paths = calculate_shortest_paths(n, topology, n_value)
-        
-        for i in range(n):
-            for j in range(n):
-                if i == j:
-                    continue
-                
-                path_key = (i, j)
-                if path_key in shortest_paths:
-                    path = shortest_paths[path_key]
-                    path_length = len(path) - 1
-                    P_comm[i, j] = p ** path_length
-                else:
-                    P_comm[i, j] = 0.0
+        # 其他拓扑：使用最短路径，P_comm = p^跳数，不可达为 0
+        P_comm = reliability_matrix_from_oracle(get_path_oracle(n, topology, n_value), p)
     
     return P_comm
 
-def calculate_comm_reliability_matrix(A, p: float, max_path_length: int = None):
+def calculate_comm_reliability_matrix(A, p: float, max_path_length: int = None, tol: float = 1e-12):
     """使用邻接矩阵幂运算计算通信路径可靠性矩阵（考虑所有路径）
     
     基于论文推导：
@@ -550,63 +1126,497 @@ def calculate_comm_reliability_matrix(A, p: float, max_path_length: int = None):
     4. 所有路径均失败概率：∏[k=1 to n-1] (1 - p^k)^A^k[i,j]
     5. 通信路径可靠性：P_comm(i,j) = 1 - ∏[k=1 to n-1] (1 - p^k)^A^k[i,j]
     
+    在对数域整体向量化：log P_fail += A^k · log1p(-p^k)。A^k 用浮点数计算（整数幂很快溢出），
+    每一步是"稠密 A^k × 稀疏 A"，代价 O(n·边数)；路径数溢出为 inf 时对应的 P_fail 为 0，结果不受影响。
+    提前停止（结果的变化保证 < tol）：
+    - P_fail 随 k 单调不增，所有可达节点对的 P_fail < tol 时，之后的路径最多改变 tol
+    - d·p < 1（d 为最大出度）时，剩余各项之和有几何级数上界 rowsum(A^k)·p^k·(dp/(1-dp))/(1-p)
+    
     注意：此函数考虑所有可能的路径，包括最短路径和绕路。
           在实际系统中，通常只使用最短路径，请使用 calculate_comm_reliability_matrix_shortest_path
     
     Args:
-        A: 邻接矩阵（numpy数组）
+        A: 邻接矩阵（numpy数组或 scipy 稀疏矩阵）
         p: 单链路成功概率
         max_path_length: 最大路径长度（默认为n-1）
+        tol: 提前停止的容差，0 表示总是计算到 max_path_length
     
     Returns:
         通信路径可靠性矩阵 P_comm[i,j]
     """
     import numpy as np
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import shortest_path
     
-    n = A.shape[0]
+    A_sparse = csr_matrix(A, dtype=float)
+    A_sparse.data = (A_sparse.data != 0).astype(float)
+    A_sparse.eliminate_zeros()
+    n = A_sparse.shape[0]
     if max_path_length is None:
         max_path_length = n - 1
     
-    # 初始化通信失败概率矩阵（初始为1，表示必然失败）
-    P_fail = np.ones((n, n))
-    
-    # 对角线元素设为0（自己到自己不需要通信）
-    np.fill_diagonal(P_fail, 0)
+    off_diagonal = ~np.eye(n, dtype=bool)
+    reachable = np.isfinite(shortest_path(A_sparse, directed=True, unweighted=True)) & off_diagonal
+    max_degree = float(np.diff(A_sparse.indptr).max()) if n > 0 else 0.0
+    
+    # 通信失败概率的对数（初始为 0，即必然失败；对角线最后单独处理）
+    log_fail = np.zeros((n, n))
+    # 当前的邻接矩阵幂（A^k），浮点数
+    A_power = A_sparse.toarray()
+    
+    steps = 0
+    with np.errstate(over="ignore", invalid="ignore"):
+        for k in range(1, max_path_length + 1):
+            steps = k
+            p_k = p ** k
+            if p_k == 0.0:
+                break  # 更长的路径成功概率下溢为 0，不再有贡献
+            # 所有长度为k的路径均失败的概率：(1 - p^k)^N_ij(k)，累加到对数域
+            log_fail += np.where(A_power > 0, A_power * np.log1p(-p_k), 0.0)
+            
+            if tol > 0 and k < max_path_length:
+                fail = np.exp(log_fail[reachable])
+                if fail.size == 0 or fail.max() < tol:
+                    break
+                if max_degree * p < 1:
+                    tail = A_power.sum(axis=1) * p_k * (max_degree * p / (1 - max_degree * p)) / (1 - p)
+                    if np.max(np.exp(log_fail) * tail[:, None], where=reachable, initial=0.0) < tol:
+                        break
+            
+            # 计算A^(k+1) = A^k * A（稠密 × 稀疏）
+            if k < max_path_length:
+                A_power = np.asarray(A_power @ A_sparse)
     
-    # 当前的邻接矩阵幂（A^k）
-    A_power = A.copy()
+    # 通信路径可靠性 = 1 - 失败概率（对角线的失败概率为 0）
+    P_comm = np.where(off_diagonal, 0.0 - np.expm1(log_fail), 1.0)
+    print(f"全路径可靠度矩阵: n={n}, p={p}, 计算了 {steps}/{max_path_length} 种路径长度")
+    return P_comm
+
+def calculate_comm_reliability_matrix_all_paths(n: int, topology: str, n_value: int, p: float):
+    """按拓扑计算"所有路径"模型的 P_comm（见 calculate_comm_reliability_matrix）
     
-    # 遍历所有可能的路径长度k = 1, 2, ..., n-1
-    for k in range(1, max_path_length + 1):
-        # 单条长度为k的路径成功概率
-        p_k = p ** k
-        
-        # 对每个节点对(i,j)
-        for i in range(n):
-            for j in range(n):
-                if i == j:
+    Raises:
+        ValueError: 带链路可靠度的自定义拓扑（路径数模型要求所有链路可靠度相同）
+    """
+    record = get_custom_topology(topology)
+    if record is not None and record["weighted"]:
+        raise ValueError("all-paths 模型只支持无权拓扑")
+    return calculate_comm_reliability_matrix(build_topology_graph(n, topology, n_value), p)
+
+def disjoint_path_success_prob(router: Dict[str, Any], paths: List[List[int]], p: float) -> float:
+    """一组不相交路径中至少一条成功的概率（精确值）
+
+    不相交路径没有公共链路，链路独立失效时各路径独立：P = 1 - ∏(1 - ∏ 路径上各链路可靠度)，
+    无权图每条链路可靠度为 p，带链路可靠度的自定义拓扑取边上的可靠度。
+    """
+    graph = router['graph']
+    fail = 1.0
+    for path in paths:
+        if router['weighted']:
+            success = 1.0
+            for a, b in zip(path, path[1:]):
+                success *= float(graph[a, b])
+        else:
+            success = p ** (len(path) - 1)
+        fail *= 1.0 - success
+    return 1.0 - fail
+
+def calculate_comm_reliability_matrix_disjoint_paths(n: int, topology: str, n_value: int, p: float,
+                                                     k: int = 2, mode: str = "node"):
+    """多路径路由模型的 P_comm：每对节点取最多 k 条不相交路径（get_disjoint_path_router），任一条成功即送达
+
+    与会话中 routingPaths=k、routingDisjoint=mode 的消息投递模型一致。
+    环形拓扑 k=2 时不相邻节点就是原来的顺时针 + 逆时针两条路径（相邻节点也多了绕环一周的备用路径）。
+    需要计算全部 n(n-1) 个节点对（对称图只算一半），每对 O(k·边数·log n)，结果随路由器缓存。
+
+    Raises:
+        ValueError: 参数不合法或自定义拓扑不存在/节点数不一致
+    """
+    import numpy as np
+    import time
+
+    start = time.perf_counter()
+    router = get_disjoint_path_router(n, topology, n_value, k, mode)
+    pairs = router['pairs']
+    P_comm = np.eye(n)
+    for i in range(n):
+        source_tree = None
+        for j in range(n):
+            if i == j:
+                continue
+            if (i, j) not in pairs and source_tree is None:
+                source_tree = disjoint_path_source_tree(router, i)
+            P_comm[i, j] = disjoint_path_success_prob(router, disjoint_paths(router, i, j, source_tree), p)
+    print(f"不相交路径可靠度矩阵: n={n}, 拓扑={topology}, k={k}, 方式={mode}, "
+          f"耗时 {time.perf_counter() - start:.2f}s")
+    return P_comm
+
+def biconnected_components(adj: Dict[int, Dict[int, float]]) -> List[List[Tuple[int, int]]]:
+    """无向简单图的双连通分量（块），每个块为边列表；迭代版 Tarjan 算法，O(边数)"""
+    index, low = {}, {}
+    components, edge_stack = [], []
+    counter = 0
+    for root in adj:
+        if root in index:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack = [(root, None, iter(adj[root]))]
+        while stack:
+            u, parent, neighbors = stack[-1]
+            advanced = False
+            for v in neighbors:
+                if v == parent:
                     continue
-                
-                # 长度为k的路径数量
-                N_ij_k = A_power[i, j]
-                
-                if N_ij_k > 0:
-                    # 所有长度为k的路径均失败的概率：(1 - p^k)^N_ij(k)
-                    fail_prob_k = (1 - p_k) ** N_ij_k
-                    
-                    # 累乘到总失败概率
-                    P_fail[i, j] *= fail_prob_k
-        
-        # 计算A^(k+1) = A^k * A
-        if k < max_path_length:
-            A_power = np.matmul(A_power, A)
-    
-    # 通信路径可靠性 = 1 - 失败概率
-    P_comm = 1 - P_fail
-    
+                if v not in index:
+                    edge_stack.append((u, v))
+                    index[v] = low[v] = counter
+                    counter += 1
+                    stack.append((v, u, iter(adj[v])))
+                    advanced = True
+                    break
+                if index[v] < index[u]:
+                    edge_stack.append((u, v))
+                    low[u] = min(low[u], index[v])
+            if advanced:
+                continue
+            stack.pop()
+            if stack:
+                parent = stack[-1][0]
+                low[parent] = min(low[parent], low[u])
+                if low[u] >= index[parent]:
+                    component = []
+                    while True:
+                        edge = edge_stack.pop()
+                        component.append(edge)
+                        if edge == (parent, u):
+                            break
+                    components.append(component)
+    return components
+
+def frontier_source_reliability(edges: List[Tuple[int, int, float]], s: int,
+                                max_states: int = TWO_TERMINAL_MAX_STATES) -> Tuple[Dict[int, float], int]:
+    """前沿 BDD（frontier-based search）：链路独立失效时 s 与图中每个节点连通的概率（一次计算所有目标节点）
+
+    链路按从 s 出发的贪心顶点顺序（每次加入使前沿最窄的节点，链路在后加入的端点加入时处理）逐条处理。
+    状态只记录"前沿"节点（已出现且还有未处理链路的节点）之间的连通划分，s 所在分量标为 0，其余分量按出现顺序编号；
+    相同划分的状态合并、概率相加（即 BDD 的节点共享），s 的分量不再有前沿节点时该状态结束。
+    - 前向：每个状态的到达概率 F
+    - 后向：G(σ, ℓ) 为从状态 σ 出发，分量 ℓ 最终与 s 的分量合并的概率
+    节点 v 的链路处理完、移出前沿时：已在 s 的分量中则计入 F，否则计入 F·G(下一状态, v 所在分量)，
+    两遍扫描就得到 s 到所有节点的两端可靠度。代价为 链路数 × 每层状态数 × 分量数，
+    状态数只与前沿宽度有关（环、网格、稀疏图很小，完全图随 n 指数增长）。
+
+    Args:
+        edges: 无向链路 [(u, v, 可靠度)]（无重边），图连通
+        s: 源节点
+        max_states: 各层状态数之和的上限
+
+    Returns:
+        ({节点: 与 s 连通的概率}, 各层状态数之和)
+
+    Raises:
+        ValueError: 状态数超过 max_states
+    """
+    neighbors = {}
+    for u, v, _ in edges:
+        neighbors.setdefault(u, set()).add(v)
+        neighbors.setdefault(v, set()).add(u)
+    # 节点顺序：每次加入使"仍有未加入邻居的已加入节点"最少的候选节点（贪心的顶点分隔序）
+    rank = {s: 0}
+    unplaced = {v: len(vs) for v, vs in neighbors.items()}  # 每个节点尚未加入的邻居数
+    for v in neighbors[s]:
+        unplaced[v] -= 1
+    open_count = 1 if unplaced[s] else 0
+    candidates = set(neighbors[s])
+    while candidates:
+        def frontier_after(v):
+            closed = sum(1 for w in neighbors[v] if w in rank and unplaced[w] == 1)
+            return open_count - closed + (1 if unplaced[v] > 0 else 0), unplaced[v], v
+        v = min(candidates, key=frontier_after)
+        open_count = frontier_after(v)[0]
+        rank[v] = len(rank)
+        candidates.discard(v)
+        for w in neighbors[v]:
+            unplaced[w] -= 1
+            if w not in rank:
+                candidates.add(w)
+    edges = sorted(edges, key=lambda e: (max(rank[e[0]], rank[e[1]]), min(rank[e[0]], rank[e[1]])))
+    remaining = {v: len(vs) for v, vs in neighbors.items()}
+
+    # 前向：逐层保存状态的到达概率和转移 (权重, 下一状态（-1 为已结束）, 分量映射, 移出前沿的节点及其分量)，
+    # 分量映射中 0 表示已与 s 的分量合并，-1 表示分量已经消失（不会再与 s 连通）
+    frontier = [s]
+    states = {(0,): 0}
+    masses = [1.0]
+    layers = []
+    total_states = 1
+    for u, v, prob in edges:
+        new_vertices = [w for w in dict.fromkeys((u, v)) if w not in frontier]
+        extended = frontier + new_vertices
+        iu, iv = extended.index(u), extended.index(v)
+        remaining[u] -= 1
+        remaining[v] -= 1
+        retired = [i for i, w in enumerate(extended) if remaining[w] == 0]
+        retired_set = set(retired)
+        next_states, next_masses, transitions = {}, [], []
+        for labels, index in states.items():
+            parts = len(set(labels))
+            labels = list(labels) + list(range(parts, parts + len(new_vertices)))  # 新节点各自成为一个分量
+            branches = []
+            for up, weight in ((False, 1.0 - prob), (True, prob)):
+                if weight == 0.0:
+                    continue
+                merged, drop, keep = labels, None, None
+                if up and labels[iu] != labels[iv]:
+                    keep, drop = min(labels[iu], labels[iv]), max(labels[iu], labels[iv])
+                    merged = [keep if x == drop else x for x in labels]
+                kept = [x for i, x in enumerate(merged) if i not in retired_set]
+                mapping, child = {0: 0}, -1
+                if 0 in kept:
+                    canonical = []
+                    for x in kept:
+                        if x not in mapping:
+                            mapping[x] = len(mapping)
+                        canonical.append(mapping[x])
+                    canonical = tuple(canonical)
+                    child = next_states.get(canonical)
+                    if child is None:
+                        child = next_states[canonical] = len(next_masses)
+                        next_masses.append(0.0)
+                    next_masses[child] += masses[index] * weight
+                label_map = [mapping.get(keep if x == drop else x, -1) for x in range(parts)]
+                retiring = [(extended[i], mapping.get(merged[i], -1)) for i in retired]
+                branches.append((weight, child, label_map, retiring))
+            transitions.append((index, branches))
+        total_states += len(next_masses)
+        if total_states > max_states:
+            raise ValueError(f"精确两端可靠度的前沿状态数超过上限 {TWO_TERMINAL_MAX_STATES}，拓扑过于稠密")
+        layers.append((masses, transitions))
+        frontier = [w for i, w in enumerate(extended) if i not in retired_set]
+        states, masses = next_states, next_masses
+
+    # 后向：G[状态][分量]，最后一层之后所有节点都已移出前沿
+    reliability = {v: 0.0 for v in neighbors}
+    G_next = [[1.0] for _ in masses]
+    for masses, transitions in reversed(layers):
+        G = [None] * len(masses)
+        for index, branches in transitions:
+            values = None
+            for weight, child, label_map, retiring in branches:
+                def joined(c):
+                    if c == 0:
+                        return 1.0
+                    return 0.0 if c < 0 or child < 0 else G_next[child][c]
+                if values is None:
+                    values = [0.0] * len(label_map)
+                for label, c in enumerate(label_map):
+                    values[label] += weight * joined(c)
+                for w, c in retiring:
+                    reliability[w] += masses[index] * weight * joined(c)
+            G[index] = values
+        G_next = G
+    reliability[s] = 1.0
+    return reliability, total_states
+
+def calculate_comm_reliability_matrix_two_terminal(n: int, topology: str, n_value: int, p: float):
+    """精确两端可靠度模型的 P_comm：每条链路独立以 p（带链路可靠度时为边上的可靠度）可用，P_comm[i, j] 为 i、j 连通的概率
+
+    与 all-paths 的"路径数之积"不同，共享链路的路径不再被当作相互独立，结果是精确值。
+    全图先分成双连通块：i 到 j 的可靠度等于块-割点树路径上各块（以割点为端点）的两端可靠度之积。
+    每个块内以每个节点为源各做一次 frontier_source_reliability（一次得到该源到块内所有节点的可靠度），
+    所有节点对共用这些块内结果：树形、星形拓扑的块都是单条链路，环形等稀疏拓扑的前沿很窄；
+    稠密的大块是 #P 难的，状态总数（按每个块第一个源节点的状态数预估）超过 TWO_TERMINAL_MAX_STATES 时抛出 ValueError。
+
+    Raises:
+        ValueError: 有向拓扑、问题过大，或自定义拓扑不存在/节点数不一致
+    """
+    import numpy as np
+    import time
+
+    start = time.perf_counter()
+    graph = build_topology_graph(n, topology, n_value)
+    if (graph != graph.T).nnz:
+        raise ValueError("two-terminal 模型只支持无向拓扑（两个方向的链路可靠度相同）")
+    record = get_custom_topology(topology)
+    weighted = bool(record is not None and record["weighted"])
+    coo = graph.tocoo()
+    adj = {v: {} for v in range(n)}
+    for u, v, w in zip(coo.row.tolist(), coo.col.tolist(), coo.data.tolist()):
+        adj[u][v] = w if weighted else float(p)
+
+    blocks = biconnected_components(adj)
+    vertex_blocks = {v: [] for v in range(n)}
+    block_vertices = []
+    for b, block in enumerate(blocks):
+        members = {v for edge in block for v in edge}
+        block_vertices.append(members)
+        for v in members:
+            vertex_blocks[v].append(b)
+
+    block_sources = {}
+    budget = {"states": TWO_TERMINAL_MAX_STATES}
+
+    def block_reliability(b, a, c):
+        if len(blocks[b]) == 1:
+            return adj[a][c]
+        if (b, a) not in block_sources:
+            # 块内第一个源节点只允许用平均份额的状态数，超出即可判断整块算不完
+            first = not any(key[0] == b for key in block_sources)
+            limit = budget["states"] // len(block_vertices[b]) if first else budget["states"]
+            block_sources[(b, a)], used = frontier_source_reliability(
+                [(u, v, adj[u][v]) for u, v in blocks[b]], a, limit
+            )
+            budget["states"] -= used
+            if first and used * (len(block_vertices[b]) - 1) > budget["states"]:
+                raise ValueError(f"精确两端可靠度的前沿状态数预计超过上限 {TWO_TERMINAL_MAX_STATES}，拓扑过于稠密")
+        return block_sources[(b, a)][c]
+
+    P_comm = np.eye(n)
+    for s in range(n):
+        # 在块-割点树上从 s 出发：进入块 b 时已知割点 c 的可靠度，块内其余节点乘上块内两端可靠度
+        reach = {s: 1.0}
+        stack = [(s, b) for b in vertex_blocks[s]]
+        visited = set(vertex_blocks[s])
+        while stack:
+            c, b = stack.pop()
+            for v in block_vertices[b]:
+                if v == c:
+                    continue
+                reach[v] = reach[c] * block_reliability(b, c, v)
+                for other in vertex_blocks[v]:
+                    if other not in visited:
+                        visited.add(other)
+                        stack.append((v, other))
+        for v, prob in reach.items():
+            if v != s:
+                P_comm[s, v] = prob
+    print(f"两端可靠度矩阵: n={n}, 拓扑={topology}, {len(blocks)} 个双连通块, "
+          f"最大块 {max(map(len, blocks), default=0)} 条链路, 耗时 {time.perf_counter() - start:.2f}s")
     return P_comm
 
 
+def poisson_binomial_tail(probs, k_min):
+    """计算独立异质伯努利变量之和 X 满足 X ≥ k_min 的概率（Poisson-binomial 尾概率）
+    
+    使用 O(m·min(k_min, m-k_min)) 动态规划代替子集枚举：
+    dp[c] 表示处理完前若干个变量后成功数恰为 c 的概率，c = k_min 为"≥k_min"吸收态。
+    直接累积吸收态而不是计算 1 - P(X < k_min)，避免高可靠度时的相消误差；
+    批量计算且门限接近 m 时改为对失败数做 DP。
+    
+    Args:
+        probs: 每个变量的成功概率。一维数组返回标量；
+               二维数组（每行一组变量）按行批量计算，返回长度为行数的数组
+        k_min: 需要的最小成功数
+    
+    Returns:
+        P(X ≥ k_min)
+    """
+    import numpy as np
+    
+    if not isinstance(probs, np.ndarray) or probs.ndim <= 1:
+        # 单组变量：纯 Python 标量 DP，避免小数组上的 numpy 调用开销
+        probs = [float(p) for p in probs]
+        m = len(probs)
+        if k_min <= 0:
+            return 1.0
+        if k_min > m:
+            return 0.0
+        dp = [1.0] + [0.0] * k_min
+        for p in probs:
+            q = 1.0 - p
+            dp[k_min] += dp[k_min - 1] * p
+            for c in range(k_min - 1, 0, -1):
+                dp[c] = dp[c] * q + dp[c - 1] * p
+            dp[0] *= q
+        return dp[k_min]
+    
+    probs = probs.astype(float, copy=False)
+    batch_shape = probs.shape[:-1]
+    m = probs.shape[-1]
+    
+    if k_min <= 0:
+        return np.ones(batch_shape)
+    if k_min > m:
+        return np.zeros(batch_shape)
+    
+    max_failures = m - k_min
+    if max_failures < k_min:
+        # 门限接近变量个数时改为统计失败数：X ≥ k_min ⟺ 失败数 ≤ m - k_min，状态更少
+        dp = np.zeros(batch_shape + (max_failures + 1,))
+        dp[..., 0] = 1.0
+        for idx in range(m):
+            p = probs[..., idx:idx + 1]
+            dp[..., 1:] = dp[..., 1:] * p + dp[..., :-1] * (1 - p)
+            dp[..., 0] = dp[..., 0] * p[..., 0]
+        return dp.sum(axis=-1)
+    
+    dp = np.zeros(batch_shape + (k_min + 1,))
+    dp[..., 0] = 1.0
+    
+    for idx in range(m):
+        p = probs[..., idx:idx + 1]
+        absorbed = dp[..., k_min] + dp[..., k_min - 1] * p[..., 0]
+        dp[..., 1:k_min] = dp[..., 1:k_min] * (1 - p) + dp[..., 0:k_min - 1] * p
+        dp[..., 0] = dp[..., 0] * (1 - p[..., 0])
+        dp[..., k_min] = absorbed
+    
+    return dp[..., k_min]
+
+def poisson_binomial_tail_with_grad(probs, k_min):
+    """批量计算 Poisson-binomial 尾概率 P(X ≥ k_min) 及其对每个 p_s 的偏导
+    
+    利用恒等式 ∂P(X ≥ k)/∂p_s = P(X_{-s} = k-1)（X_{-s} 为去掉第 s 个变量后的和），
+    用截断到 k-1 的前缀/后缀 PMF 卷积求出所有 s 的留一概率，避免对 PMF 做不稳定的反卷积。
+    
+    Args:
+        probs: (..., m) 数组
+        k_min: 需要的最小成功数
+    
+    Returns:
+        (tail, grad)：tail 形状为 (...)，grad 形状为 (..., m)
+    """
+    import numpy as np
+    
+    probs = np.asarray(probs, dtype=float)
+    batch_shape = probs.shape[:-1]
+    m = probs.shape[-1]
+    if k_min <= 0:
+        return np.ones(batch_shape), np.zeros(probs.shape)
+    if k_min > m:
+        return np.zeros(batch_shape), np.zeros(probs.shape)
+    
+    # prefix[s, ..., c] = P(前 s 个变量之和 = c)，suffix[s, ..., c] = P(第 s 个及之后的变量之和 = c)，c < k_min
+    # 变量维放在最前面，使每一步读写的都是连续内存
+    probs_first = np.ascontiguousarray(np.moveaxis(probs, -1, 0))[..., None]
+    prefix = np.zeros((m + 1,) + batch_shape + (k_min,))
+    suffix = np.zeros((m + 1,) + batch_shape + (k_min,))
+    prefix[0, ..., 0] = 1.0
+    suffix[m, ..., 0] = 1.0
+    for s in range(m):
+        p = probs_first[s]
+        np.multiply(prefix[s], 1 - p, out=prefix[s + 1])
+        prefix[s + 1, ..., 1:] += prefix[s, ..., :-1] * p
+    for s in range(m - 1, -1, -1):
+        p = probs_first[s]
+        np.multiply(suffix[s + 1], 1 - p, out=suffix[s])
+        suffix[s, ..., 1:] += suffix[s + 1, ..., :-1] * p
+    
+    # P(X_{-s} = k-1) = Σ_c prefix[s][c] · suffix[s+1][k-1-c]
+    grad = np.moveaxis(np.einsum('s...c,s...c->s...', prefix[:m], suffix[1:, ..., ::-1]), 0, -1)
+    tail = poisson_binomial_tail(probs, k_min) if probs.ndim > 1 else poisson_binomial_tail(probs[None, :], k_min)[0]
+    return tail, grad
+
+def leave_one_out_products(factors):
+    """沿最后一维计算"除自己外所有因子之积"，用前缀/后缀累乘避免除以 0"""
+    import numpy as np
+    
+    factors = np.asarray(factors, dtype=float)
+    ones = np.ones(factors.shape[:-1] + (1,))
+    prefix = np.cumprod(np.concatenate([ones, factors[..., :-1]], axis=-1), axis=-1)
+    suffix = np.cumprod(np.concatenate([ones, factors[..., :0:-1]], axis=-1), axis=-1)[..., ::-1]
+    return prefix * suffix
+
 def calc_exact_receive_k_prob(senders, target, k_min, P_comm):
     """计算目标节点从发送者集合中至少收到k_min条消息的概率
     
@@ -619,8 +1629,6 @@ def calc_exact_receive_k_prob(senders, target, k_min, P_comm):
     Returns:
         至少收到k_min条消息的概率
     """
-    from itertools import combinations
-    
     # 过滤掉目标节点自己（不能给自己发消息）
     valid_senders = [s for s in senders if s != target]
     
@@ -629,542 +1637,1647 @@ def calc_exact_receive_k_prob(senders, target, k_min, P_comm):
     if k_min > len(valid_senders):
         return 0.0
     
-    total_prob = 0.0
-    
-    # 枚举所有可能收到消息的子集，大小>=k_min
-    for k in range(k_min, len(valid_senders) + 1):
-        for subset in combinations(valid_senders, k):
-            # 计算这个子集的概率：subset中的节点成功发送，其余节点失败
-            prob = 1.0
-            for sender in valid_senders:
-                if sender in subset:
-                    # 成功发送
-                    prob *= P_comm[sender, target]
-                else:
-                    # 失败
-                    prob *= (1 - P_comm[sender, target])
-            total_prob += prob
-    
-    return total_prob
+    # 各发送者到目标节点的链路可靠性互不相同，使用 Poisson-binomial 尾概率精确计算
+    return poisson_binomial_tail([P_comm[s, target] for s in valid_senders], k_min)
 
-def calculate_theoretical_success_rate_custom_matrix(n: int, f: int, P_comm, proposer_id: int = 0) -> float:
-    """使用自定义可靠度矩阵计算PBFT共识的理论成功概率
+def poisson_binomial_pmf(probs):
+    """计算独立异质伯努利变量之和的完整分布 P(X = c), c = 0..m
     
     Args:
-        n: 节点数
-        f: 容错数
-        P_comm: 自定义的通信可靠性矩阵 (numpy数组或列表，n×n)
-        proposer_id: 主节点ID，默认为0
+        probs: 每个变量的成功概率。一维返回长度 m+1 的数组；
+               二维数组（每行一组变量）按行批量计算，返回 (行数, m+1) 数组
     
     Returns:
-        理论成功率
+        P(X = c) 数组
     """
-    from math import comb
-    from itertools import combinations
     import numpy as np
     
-    # 确保P_comm是numpy数组
-    if not isinstance(P_comm, np.ndarray):
-        P_comm = np.array(P_comm)
+    probs = np.asarray(probs, dtype=float)
+    m = probs.shape[-1]
+    pmf = np.zeros(probs.shape[:-1] + (m + 1,))
+    pmf[..., 0] = 1.0
+    for idx in range(m):
+        p = probs[..., idx:idx + 1]
+        pmf[..., 1:idx + 2] = pmf[..., 1:idx + 2] * (1 - p) + pmf[..., 0:idx + 1] * p
+        pmf[..., 0] *= (1 - p[..., 0])
+    return pmf
+
+def batch_receive_probs(P_comm, sender_members, k_min):
+    """批量计算：对每组发送者集合，每个节点从组内其他节点收到 ≥k_min 条消息的概率
     
-    print(f"\n=== 自定义矩阵理论计算 ===")
-    print(f"节点数: {n}, 容错数: {f}, 主节点: {proposer_id}")
-    print(f"使用自定义P_comm矩阵")
+    Args:
+        P_comm: 通信可靠性矩阵 (n×n)
+        sender_members: (B, n) 布尔数组，第 b 行标记第 b 组的发送者
+        k_min: 需要的最小消息数
     
-    # 显示部分通信可靠性
-    print(f"\nP_comm矩阵（部分）:")
-    for i in range(min(3, n)):
-        for j in range(min(3, n)):
-            if i != j:
-                print(f"  P_comm({i},{j}) = {P_comm[i,j]:.4f}")
+    Returns:
+        (B, n) 数组，[b, t] 为节点 t 从第 b 组发送者（不含 t 自己）收到 ≥k_min 条的概率
+    """
+    import numpy as np
     
-    nc_required = n - f  # 成功阈值
-    k_prepare = 2 * f - 1   # prepare阶段门限：从其他节点收到2f-1条（加自己=2f）
-    k_commit = 2 * f        # commit阶段门限：从其他节点收到2f条（加自己=2f+1）
+    n = P_comm.shape[0]
+    # probs[b, t, s] = P_comm[s, t]（s 为第 b 组发送者且 s ≠ t），否则为 0
+    probs = P_comm.T[None, :, :] * sender_members[:, None, :]
+    probs[:, np.arange(n), np.arange(n)] = 0.0
+    return poisson_binomial_tail(probs, k_min)
+
+def comm_matrix_column_digests(P_comm) -> List[bytes]:
+    """计算 P_comm 每一列的摘要，作为接收概率缓存键的一部分"""
+    import hashlib
+    import numpy as np
     
-    # 构建副本节点列表（所有节点除了主节点）
-    replica_nodes = [i for i in range(n) if i != proposer_id]
+    columns = np.ascontiguousarray(np.asarray(P_comm, dtype=float).T)
+    return [hashlib.blake2b(column.tobytes(), digest_size=16).digest() for column in columns]
+
+def cached_batch_receive_probs(P_comm, sender_members, target_members, k_min, column_digests=None):
+    """带 LRU 缓存的 batch_receive_probs
     
-    total_prob = 0.0
+    只查询/计算 target_members 标记的 (组, 目标) 组合：逐个组合查缓存，命中的更新最近使用顺序；
+    含未命中组合的组一次性批量计算，只把未命中的组合写回缓存。
     
-    # ========== Pre-prepare阶段 ==========
-    # 枚举所有可能的V_pp配置（主节点 + x-1个副本）
-    for x in range(nc_required, n + 1):
-        for v_pp_replicas in combinations(replica_nodes, x - 1):
-            # 计算这个V_pp配置的概率
-            p_this_vpp = 1.0
-            for replica in replica_nodes:
-                if replica in v_pp_replicas:
-                    p_this_vpp *= P_comm[proposer_id, replica]
-                else:
-                    p_this_vpp *= (1 - P_comm[proposer_id, replica])
-            
-            if p_this_vpp < 1e-15:
+    Args:
+        P_comm: 通信可靠性矩阵 (n×n)
+        sender_members: (B, n) 布尔数组，每组的发送者
+        target_members: (B, n) 布尔数组，每组需要的目标节点
+        k_min: 需要的最小消息数
+        column_digests: comm_matrix_column_digests(P_comm)，批量调用时由调用方预先计算
+    
+    Returns:
+        (B, n) 数组，非目标位置为 0
+    """
+    import numpy as np
+    
+    if column_digests is None:
+        column_digests = comm_matrix_column_digests(P_comm)
+    
+    batch, n = sender_members.shape
+    packed = np.packbits(sender_members, axis=1, bitorder='little')
+    sender_masks = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+    target_lists = [np.flatnonzero(row).tolist() for row in target_members]
+    cache = receive_prob_cache
+    
+    result = np.zeros((batch, n))
+    miss_rows = []
+    miss_targets = []  # 每个未命中行中缓存里没有的目标节点（已命中的目标照常计入命中并更新最近使用）
+    hits = 0
+    for row in range(batch):
+        mask = sender_masks[row]
+        missing = []
+        for t in target_lists[row]:
+            key = (column_digests[t], mask & ~(1 << t), t, k_min)
+            value = cache.get(key)
+            if value is None:
+                missing.append(t)
                 continue
-            
-            v_pp_nodes = [proposer_id] + list(v_pp_replicas)
-            
-            # ========== Prepare阶段 ==========
-            for y in range(nc_required, min(x, n) + 1):
-                for v_p_nodes in combinations(v_pp_nodes, y):
-                    # 计算每个节点收到足够prepare的概率
-                    p_this_vp_given_vpp = 1.0
-                    
-                    # prepare的发送者：主节点不发送prepare
-                    prepare_senders = [node for node in v_pp_nodes if node != proposer_id]
-                    
-                    for target in v_pp_nodes:
-                        if target in v_p_nodes:
-                            # 该节点需要收到≥k_prepare个prepare
-                            p_target_receive_k = calc_exact_receive_k_prob(
-                                prepare_senders, target, k_prepare, P_comm
-                            )
-                            p_this_vp_given_vpp *= p_target_receive_k
-                        else:
-                            # 该节点未收到足够的prepare
-                            p_target_receive_k = calc_exact_receive_k_prob(
-                                prepare_senders, target, k_prepare, P_comm
-                            )
-                            p_this_vp_given_vpp *= (1 - p_target_receive_k)
-                    
-                    if p_this_vp_given_vpp < 1e-15:
-                        continue
-                    
-                    # ========== Commit阶段 ==========
-                    for z in range(nc_required, min(y, n) + 1):
-                        for v_c_nodes in combinations(v_p_nodes, z):
-                            # commit的发送者：v_p_nodes中的所有节点
-                            commit_senders = list(v_p_nodes)
-                            
-                            p_this_vc_given_vp = 1.0
-                            
-                            for target in v_p_nodes:
-                                if target in v_c_nodes:
-                                    # 需要收到≥k_commit个commit
-                                    p_target_receive_k = calc_exact_receive_k_prob(
-                                        commit_senders, target, k_commit, P_comm
-                                    )
-                                    p_this_vc_given_vp *= p_target_receive_k
-                                else:
-                                    p_target_receive_k = calc_exact_receive_k_prob(
-                                        commit_senders, target, k_commit, P_comm
-                                    )
-                                    p_this_vc_given_vp *= (1 - p_target_receive_k)
-                            
-                            if p_this_vc_given_vp < 1e-15:
-                                continue
-                            
-                            # 如果|V_c| >= n-f，则成功
-                            if len(v_c_nodes) >= nc_required:
-                                total_prob += p_this_vpp * p_this_vp_given_vpp * p_this_vc_given_vp
-    
-    print(f"理论成功率（自定义矩阵，精确计算）: {total_prob:.6f}\n")
-    return total_prob
-
-def calculate_theoretical_success_rate_multihop(n: int, f: int, topology: str, n_value: int, p: float, proposer_id: int = 0) -> float:
-    """计算多跳拓扑下PBFT共识的理论成功概率（精确计算，使用真实P_comm矩阵）
+            cache.move_to_end(key)
+            result[row, t] = value
+            hits += 1
+        if missing:
+            miss_rows.append(row)
+            miss_targets.append(missing)
+    
+    if miss_rows:
+        computed = batch_receive_probs(P_comm, sender_members[miss_rows], k_min)
+        for idx, row in enumerate(miss_rows):
+            mask = sender_masks[row]
+            for t in miss_targets[idx]:
+                cache[(column_digests[t], mask & ~(1 << t), t, k_min)] = float(computed[idx, t])
+            result[row, miss_targets[idx]] = computed[idx, miss_targets[idx]]
+            receive_prob_cache_stats["misses"] += len(miss_targets[idx])
+        while len(cache) > RECEIVE_PROB_CACHE_SIZE:
+            cache.popitem(last=False)
+            receive_prob_cache_stats["evictions"] += 1
+    
+    receive_prob_cache_stats["hits"] += hits
+    return result
+
+def get_receive_prob_cache_stats() -> Dict[str, Any]:
+    """接收概率 LRU 缓存的命中统计"""
+    hits = receive_prob_cache_stats["hits"]
+    misses = receive_prob_cache_stats["misses"]
+    return {
+        "size": len(receive_prob_cache),
+        "maxSize": RECEIVE_PROB_CACHE_SIZE,
+        "hits": hits,
+        "misses": misses,
+        "evictions": receive_prob_cache_stats["evictions"],
+        "hitRate": hits / (hits + misses) if hits + misses > 0 else 0.0
+    }
+
+def worst_best_receive_tails(sorted_senders, keep: int, k_min: int):
+    """每行（已按升序排列的发送者可靠度）保留最差/最好的 keep 个发送者时收到 ≥k_min 条消息的概率"""
+    import numpy as np
     
-    方法：不使用平均P_comm的简化，而是对每对节点使用真实的通信可靠性P_comm[i,j]
+    width = sorted_senders.shape[-1]
+    worst = poisson_binomial_tail(sorted_senders[..., :keep], k_min)
+    best = poisson_binomial_tail(sorted_senders[..., width - keep:], k_min)
+    return np.atleast_1d(worst), np.atleast_1d(best)
+
+def theory_commit_stage_bounds(n: int, f: int, P_comm):
+    """commit 阶段成功概率的上下界 g_min(d) / g_max(d)（|V_p| = n-d，d = 0..f），与主节点无关
     
-    按照伪代码Line 8：所有诚实节点（包括主节点）都广播PREPARE
+    Returns:
+        (g_min 数组, g_max 数组)
+    """
+    import numpy as np
     
-    路径策略：
-    - 星形拓扑：中心↔边缘 P_comm=p，边缘↔边缘 P_comm=p²
-    - 环形拓扑：相邻 P_comm=p，不相邻 P_comm=1-(1-p^k1)(1-p^k2)
+    P_comm = np.asarray(P_comm, dtype=float)
+    nc_required = n - f
+    k_commit = 2 * f
+    
+    # commit：接收方 i 的发送者为除自己外的所有节点，按升序排列
+    off_diagonal = ~np.eye(n, dtype=bool)
+    commit_senders = np.sort(P_comm.T[off_diagonal].reshape(n, n - 1), axis=1)
+    
+    g_min = np.zeros(f + 1)
+    g_max = np.zeros(f + 1)
+    for d in range(f + 1):
+        size = n - d
+        worst, best = worst_best_receive_tails(commit_senders, size - 1, k_commit)
+        g_min[d] = poisson_binomial_tail(np.sort(worst)[:size][None, :], nc_required)[0]
+        g_max[d] = poisson_binomial_tail(np.sort(best)[::-1][:size][None, :], nc_required)[0]
+    return g_min, g_max
+
+def theory_stochastic_bounds_batch(n: int, f: int, P_comm, proposer_ids=None, commit_bounds=None,
+                                   node_availability=None):
+    """只按缺失数（而不是缺失集合）分层的随机序上下界，O(f·n²)/主节点，不做子集枚举
+    
+    依据三条单调性：
+    1. 接收方收到 ≥k 条消息的概率对发送者集合单调，因此 pre-prepare 缺失 a 个节点时，
+       副本 i 的 prepare 通过概率介于"去掉 a 个最好/最差发送者"的尾概率之间
+    2. prepare 失败数是独立伯努利之和，失败概率逐个放大/缩小后得到随机序意义下的上/下界分布
+    3. 给定 |V_p| = n-d，commit 成功概率 g(V_p) 介于"最差/最好的 n-d 个接收方、各自最差/最好的 n-d-1 个发送者"之间，
+       且对 d 单调递减
+    
+    pre-prepare 缺失数的分布是精确的，因此
+    lower = Σ_a P(a) Σ_b P_worst(b | a) g_min(a+b)，upper 同理用最好情况。
+    
+    多个主节点一起按 (主节点, 接收方, 发送者) 三维数组批量计算；commit 阶段上下界与主节点无关，
+    可传入 theory_commit_stage_bounds 的结果 commit_bounds 复用。
     
     Args:
-        n: 节点总数
-        f: 容错数
-        topology: 拓扑类型
-        n_value: 分支数
-        p: 单链路成功概率
-        proposer_id: 主节点ID，默认为0
+        proposer_ids: 主节点列表，None 表示全部节点
+        node_availability: 节点在线率，按 pre_prepare_probs 计入 pre-prepare，结果再乘以主节点在线率
     
     Returns:
-        理论成功率
+        (lower 数组, upper 数组)，与 proposer_ids 一一对应
     """
-    from math import comb
-    from itertools import combinations
     import numpy as np
     
-    # 计算通信路径可靠性矩阵
-    P_comm = calculate_comm_reliability_matrix_shortest_path(n, topology, n_value, p)
+    P_comm = np.asarray(P_comm, dtype=float)
+    proposers = np.arange(n) if proposer_ids is None else np.asarray(proposer_ids, dtype=int)
+    count = len(proposers)
+    k_prepare = 2 * f - 1
+    
+    nodes = np.arange(n)
+    off_diagonal = ~np.eye(n, dtype=bool)
+    # pre-prepare：主节点 v 到各副本的链路（离线副本收不到 pre-prepare）
+    availability = np.ones(n) if node_availability is None else np.asarray(node_availability, dtype=float)
+    pre_probs = P_comm[proposers] * availability[None, :]
+    pre_missing_pmf = poisson_binomial_pmf(1 - pre_probs[off_diagonal[proposers]].reshape(count, n - 1))
+    
+    # prepare：主节点的发送者为全部副本（第 v 列去掉对角线），
+    # 副本 i 的发送者为除主节点和自己外的副本（第 i 列去掉第 v、i 行），均按升序排列
+    proposer_senders = np.sort(P_comm.T[proposers][off_diagonal[proposers]].reshape(count, n - 1), axis=1)
+    v = proposers[:, None, None]
+    receiver = nodes[None, :, None]
+    sender = nodes[None, None, :]
+    keep = (receiver != v) & (sender != v) & (sender != receiver)
+    replica_senders = np.sort(np.broadcast_to(P_comm.T, (count, n, n))[keep].reshape(count, n - 1, max(n - 2, 0)), axis=2)
+    
+    # g_min(d) / g_max(d)：|V_p| = n-d 时 commit 阶段成功概率的上下界
+    g_min, g_max = commit_bounds if commit_bounds is not None else theory_commit_stage_bounds(n, f, P_comm)
+    
+    lower = np.zeros(count)
+    upper = np.zeros(count)
+    for a in range(f + 1):
+        proposer_worst, proposer_best = worst_best_receive_tails(proposer_senders, n - 1 - a, k_prepare)
+        replica_worst, replica_best = worst_best_receive_tails(replica_senders, n - 2 - a, k_prepare)
+        # V_pp 中有主节点和 n-a-1 个副本：取最差/最好的 n-a-1 个副本
+        fail_worst = 1 - np.concatenate([proposer_worst[:, None], np.sort(replica_worst, axis=1)[:, :n - a - 1]], axis=1)
+        fail_best = 1 - np.concatenate([proposer_best[:, None], np.sort(replica_best, axis=1)[:, ::-1][:, :n - a - 1]], axis=1)
+        pmf_worst = poisson_binomial_pmf(fail_worst)
+        pmf_best = poisson_binomial_pmf(fail_best)
+        lower += pre_missing_pmf[:, a] * (pmf_worst[:, :f - a + 1] @ g_min[a:])
+        upper += pre_missing_pmf[:, a] * (pmf_best[:, :f - a + 1] @ g_max[a:])
+    
+    upper = np.minimum(1.0, upper) * availability[proposers]
+    lower = lower * availability[proposers]
+    return np.minimum(lower, upper), upper
+
+def theory_stochastic_bounds(n: int, f: int, P_comm, proposer_id: int = 0,
+                             commit_bounds=None, node_availability: Optional[List[float]] = None) -> Tuple[float, float]:
+    """单个主节点的随机序上下界（见 theory_stochastic_bounds_batch）
     
-    print(f"\n=== 多跳拓扑理论计算（{topology}拓扑，精确方法） ===")
-    print(f"节点数: {n}, 容错数: {f}, 链路可靠性: {p:.3f}, 主节点: {proposer_id}")
-    print(f"使用精确P_comm矩阵，不使用平均近似")
+    Returns:
+        (lower, upper)
+    """
+    lower, upper = theory_stochastic_bounds_batch(n, f, P_comm, [proposer_id], commit_bounds, node_availability)
+    return float(lower[0]), float(upper[0])
+
+def theory_engine_custom_matrix(n: int, f: int, P_comm, proposer_id: int = 0,
+                                epsilon: float = 0.0, time_budget: Optional[float] = None,
+                                prior_bounds: Optional[Tuple[float, float]] = None,
+                                distributions: bool = False,
+                                node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """逐阶段淘汰模型的精确/带证书误差理论引擎（自定义 P_comm）
+    
+    与原先的三重子集枚举模型完全一致：
+    - Pre-prepare：副本 r 以 P_comm[v,r] 进入 V_pp
+    - Prepare：V_pp 中的节点从 V_pp 中除主节点外的副本收到 ≥2f-1 条 prepare 进入 V_p
+    - Commit：V_p 中的节点从 V_p 收到 ≥2f 条 commit 进入 V_c，成功判据 |V_c| ≥ n-f
+    
+    重构要点：
+    1. 不再枚举 V_c：给定 V_p 时各节点相互独立，|V_c| ≥ n-f 是 Poisson-binomial 尾概率
+    2. 枚举"缺失集合"而不是"存活集合"：pre-prepare 缺失 M1（|M1|=a），prepare 再缺失 M2（|M2|=b），
+       成功要求 a + b ≤ f；按总缺失数 d = a + b 从小到大枚举，概率质量大的分支先计算
+    3. 分支按块批量计算（numpy 广播），单节点接收概率走全局 LRU 缓存，
+       commit 成功概率按总缺失集合 M1 ∪ M2 缓存复用
+    4. 残余质量证书：所有 (M1, M2) 配置的概率之和为 1，未枚举分支对成功率的贡献
+       不超过其概率质量，因此 lower ≤ P_success ≤ lower + (1 - 已枚举质量 - 已知失败质量)
+    
+    当区间宽度 ≤ epsilon 或超出 time_budget（秒）时提前停止；epsilon=0 且无时间预算时为精确计算。
+    提供 prior_bounds（如 theory_stochastic_bounds 的结果）时，区间取两者的交集。
+    
+    distributions=True 时在同一次枚举中累积各阶段人数的分布：
+    N_pp 的分布是 pre-prepare 缺失数的 Poisson-binomial PMF（完整）；
+    N_p、N_c 只在 ≥ n-f 的取值上精确（更小的取值对应未枚举的分支），见 summarize_phase_distributions。
+    
+    node_availability（节点在线率）按 pre_prepare_probs 计入 pre-prepare 阶段，结果再乘以主节点在线率。
     
-    # 显示部分通信可靠性
-    print(f"\nP_comm矩阵（部分）:")
-    for i in range(min(3, n)):
-        for j in range(min(3, n)):
-            if i != j:
-                print(f"  P_comm({i},{j}) = {P_comm[i,j]:.4f}")
+    Args:
+        n: 节点数
+        f: 容错数
+        P_comm: 通信可靠性矩阵 (n×n)
+        proposer_id: 主节点ID
+        epsilon: 允许的误差区间宽度
+        time_budget: 计算时间上限（秒），None 表示不限制
+        prior_bounds: 已知的 (下界, 上界)，可选
+        distributions: 是否同时返回 N_pp / N_p / N_c 的分布
+        node_availability: 每个节点的在线率 s(v)，None 表示全部在线
     
-    nc_required = n - f  # 成功阈值
-    k_prepare = 2 * f - 1   # prepare阶段门限：从其他节点收到2f-1条（加自己=2f）
-    k_commit = 2 * f        # commit阶段门限：从其他节点收到2f条（加自己=2f+1）
+    Returns:
+        {
+            'success_rate': 点估计（精确时等于 lower，否则取区间中点）,
+            'lower': 下界, 'upper': 上界, 'exact': 是否枚举完所有成功分支,
+            'branches': 计算的 (V_pp, V_p) 分支数,
+            'distributions': distributions=True 且精确时为 summarize_phase_distributions 的结果，否则为 None,
+            'cache_hits' / 'cache_misses': 本次调用的接收概率缓存命中/未命中数,
+            'elapsed': 耗时（秒）
+        }
+    """
+    import numpy as np
+    import time
+    from itertools import combinations, islice
     
-    # 构建副本节点列表（所有节点除了主节点）
-    replica_nodes = [i for i in range(n) if i != proposer_id]
-    
-    total_prob = 0.0
-    
-    # ========== Pre-prepare阶段 ==========
-    # 枚举所有可能的V_pp配置（主节点 + x-1个副本）
-    for x in range(nc_required, n + 1):
-        # 枚举所有x-1个副本的组合
-        for v_pp_replicas in combinations(replica_nodes, x - 1):
-            # 计算这个V_pp配置的概率
-            p_this_vpp = 1.0
-            for replica in replica_nodes:
-                if replica in v_pp_replicas:
-                    p_this_vpp *= P_comm[proposer_id, replica]  # 收到pre-prepare
-                else:
-                    p_this_vpp *= (1 - P_comm[proposer_id, replica])  # 未收到
-            
-            if p_this_vpp < 1e-15:
-                continue
-            
-            # V_pp = {proposer_id} ∪ v_pp_replicas
-            v_pp_nodes = [proposer_id] + list(v_pp_replicas)
-            
-            # ========== Prepare阶段 ==========
-            # 主节点不发送prepare，只有副本互相发送
-            
-            # 对于V_pp中的每个节点，计算它收到≥k_prepare条prepare的概率
-            # 使用精确的P_comm[i,j]
-            
-            # 副本节点发送prepare（主节点不发送）
-            prepare_senders = [node for node in v_pp_nodes if node != proposer_id]
-            
-            # 计算每个节点能否进入V_p（收到≥k_prepare条prepare）
-            # 使用动态规划或枚举所有可能的消息传递情况
-            
-            # 简化但仍精确的方法：对每个节点，计算从prepare_senders收到≥k_prepare条的概率
-            node_enter_vp_prob = {}
-            
-            for target_node in v_pp_nodes:
-                # 该节点从prepare_senders中收到消息
-                senders_to_this_node = [s for s in prepare_senders if s != target_node]
-                
-                if len(senders_to_this_node) < k_prepare:
-                    node_enter_vp_prob[target_node] = 0.0
-                else:
-                    # 计算收到≥k_prepare条消息的概率
-                    # 枚举所有可能的k条成功组合
-                    prob_ge_k = 0.0
-                    for num_success in range(k_prepare, len(senders_to_this_node) + 1):
-                        for success_set in combinations(senders_to_this_node, num_success):
-                            prob_this_case = 1.0
-                            for sender in senders_to_this_node:
-                                if sender in success_set:
-                                    prob_this_case *= P_comm[sender, target_node]
-                                else:
-                                    prob_this_case *= (1 - P_comm[sender, target_node])
-                            prob_ge_k += prob_this_case
-                    
-                    node_enter_vp_prob[target_node] = prob_ge_k
-            
-            # 枚举V_p的所有可能配置（V_p ⊆ V_pp）
-            for y in range(nc_required, x + 1):
-                for v_p_nodes_tuple in combinations(v_pp_nodes, y):
-                    v_p_nodes = list(v_p_nodes_tuple)
-                    
-                    # 计算这个V_p配置的概率
-                    p_this_vp_given_vpp = 1.0
-                    for node in v_pp_nodes:
-                        if node in v_p_nodes:
-                            p_this_vp_given_vpp *= node_enter_vp_prob[node]
-                        else:
-                            p_this_vp_given_vpp *= (1 - node_enter_vp_prob[node])
-                    
-                    if p_this_vp_given_vpp < 1e-15:
-                        continue
-                    
-                    # ========== Commit阶段 ==========
-                    # V_p中的所有节点互相发送commit
-                    commit_senders = v_p_nodes
-                    
-                    # 计算每个节点能否进入V_c（收到≥k_commit条commit）
-                    node_enter_vc_prob = {}
-                    
-                    for target_node in v_p_nodes:
-                        senders_to_this_node = [s for s in commit_senders if s != target_node]
-                        
-                        if len(senders_to_this_node) < k_commit:
-                            node_enter_vc_prob[target_node] = 0.0
-                        else:
-                            prob_ge_k = 0.0
-                            for num_success in range(k_commit, len(senders_to_this_node) + 1):
-                                for success_set in combinations(senders_to_this_node, num_success):
-                                    prob_this_case = 1.0
-                                    for sender in senders_to_this_node:
-                                        if sender in success_set:
-                                            prob_this_case *= P_comm[sender, target_node]
-                                        else:
-                                            prob_this_case *= (1 - P_comm[sender, target_node])
-                                    prob_ge_k += prob_this_case
-                            
-                            node_enter_vc_prob[target_node] = prob_ge_k
-                    
-                    # 计算|V_c| >= nc_required的概率
-                    # 枚举所有可能的V_c配置
-                    p_success_given_vp = 0.0
-                    for z in range(nc_required, y + 1):
-                        for v_c_nodes_tuple in combinations(v_p_nodes, z):
-                            v_c_nodes = list(v_c_nodes_tuple)
-                            
-                            p_this_vc_given_vp = 1.0
-                            for node in v_p_nodes:
-                                if node in v_c_nodes:
-                                    p_this_vc_given_vp *= node_enter_vc_prob[node]
-                                else:
-                                    p_this_vc_given_vp *= (1 - node_enter_vc_prob[node])
-                            
-                            p_success_given_vp += p_this_vc_given_vp
-                    
-                    total_prob += p_this_vpp * p_this_vp_given_vpp * p_success_given_vp
-    
-    print(f"理论成功率（精确计算，使用真实P_comm）: {total_prob:.6f}")
-    print(f"=" * 50)
+    P_comm = np.asarray(P_comm, dtype=float)
+    start_time = time.time()
     
-    return total_prob
-
-def calculate_theoretical_success_rate(n: int, f: int, p: float) -> float:
-    """计算PBFT共识的理论成功概率（口径A：N_c ≥ N − f）
-
-    严格对齐论文 Theorem 1（式(1)–(6)）和伪代码Algorithm 1在以下特例下的闭式化简：
-    - 全连接网络
-    - 所有节点在线（P(V_node)=1）
-    - 同质链路：p^L_{i,j} = p
-    - n 给定，f = floor((n-1)/3)
-    - 成功判据：commit 成功节点数 N_c ≥ N − f
-    - 按照伪代码Line 8：所有诚实节点（包括主节点）都广播PREPARE
+    v = proposer_id
+    nc_required = n - f
+    k_prepare = 2 * f - 1   # prepare阶段门限：从其他节点收到2f-1条（加自己=2f）
+    k_commit = 2 * f        # commit阶段门限：从其他节点收到2f条（加自己=2f+1）
+    max_missing = n - nc_required
+    
+    replica_nodes = [i for i in range(n) if i != v]
+    is_replica = np.arange(n) != v
+    # 以下均为主节点在线条件下的概率，返回前再乘以主节点在线率
+    p_pre, primary_availability = pre_prepare_probs(P_comm, v, node_availability)
+    
+    # 每块处理的分支数：限制 (块大小, n, n) 广播数组的内存占用
+    chunk_size = max(64, (1 << 20) // (n * n))
+    
+    # Pre-prepare 缺失数超过 f 的质量必然失败
+    pre_missing_pmf = poisson_binomial_pmf(1 - p_pre[replica_nodes])
+    known_failure_mass = float(np.sum(pre_missing_pmf[max_missing + 1:]))
+    
+    # 接收概率走全局 LRU 缓存（按 发送者位掩码 + 目标节点），跨分支、跨主节点、跨请求复用
+    column_digests = comm_matrix_column_digests(P_comm)
+    hits_before = receive_prob_cache_stats["hits"]
+    misses_before = receive_prob_cache_stats["misses"]
+    
+    prepare_cache = {}   # M1 -> (mass1, r 向量：V_pp 中各节点进入 V_p 的概率)
+    commit_cache = {}    # V_p 位图 -> P(|V_c| ≥ n-f | V_p)
+    commit_pmf_cache = {}  # V_p 位图 -> P(|V_c| = z | V_p), z = 0..n（仅 distributions=True）
+    pmf_p = np.zeros(n + 1)
+    pmf_c = np.zeros(n + 1)
+    
+    lower = 0.0
+    explored_mass = 0.0
+    branches = 0
+    stopped_early = False
+    
+    prior_lower, prior_upper = prior_bounds if prior_bounds is not None else (0.0, 1.0)
+    if primary_availability < 1.0:
+        # prior_bounds 包含主节点在线率，换算成在线条件下的区间
+        prior_lower, prior_upper = ((prior_lower / primary_availability, min(1.0, prior_upper / primary_availability))
+                                    if primary_availability > 0 else (0.0, 1.0))
+    
+    def unexplored_mass():
+        return max(0.0, 1.0 - explored_mass - known_failure_mass)
+    
+    def interval():
+        return max(lower, prior_lower), min(1.0, lower + unexplored_mass(), prior_upper)
+    
+    def fill_prepare_cache(m1_list):
+        """批量计算一组 M1 的 V_pp 概率和 prepare 阶段各节点进入 V_p 的概率"""
+        nonlocal known_failure_mass
+        missing1 = np.zeros((len(m1_list), n), dtype=bool)
+        for row, m1 in enumerate(m1_list):
+            missing1[row, list(m1)] = True
+        in_pp = ~missing1
+        mass1 = np.prod(np.where(missing1, 1 - p_pre, p_pre), axis=1)
+        r = cached_batch_receive_probs(P_comm, in_pp & is_replica, in_pp, k_prepare, column_digests)
+        # prepare 阶段缺失数超过 f-a 的质量必然失败
+        fail_probs = np.where(in_pp, 1 - r, 0.0)
+        pmf = poisson_binomial_pmf(fail_probs)
+        for row, m1 in enumerate(m1_list):
+            known_failure_mass += mass1[row] * float(np.sum(pmf[row, max_missing - len(m1) + 1:]))
+            prepare_cache[m1] = (float(mass1[row]), r[row])
+    
+    def process_chunk(pairs):
+        """批量计算一块 (M1, M2) 分支的概率质量和成功贡献"""
+        nonlocal lower, explored_mass, branches
+        new_m1 = list({m1 for m1, _ in pairs if m1 not in prepare_cache})
+        if new_m1:
+            fill_prepare_cache(new_m1)
+        
+        mass1 = np.array([prepare_cache[m1][0] for m1, _ in pairs])
+        r = np.array([prepare_cache[m1][1] for m1, _ in pairs])
+        # 同一块内的 M1、M2 大小分别相同，可直接构造索引数组
+        rows = np.arange(len(pairs))[:, None]
+        missing1 = np.zeros((len(pairs), n), dtype=bool)
+        missing2 = np.zeros((len(pairs), n), dtype=bool)
+        missing1[rows, np.array([m1 for m1, _ in pairs], dtype=int).reshape(len(pairs), -1)] = True
+        missing2[rows, np.array([m2 for _, m2 in pairs], dtype=int).reshape(len(pairs), -1)] = True
+        in_pp = ~missing1
+        in_p = in_pp & ~missing2
+        mass2 = np.prod(np.where(in_pp, np.where(missing2, 1 - r, r), 1.0), axis=1)
+        branch_mass = mass1 * mass2
+        
+        keys = [row.tobytes() for row in np.packbits(in_p, axis=1)]
+        new_rows = {}
+        for row, key in enumerate(keys):
+            if key not in commit_cache and key not in new_rows and branch_mass[row] > 0:
+                new_rows[key] = row
+        if new_rows:
+            members = in_p[list(new_rows.values())]
+            q = cached_batch_receive_probs(P_comm, members, members, k_commit, column_digests)
+            g = poisson_binomial_tail(q, nc_required)
+            for key, value in zip(new_rows.keys(), g):
+                commit_cache[key] = float(value)
+            if distributions:
+                for key, row_pmf in zip(new_rows.keys(), poisson_binomial_pmf(q)):
+                    commit_pmf_cache[key] = row_pmf
+        
+        g_vec = np.array([commit_cache.get(key, 0.0) for key in keys])
+        explored_mass += float(np.sum(branch_mass))
+        lower += float(np.sum(branch_mass * g_vec))
+        branches += len(pairs)
+        if distributions:
+            # 同一块内 |V_p| = n - d 相同
+            pmf_p[n - len(pairs[0][0]) - len(pairs[0][1])] += float(np.sum(branch_mass))
+            for row, key in enumerate(keys):
+                if key in commit_pmf_cache:
+                    pmf_c[:] += branch_mass[row] * commit_pmf_cache[key]
+    
+    def branch_pairs(d, a):
+        """生成总缺失数为 d、其中 pre-prepare 缺失 a 个的所有 (M1, M2) 分支"""
+        for m1 in combinations(replica_nodes, a):
+            m1_set = set(m1)
+            v_pp_nodes = [node for node in range(n) if node not in m1_set]
+            for m2 in combinations(v_pp_nodes, d - a):
+                yield m1, m2
+    
+    for d in range(max_missing + 1):
+        for a in range(d + 1):
+            pairs_iter = branch_pairs(d, a)
+            while True:
+                pairs = list(islice(pairs_iter, chunk_size))
+                if not pairs:
+                    break
+                # 仍有未计算的分支时才检查停止条件，全部枚举完即为精确结果
+                interval_lower, interval_upper = interval()
+                if epsilon > 0 and interval_upper - interval_lower <= epsilon:
+                    stopped_early = True
+                elif time_budget is not None and time.time() - start_time > time_budget:
+                    stopped_early = True
+                if stopped_early:
+                    break
+                process_chunk(pairs)
+            if stopped_early:
+                break
+        if stopped_early:
+            break
+    
+    exact = not stopped_early
+    if exact:
+        upper = lower
+    else:
+        lower, upper = interval()
+        lower = min(lower, upper)
+    
+    phase_distributions = None
+    if distributions and exact:
+        pmf_pp = np.zeros(n + 1)
+        pmf_pp[n - np.arange(len(pre_missing_pmf))] = pre_missing_pmf  # N_pp = n - |M1|
+        phase_distributions = mix_primary_offline_distributions(
+            summarize_phase_distributions(n, f, pmf_pp, pmf_p, pmf_c, support=nc_required), primary_availability
+        )
+    lower *= primary_availability
+    upper *= primary_availability
+    
+    return {
+        'success_rate': lower if exact else (lower + upper) / 2,
+        'lower': lower,
+        'upper': upper,
+        'exact': exact,
+        'branches': branches,
+        'distributions': phase_distributions,
+        'cache_hits': receive_prob_cache_stats["hits"] - hits_before,
+        'cache_misses': receive_prob_cache_stats["misses"] - misses_before,
+        'elapsed': time.time() - start_time
+    }
 
-    注意：单节点在 prepare/commit 阶段的门限来自式(6)：至少收到 2f 条成功消息（来自其他节点）。
+def find_equivalent_node_classes(P_comm, proposer_id: int = 0, tol: float = 1e-12,
+                                 node_availability: Optional[List[float]] = None) -> List[List[int]]:
+    """把可互换的节点划分为等价类（主节点单独一类，排在第一位）
+    
+    副本 s、t 可互换 ⟺ 交换二者后 P_comm 不变：
+    对所有 x ∉ {s, t} 有 P[s,x] = P[t,x]、P[x,s] = P[x,t]，且 P[s,t] = P[t,s]。
+    这一关系具有传递性，同一类内任意两点之间的链路可靠度相同，类之间的可靠度只取决于类。
+    例如星形拓扑的所有叶子、树形拓扑同一父节点下的叶子；环形拓扑上"到主节点距离相同"的节点
+    彼此之间的链路并不对称，不满足该条件。给定 node_availability 时还要求二者在线率相同。
+    
+    Returns:
+        等价类列表，classes[0] == [proposer_id]
     """
-    from math import comb
-
-    def binom_prob(n_trials: int, k_success: int, prob: float) -> float:
-        if k_success > n_trials or k_success < 0:
-            return 0.0
-        return comb(n_trials, k_success) * (prob ** k_success) * ((1 - prob) ** (n_trials - k_success))
+    import numpy as np
+    
+    P_comm = np.asarray(P_comm, dtype=float)
+    n = P_comm.shape[0]
+    availability = np.ones(n) if node_availability is None else np.asarray(node_availability, dtype=float)
+    classes = [[proposer_id]]
+    for s in range(n):
+        if s == proposer_id:
+            continue
+        for members in classes[1:]:
+            t = members[0]
+            outside = np.ones(n, dtype=bool)
+            outside[[s, t]] = False
+            if (np.all(np.abs(P_comm[s, outside] - P_comm[t, outside]) <= tol)
+                    and np.all(np.abs(P_comm[outside, s] - P_comm[outside, t]) <= tol)
+                    and abs(P_comm[s, t] - P_comm[t, s]) <= tol
+                    and abs(availability[s] - availability[t]) <= tol):
+                members.append(s)
+                break
+        else:
+            classes.append([s])
+    return classes
 
-    # q_{>=k}(m) = P(Bin(m,p) >= k)
-    def binom_tail_ge(m: int, k: int, prob: float) -> float:
-        if k <= 0:
+def estimate_node_class_states(class_sizes: List[int], f: int) -> int:
+    """预估按类计数的精确引擎需要计算的 (x, y) 状态数
+    
+    副本类（大小 m）中 pre-prepare 缺失 u 个、prepare 再缺失 w 个，u + w = d 的组合数为 d+1（d ≤ m）；
+    主节点类只可能在 prepare 阶段缺失（0 或 1 个）。各类按总缺失数 ≤ f 卷积计数。
+    """
+    counts = [1] + [0] * f
+    for index, size in enumerate(class_sizes):
+        per_class = [1, 1] if index == 0 else [d + 1 if d <= size else 0 for d in range(f + 1)]
+        counts = [sum(counts[d - e] * per_class[e] for e in range(min(d, len(per_class) - 1) + 1))
+                  for d in range(f + 1)]
+    return sum(counts)
+
+def theory_engine_node_classes(n: int, f: int, P_comm, proposer_id: int = 0,
+                               classes: Optional[List[List[int]]] = None,
+                               node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """按节点等价类计数的精确理论引擎（与 theory_engine_custom_matrix 同一模型）
+    
+    同一类内的节点可互换，给定各类在 V_pp / V_p 中的人数后，
+    类内每个节点进入下一阶段的概率相同，人数服从二项分布，因此只需枚举"每类人数"而不是节点子集：
+    - Pre-prepare：X_k ~ Bin(m_k, s_k·P[v, c_k])（s 为在线率，见 pre_prepare_probs）
+    - Prepare：类 l 的节点从各类副本收到的 prepare 数为 Σ_k Bin(x_k - [k=l], B[k,l])，
+      达到 2f-1 的概率 r_l(x)，Y_l | x ~ Bin(x_l, r_l(x))，主节点以 r_0(x) 进入 V_p
+    - Commit：同理得到 q_l(y)，成功概率为 P(Σ_l Bin(y_l, q_l(y)) ≥ n-f)
+    与子集枚举一样只枚举总缺失数 ≤ f 的状态。星形拓扑只有 1~2 个副本类，n=100 只有几千个状态。
+    
+    Args:
+        n: 节点数
+        f: 容错数
+        P_comm: 通信可靠性矩阵 (n×n)
+        proposer_id: 主节点ID
+        classes: find_equivalent_node_classes 的结果，None 时自动检测
+        node_availability: 每个节点的在线率，None 表示全部在线
+    
+    Returns:
+        与 theory_engine_custom_matrix 相同的字段（'exact' 恒为 True），
+        另含 'classes': 各类大小, 'branches': 计算的 (x, y) 状态数
+    """
+    import numpy as np
+    import time
+    from scipy.stats import binom
+    
+    P_comm = np.asarray(P_comm, dtype=float)
+    start_time = time.time()
+    v = proposer_id
+    nc_required = n - f
+    k_prepare = 2 * f - 1
+    k_commit = 2 * f
+    
+    if classes is None:
+        classes = find_equivalent_node_classes(P_comm, v, node_availability=node_availability)
+    p_pre, primary_availability = pre_prepare_probs(P_comm, v, node_availability)
+    class_count = len(classes)
+    sizes = [len(members) for members in classes]
+    reps = [members[0] for members in classes]
+    # B[k, l]：类 k 的节点发往类 l 的另一个节点的可靠度
+    B = P_comm[np.ix_(reps, reps)].copy()
+    for k, members in enumerate(classes):
+        B[k, k] = P_comm[members[0], members[1]] if len(members) > 1 else 0.0
+    
+    def sum_tail(counts, probs, k_min):
+        """P(Σ_k Bin(counts[k], probs[k]) ≥ k_min)"""
+        if k_min <= 0:
             return 1.0
-        if m < 0:
-            return 0.0
-        if k > m:
+        if sum(counts) < k_min:
             return 0.0
-        return sum(binom_prob(m, i, prob) for i in range(k, m + 1))
-
-    # 口径A：最终成功要求 N_c >= N - f
-    nc_required = n - f
-    # 论文式(6)中使用的"至少收到2f条成功消息"（来自其他节点）
-    k_prepare = 2 * f - 1   # prepare阶段：从其他节点收到2f-1条（加自己=2f）
-    k_commit = 2 * f        # commit阶段：从其他节点收到2f条（加自己=2f+1）
-
-    total_prob = 0.0
-
-    # pre-prepare：主节点v0始终在V_pp，n-1个副本中有 x-1 个收到
-    # 因为要求 N_pp >= N_p >= N_c >= N-f，所以这里 x 从 nc_required 到 n
-    for x in range(nc_required, n + 1):
-        # P(N_pp = x)
-        p_pp = binom_prob(n - 1, x - 1, p)
-        if p_pp < 1e-15:
+        pmf = np.ones(1)
+        for count, prob in zip(counts, probs):
+            if count > 0:
+                pmf = np.convolve(pmf, binom.pmf(np.arange(count + 1), count, prob))
+        # 卷积求和的舍入可能略超 1，会让后续 binom.pmf 得到 nan
+        return float(min(max(np.sum(pmf[k_min:]), 0.0), 1.0))
+    
+    def bounded_vectors(limits, budget):
+        """所有 0 ≤ u_k ≤ limits[k] 且 Σu ≤ budget 的整数向量"""
+        if not limits:
+            yield ()
+            return
+        for first in range(min(limits[0], budget) + 1):
+            for rest in bounded_vectors(limits[1:], budget - first):
+                yield (first,) + rest
+    
+    # Pre-prepare：各副本类缺失 u_k 个的概率
+    pre_pmf = [None] + [binom.pmf(sizes[k] - np.arange(min(sizes[k], f) + 1), sizes[k], p_pre[reps[k]])
+                        for k in range(1, class_count)]
+    commit_cache = {}
+    success = 0.0
+    states = 0
+    
+    for u in bounded_vectors([min(s, f) for s in sizes[1:]], f):
+        x = [1] + [sizes[k] - u[k - 1] for k in range(1, class_count)]
+        mass1 = float(np.prod([pre_pmf[k][u[k - 1]] for k in range(1, class_count)]))
+        if mass1 == 0.0:
             continue
-
-        # prepare：给定 N_pp = x
-        # 主节点不发送prepare，只有副本发送
-        # 主节点从 x-1 个副本收到 prepare，需 >=2f
-        q0 = binom_tail_ge(x - 1, k_prepare, p)
-        # 副本从其余 (x-2) 个副本收到 prepare，需 >=2f
-        q1 = binom_tail_ge(x - 2, k_prepare, p)
-
-        # 枚举 N_p = y（也必须 >= nc_required，且 y <= x）
-        for y in range(nc_required, x + 1):
-            # P(N_p = y | N_pp = x)
-            # 两种情况：主节点在/不在 V_p
-            p_p_y_given_x = 0.0
-            # 主节点在V_p：副本中有 y-1 个进入
-            p_p_y_given_x += q0 * binom_prob(x - 1, y - 1, q1)
-            # 主节点不在V_p：副本中有 y 个进入
-            p_p_y_given_x += (1 - q0) * binom_prob(x - 1, y, q1)
-
-            if p_p_y_given_x < 1e-15:
+        # Prepare：主节点不发送 prepare
+        r = [sum_tail([x[k] - (k == l) if k > 0 else 0 for k in range(class_count)], B[:, l], k_prepare)
+             if x[l] > 0 else 0.0 for l in range(class_count)]
+        budget = f - sum(u)
+        # 类 l 在 prepare 阶段缺失 w_l 个的概率，按 w_l 预先算成向量
+        prep_pmf = [binom.pmf(x[l] - np.arange(min(x[l], budget) + 1), x[l], r[l]) for l in range(class_count)]
+        for w in bounded_vectors(x, budget):
+            mass2 = 1.0
+            for l in range(class_count):
+                mass2 *= prep_pmf[l][w[l]]
+            states += 1
+            if mass2 == 0.0:
                 continue
+            y = tuple(x[l] - w[l] for l in range(class_count))
+            if y not in commit_cache:
+                q = [sum_tail([y[k] - (k == l) for k in range(class_count)], B[:, l], k_commit)
+                     if y[l] > 0 else 0.0 for l in range(class_count)]
+                commit_cache[y] = sum_tail(list(y), q, nc_required)
+            success += mass1 * mass2 * commit_cache[y]
+    success *= primary_availability
+    
+    return {
+        'success_rate': success,
+        'lower': success,
+        'upper': success,
+        'exact': True,
+        'branches': states,
+        'classes': sizes,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'distributions': None,
+        'elapsed': time.time() - start_time
+    }
 
-            # commit：给定 N_p = y
-            # 节点从其他 y-1 个节点收到 commit，需 >=2f
-            q2 = binom_tail_ge(y - 1, k_commit, p)
-            # P(N_c >= N-f | N_p = y)
-            p_c_ge = sum(binom_prob(y, z, q2) for z in range(nc_required, y + 1))
-
-            total_prob += p_pp * p_p_y_given_x * p_c_ge
-
-    return total_prob
-
+def theory_engine_with_symmetry(n: int, f: int, P_comm, proposer_id: int = 0,
+                                time_budget: Optional[float] = None,
+                                node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """检测节点等价类，按类计数更省时用 theory_engine_node_classes，否则用子集枚举引擎"""
+    classes = find_equivalent_node_classes(P_comm, proposer_id, node_availability=node_availability)
+    class_states = estimate_node_class_states([len(members) for members in classes], f)
+    if class_states < estimate_custom_matrix_branches(n, f):
+        print(f"检测到 {len(classes)} 个节点等价类（大小 {[len(members) for members in classes]}），"
+              f"按类计数枚举 {class_states} 个状态")
+        return theory_engine_node_classes(n, f, P_comm, proposer_id, classes, node_availability)
+    return theory_engine_custom_matrix(n, f, P_comm, proposer_id, time_budget=time_budget,
+                                       node_availability=node_availability)
+
+def estimate_theory_branches(n: int, f: int, P_comm, proposer_id: int = 0,
+                             node_availability: Optional[List[float]] = None) -> int:
+    """theory_engine_with_symmetry 的成本预估：按类计数状态数与子集枚举分支数取较小者"""
+    classes = find_equivalent_node_classes(P_comm, proposer_id, node_availability=node_availability)
+    return min(estimate_node_class_states([len(members) for members in classes], f),
+               estimate_custom_matrix_branches(n, f))
+
+def has_partial_availability(node_availability) -> bool:
+    """是否有节点的在线率 s(v) < 1（None 表示全部在线）"""
+    return node_availability is not None and min(node_availability) < 1.0
+
+def pre_prepare_probs(P_comm, proposer_id: int, node_availability=None):
+    """各节点进入 V_pp 的概率（主节点为 1）及主节点在线率 s_v
+    
+    每个节点本轮是否在线相互独立；离线节点收不到 pre-prepare，因此不会进入 V_pp，
+    之后既不发送 prepare/commit，也不计入 V_p、V_c。逐阶段淘汰模型下这与对在线集合求和完全等价：
+    副本 r 进入 V_pp 的概率变为 s_r·P[v,r]，prepare/commit 阶段的链路（包括主节点发出的 commit）不变；
+    主节点离线时本轮必然失败，成功率再乘以 s_v。因此不需要枚举 2^n 个在线集合。
+    
+    Returns:
+        (长度 n 的概率数组, s_v)；node_availability 为 None 时为 (P_comm[v]（主节点处为 1）, 1.0)
+    """
+    import numpy as np
+    
+    p_pre = np.array(P_comm[proposer_id], dtype=float)
+    primary_availability = 1.0
+    if node_availability is not None:
+        availability = np.asarray(node_availability, dtype=float)
+        p_pre *= availability
+        primary_availability = float(availability[proposer_id])
+    p_pre[proposer_id] = 1.0  # 主节点（在线时）始终在 V_pp
+    return p_pre, primary_availability
+
+def theory_gradient_custom_matrix(n: int, f: int, P_comm, proposer_id: int = 0,
+                                  node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """逐阶段淘汰模型成功率对每条链路可靠度的偏导 ∂P_success/∂P_comm[i,j]（精确，一次枚举得到全部 n² 个偏导）
+    
+    与 theory_engine_custom_matrix 相同地枚举 (M1, M2) 缺失集合分支，分支贡献为 mass1 · mass2 · g(V_p)，
+    对三个因子分别求导（乘积法则）：
+    - mass1 = Π_r (p_vr 或 1-p_vr)：对 pre-prepare 链路 (v, r) 的偏导为 ± 其余因子之积
+    - mass2 = Π_t (r_t 或 1-r_t)：r_t 是 Poisson-binomial 尾概率，∂r_t/∂P[s,t] = P(X_{t,-s} = k-1)
+    - g = P(|V_c| ≥ n-f)：对 q_t 的偏导同样是留一概率，q_t 对 commit 链路的偏导同上
+    同一条链路在不同阶段是独立的伯努利试验，偏导按阶段相加。
+    node_availability 按 pre_prepare_probs 计入：p_vr = s_r·P[v,r]，因此 pre-prepare 偏导再乘以 s_r，
+    成功率和全部偏导再乘以主节点在线率 s_v。
+    
+    Returns:
+        {'success_rate': 成功率, 'gradient': n×n 偏导矩阵（行：发送方，列：接收方）,
+         'branches': 分支数, 'elapsed': 耗时（秒）}
+    """
+    import numpy as np
+    import time
+    from itertools import combinations, islice
+    
+    P_comm = np.asarray(P_comm, dtype=float)
+    start_time = time.time()
+    
+    v = proposer_id
+    nc_required = n - f
+    k_prepare = 2 * f - 1
+    k_commit = 2 * f
+    max_missing = n - nc_required
+    
+    replica_nodes = [i for i in range(n) if i != v]
+    is_replica = np.arange(n) != v
+    off_diagonal = ~np.eye(n, dtype=bool)
+    p_pre, primary_availability = pre_prepare_probs(P_comm, v, node_availability)
+    # dp_pre[r] / dP_comm[v, r] = s_r
+    pre_scale = np.asarray(node_availability, dtype=float) if node_availability is not None else np.ones(n)
+    link_T = P_comm.T * off_diagonal  # [t, s] = P_comm[s, t]，对角线为 0
+    
+    chunk_size = max(16, (1 << 18) // (n * n * max(1, k_commit)))
+    
+    success = 0.0
+    grad_pre = np.zeros(n)        # 对 P_comm[v, r] 的 pre-prepare 偏导
+    grad_T = np.zeros((n, n))     # [t, s]：对 P_comm[s, t] 的 prepare + commit 偏导
+    branches = 0
+    
+    def process_chunk(pairs):
+        nonlocal success, branches
+        rows = np.arange(len(pairs))[:, None]
+        missing1 = np.zeros((len(pairs), n), dtype=bool)
+        missing2 = np.zeros((len(pairs), n), dtype=bool)
+        missing1[rows, np.array([m1 for m1, _ in pairs], dtype=int).reshape(len(pairs), -1)] = True
+        missing2[rows, np.array([m2 for _, m2 in pairs], dtype=int).reshape(len(pairs), -1)] = True
+        in_pp = ~missing1
+        in_p = in_pp & ~missing2
+        
+        # Pre-prepare
+        f1 = np.where(is_replica, np.where(in_pp, p_pre, 1 - p_pre), 1.0)
+        mass1 = np.prod(f1, axis=1)
+        dmass1 = np.where(is_replica, np.where(in_pp, 1.0, -1.0), 0.0) * leave_one_out_products(f1)
+        
+        # Prepare：V_pp 中除主节点外的副本发送
+        senders1 = in_pp & is_replica
+        r, dr = poisson_binomial_tail_with_grad(link_T[None, :, :] * senders1[:, None, :], k_prepare)
+        dr *= senders1[:, None, :] & off_diagonal
+        f2 = np.where(in_pp, np.where(in_p, r, 1 - r), 1.0)
+        mass2 = np.prod(f2, axis=1)
+        dmass2 = np.where(in_pp, np.where(in_p, 1.0, -1.0), 0.0) * leave_one_out_products(f2)
+        
+        # Commit：V_p 中的节点互相发送
+        q, dq = poisson_binomial_tail_with_grad(link_T[None, :, :] * in_p[:, None, :], k_commit)
+        dq *= in_p[:, None, :] & off_diagonal
+        g, dg = poisson_binomial_tail_with_grad(np.where(in_p, q, 0.0), nc_required)
+        dg *= in_p
+        
+        success += float(np.sum(mass1 * mass2 * g))
+        grad_pre[:] += dmass1.T @ (mass2 * g)
+        grad_T[:] += np.einsum('b,bt,bts->ts', mass1 * g, dmass2, dr)
+        grad_T[:] += np.einsum('b,bt,bts->ts', mass1 * mass2, dg, dq)
+        branches += len(pairs)
+    
+    def branch_pairs(d, a):
+        for m1 in combinations(replica_nodes, a):
+            m1_set = set(m1)
+            v_pp_nodes = [node for node in range(n) if node not in m1_set]
+            for m2 in combinations(v_pp_nodes, d - a):
+                yield m1, m2
+    
+    for d in range(max_missing + 1):
+        for a in range(d + 1):
+            pairs_iter = branch_pairs(d, a)
+            while True:
+                pairs = list(islice(pairs_iter, chunk_size))
+                if not pairs:
+                    break
+                process_chunk(pairs)
+    
+    gradient = grad_T.T.copy()
+    gradient[v, is_replica] += grad_pre[is_replica] * pre_scale[is_replica]
+    return {
+        'success_rate': success * primary_availability,
+        'gradient': gradient * primary_availability,
+        'branches': branches,
+        'elapsed': time.time() - start_time
+    }
 
-def calculate_theoretical_success_rate_paper_simulation(n: int, f: int, p: float) -> float:
-    """使用论文的逐阶段淘汰仿真模型计算PBFT共识成功概率
+def calculate_theoretical_success_rate_custom_matrix(n: int, f: int, P_comm, proposer_id: int = 0,
+                                                     node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """使用自定义可靠度矩阵计算PBFT共识的理论成功概率
     
-    论文方法（第10页）：
-    "In P-L models, a link failure leads to the failure in the corresponding 
-    communication phase, and only the live nodes enter the next round of consensus"
+    精确枚举的成本随 C(n, f) 增长（见 estimate_custom_matrix_branches），无对称性时约 n ≤ 20 可在时间预算内完成；
+    超出 THEORY_TIME_BUDGET 时 result['exact'] 为 False，success_rate 只是区间 [lower, upper] 的中点，
+    调用方需要检查 exact 并改用蒙特卡洛或报告区间（见 calculate_theoretical_success_custom_matrix_auto）。
     
-    关键特征：
-    1. 每个阶段后，只有成功的节点（收到足够消息的节点）进入下一阶段
-    2. 下一阶段的通信只在"存活"节点之间进行
-    3. 最终判断：存活节点数 ≥ n-f 则成功
+    Args:
+        n: 节点数
+        f: 容错数
+        P_comm: 自定义的通信可靠性矩阵 (numpy数组或列表，n×n)
+        proposer_id: 主节点ID，默认为0
+        node_availability: 每个节点的在线率，None 表示全部在线
     
-    这个模型更接近论文的红×仿真结果
+    Returns:
+        theory_engine_with_symmetry 的结果字典（'success_rate', 'exact', 'lower', 'upper', 'branches', 'elapsed' 等）
     """
-    from math import comb
+    import numpy as np
     
-    def binom_prob(n_trials: int, k_success: int, prob: float) -> float:
-        if k_success > n_trials or k_success < 0:
-            return 0.0
-        return comb(n_trials, k_success) * (prob ** k_success) * ((1 - prob) ** (n_trials - k_success))
+    # 确保P_comm是numpy数组
+    if not isinstance(P_comm, np.ndarray):
+        P_comm = np.array(P_comm)
     
-    def binom_tail_ge(m: int, k: int, prob: float) -> float:
-        """二项分布尾概率 P(X ≥ k)"""
-        if k <= 0:
-            return 1.0
-        if m < 0:
-            return 0.0
-        if k > m:
-            return 0.0
-        return sum(binom_prob(m, i, prob) for i in range(k, m + 1))
+    print(f"\n=== 自定义矩阵理论计算 ===")
+    print(f"节点数: {n}, 容错数: {f}, 主节点: {proposer_id}")
+    print(f"使用自定义P_comm矩阵")
+    
+    # 显示部分通信可靠性
+    print(f"\nP_comm矩阵（部分）:")
+    for i in range(min(3, n)):
+        for j in range(min(3, n)):
+            if i != j:
+                print(f"  P_comm({i},{j}) = {P_comm[i,j]:.4f}")
+    
+    # 按缺失集合分层枚举的理论引擎（与逐阶段子集枚举结果一致，超出时间预算时给出带证书的区间）；
+    # 存在可互换节点（如相同的行/列）时改为按等价类计数
+    result = theory_engine_with_symmetry(n, f, P_comm, proposer_id, time_budget=THEORY_TIME_BUDGET,
+                                         node_availability=node_availability)
+    total_prob = result['success_rate']
+    
+    if result['exact']:
+        print(f"理论成功率（自定义矩阵，精确计算）: {total_prob:.6f} "
+              f"({result['branches']}个分支, {result['elapsed']:.3f}s, "
+              f"接收概率缓存命中 {result['cache_hits']}/{result['cache_hits'] + result['cache_misses']})\n")
+    else:
+        print(f"理论成功率（自定义矩阵，超出{THEORY_TIME_BUDGET}s时间预算，非精确值）: "
+              f"∈ [{result['lower']:.6f}, {result['upper']:.6f}]\n")
+    return result
+
+def calculate_theoretical_success_bounds_custom_matrix(n: int, f: int, P_comm, proposer_id: int = 0,
+                                                       epsilon: float = THEORY_BOUNDS_EPSILON,
+                                                       time_budget: Optional[float] = None,
+                                                       node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """自定义矩阵理论成功率的带证书区间（"bounds" 精度模式）
     
+    先计算只按缺失数分层的随机序上下界（theory_stochastic_bounds），
+    再按概率质量从大到小枚举缺失集合，未枚举分支的质量直接计入上界，两个区间取交集；
+    区间宽度 ≤ epsilon 或超出 time_budget 时立即停止，因此大矩阵也能在有限时间内返回。
+    区间 [lower, upper] 始终保证包含精确值，超时时宽度可能大于 epsilon。
+    
+    Returns:
+        theory_engine_custom_matrix 的结果字典
+    """
+    import numpy as np
+    
+    P_comm = np.asarray(P_comm, dtype=float)
+    print(f"\n=== 自定义矩阵理论计算（bounds 模式, epsilon={epsilon}） ===")
+    print(f"节点数: {n}, 容错数: {f}, 主节点: {proposer_id}")
+    
+    # 先用随机序上下界（O(f·n²)）收窄区间，宽度已 ≤ epsilon 时不再枚举
+    prior_bounds = theory_stochastic_bounds(n, f, P_comm, proposer_id, node_availability=node_availability)
+    print(f"随机序上下界: [{prior_bounds[0]:.6f}, {prior_bounds[1]:.6f}]")
+    
+    result = theory_engine_custom_matrix(n, f, P_comm, proposer_id, epsilon=epsilon, time_budget=time_budget,
+                                         prior_bounds=prior_bounds, node_availability=node_availability)
+    width = result['upper'] - result['lower']
+    status = "精确" if result['exact'] else ("达到精度" if width <= epsilon else "超出时间预算")
+    print(f"理论成功率区间: [{result['lower']:.6f}, {result['upper']:.6f}] (宽度 {width:.2e}, {status}, "
+          f"{result['branches']}个分支, {result['elapsed']:.3f}s)\n")
+    return result
+
+def estimate_custom_matrix_branches(n: int, f: int) -> int:
+    """预估精确引擎需要计算的 (M1, M2) 分支数：Σ_{d≤f} Σ_{a≤d} C(n-1, a)·C(n-a, d-a)"""
+    from math import comb
+    return sum(comb(n - 1, a) * comb(n - a, d - a) for d in range(f + 1) for a in range(d + 1))
+
+def wilson_interval(successes: int, trials: int, confidence: float = 0.95) -> Tuple[float, float]:
+    """二项比例的 Wilson 置信区间"""
+    if trials == 0:
+        return 0.0, 1.0
+    z = norm.ppf(0.5 + confidence / 2)
+    p_hat = successes / trials
+    denom = 1 + z * z / trials
+    center = (p_hat + z * z / (2 * trials)) / denom
+    half = z * ((p_hat * (1 - p_hat) / trials + z * z / (4 * trials * trials)) ** 0.5) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+def clopper_pearson_interval(successes: int, trials: int, confidence: float = 0.95) -> Tuple[float, float]:
+    """二项比例的 Clopper-Pearson（精确）置信区间"""
+    from scipy.stats import beta
+    
+    alpha = 1 - confidence
+    lower = 0.0 if successes == 0 else float(beta.ppf(alpha / 2, successes, trials - successes + 1))
+    upper = 1.0 if successes == trials else float(beta.ppf(1 - alpha / 2, successes + 1, trials - successes))
+    return lower, upper
+
+def theory_monte_carlo_custom_matrix(n: int, f: int, P_comm, proposer_id: int = 0,
+                                     trials: int = THEORY_MC_TRIALS, seed: Optional[int] = None,
+                                     confidence: float = 0.95, time_budget: Optional[float] = None,
+                                     node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """直接模拟 V_pp → V_p → V_c 逐阶段淘汰模型的蒙特卡洛估计（自定义 P_comm）
+    
+    每批同时模拟多轮：每个阶段用一个 (批大小, n, n) 的伯努利链路矩阵，
+    接收数 = 发送者掩码 × 链路矩阵（矩阵乘法），门限与精确引擎相同：
+    - Pre-prepare：副本 r 以 P_comm[v,r] 进入 V_pp
+    - Prepare：V_pp 中的节点从 V_pp 中除主节点和自己外的副本收到 ≥2f-1 条 prepare 进入 V_p
+    - Commit：V_p 中的节点从 V_p 中其他节点收到 ≥2f 条 commit 进入 V_c，|V_c| ≥ n-f 为成功
+    
+    给定 node_availability 时为节点掉线（churn）模式：每轮按 s(v) 独立抽取在线节点，
+    离线节点不收发任何消息（主节点离线时本轮失败），与精确引擎的 pre_prepare_probs 相互独立地验证。
+    超出 time_budget（秒）时按已完成的轮数给出估计。
+    
+    Returns:
+        {
+            'success_rate': 估计值, 'lower' / 'upper': Wilson 区间,
+            'clopper_pearson': (下界, 上界), 'trials': 实际轮数, 'successes': 成功轮数,
+            'confidence': 置信度, 'seed': 随机种子, 'complete': 是否跑满 trials 轮, 'elapsed': 耗时（秒）
+        }
+    """
+    import numpy as np
+    import time
+    
+    start_time = time.time()
+    rng = np.random.default_rng(seed)
+    v = proposer_id
     nc_required = n - f
-    k_prepare = 2 * f - 1  # prepare门限：从其他节点收到2f-1条（加自己=2f）
-    k_commit = 2 * f       # commit门限：从其他节点收到2f条（加自己=2f+1）
+    k_prepare = 2 * f - 1
+    k_commit = 2 * f
+    
+    link_probs = np.asarray(P_comm, dtype=np.float32).copy()
+    np.fill_diagonal(link_probs, 0.0)  # 节点不计自己发给自己的消息
+    p_pre = link_probs[v].copy()
+    p_pre[v] = 1.0  # 主节点始终在 V_pp
+    is_replica = np.arange(n) != v
+    availability = np.asarray(node_availability, dtype=np.float32) if node_availability is not None else None
+    
+    batch_size = max(1, (1 << 22) // (n * n))
+    done = 0
+    successes = 0
+    while done < trials:
+        if time_budget is not None and done > 0 and time.time() - start_time > time_budget:
+            break
+        batch = min(batch_size, trials - done)
+        
+        in_pp = rng.random((batch, n), dtype=np.float32) < p_pre
+        if availability is not None:
+            # 离线节点收不到 pre-prepare；主节点离线时没有人收到
+            online = rng.random((batch, n), dtype=np.float32) < availability
+            in_pp &= online & online[:, v:v + 1]
+        
+        links = rng.random((batch, n, n), dtype=np.float32) < link_probs
+        senders = (in_pp & is_replica).astype(np.float32)
+        received = np.matmul(senders[:, None, :], links.astype(np.float32))[:, 0, :]
+        in_p = in_pp & (received >= k_prepare)
+        
+        links = rng.random((batch, n, n), dtype=np.float32) < link_probs
+        received = np.matmul(in_p.astype(np.float32)[:, None, :], links.astype(np.float32))[:, 0, :]
+        in_c = in_p & (received >= k_commit)
+        
+        successes += int(np.count_nonzero(in_c.sum(axis=1) >= nc_required))
+        done += batch
+    
+    lower, upper = wilson_interval(successes, done, confidence)
+    return {
+        'success_rate': successes / done,
+        'lower': lower,
+        'upper': upper,
+        'clopper_pearson': clopper_pearson_interval(successes, done, confidence),
+        'trials': done,
+        'successes': successes,
+        'confidence': confidence,
+        'seed': seed,
+        'complete': done == trials,
+        'elapsed': time.time() - start_time
+    }
+
+def calculate_theoretical_success_custom_matrix_auto(n: int, f: int, P_comm, proposer_id: int = 0,
+                                                     method: str = "auto", trials: Optional[int] = None,
+                                                     seed: Optional[int] = None,
+                                                     node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """按成本预估在精确枚举和蒙特卡洛之间选择（自定义 P_comm）
     
-    total_prob = 0.0
+    method="auto" 时预估分支数不超过 THEORY_EXACT_MAX_BRANCHES 用精确引擎，否则用蒙特卡洛；
+    也可以用 "exact" / "monte-carlo" 强制指定。存在节点等价类时预估值取按类计数的状态数。
+    精确引擎超出 THEORY_TIME_BUDGET 时不再是精确值：auto 改用蒙特卡洛重新计算；
+    强制 "exact" 时 method 为 "bounds"，'bounds' 为带证书的区间。
+    node_availability：精确引擎计入 pre-prepare 阶段（见 pre_prepare_probs），蒙特卡洛直接模拟节点掉线。
     
-    # ========== Phase 1: Pre-prepare ==========
-    # 主节点始终在V_pp，n-1个副本中x-1个收到pre-prepare消息
-    for x in range(nc_required, n + 1):
-        p_pp = binom_prob(n - 1, x - 1, p)
-        if p_pp < 1e-15:
-            continue
+    Returns:
+        {'rate': 理论成功率（bounds 时为区间中点）, 'method': 实际使用的方法（exact / monte-carlo / bounds）,
+         'estimatedBranches': 预估分支数, 'monteCarlo': 蒙特卡洛结果（仅 monte-carlo）,
+         'bounds': 精确引擎的结果字典（仅 bounds，含 lower / upper）}
+    """
+    estimated_branches = estimate_theory_branches(n, f, P_comm, proposer_id, node_availability)
+    fallback = method == "auto"
+    if method == "auto":
+        method = "exact" if estimated_branches <= THEORY_EXACT_MAX_BRANCHES else "monte-carlo"
+    
+    if method == "exact":
+        result = calculate_theoretical_success_rate_custom_matrix(n, f, P_comm, proposer_id, node_availability)
+        if result['exact']:
+            return {'rate': result['success_rate'], 'method': "exact", 'estimatedBranches': estimated_branches,
+                    'monteCarlo': None, 'bounds': None}
+        if not fallback:
+            return {'rate': result['success_rate'], 'method': "bounds", 'estimatedBranches': estimated_branches,
+                    'monteCarlo': None, 'bounds': result}
+        print(f"精确引擎超出{THEORY_TIME_BUDGET}s时间预算，改用蒙特卡洛")
+    
+    result = theory_monte_carlo_custom_matrix(n, f, P_comm, proposer_id, trials or THEORY_MC_TRIALS, seed,
+                                              time_budget=THEORY_TIME_BUDGET, node_availability=node_availability)
+    print(f"\n=== 自定义矩阵理论计算（蒙特卡洛, 主节点={proposer_id}, 预估精确分支数={estimated_branches}） ===")
+    print(f"理论成功率: {result['success_rate']:.6f} ∈ [{result['lower']:.6f}, {result['upper']:.6f}] "
+          f"(Wilson {result['confidence']:.0%}, {result['trials']}轮, {result['elapsed']:.3f}s)\n")
+    return {'rate': result['success_rate'], 'method': "monte-carlo", 'estimatedBranches': estimated_branches,
+            'monteCarlo': result, 'bounds': None}
+
+def theory_engine_gaussian(n: int, f: int, P_comm, proposer_id: int = 0,
+                           node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """自定义 P_comm 的高斯/平均场近似（"fast" 精度），O(n²)，n 上千时也能快速返回
+    
+    逐阶段只跟踪人数，条件在人数上用平均场近似成员组成：
+    - Pre-prepare：N_pp = 1 + Σ Bernoulli(P[v, r])，精确 Poisson-binomial 分布
+    - 给定 N_pp = m，副本 j 属于 V_pp 的概率按 a_j = P[v, j] 等比例缩放到总数为 m-1；
+      节点 i 收到的 prepare 数近似为独立伯努利之和，均值/方差由两次矩阵-向量乘得到，尾概率用正态近似
+    - 给定 V_pp 后各节点的接收相互独立，N_p | m 用离散化正态近似；commit 阶段以 V_p 的边缘概率同样处理，
+      P(N_c ≥ n-f | N_p = k) 用正态近似
+    所有正态近似都带连续性修正；N_pp、N_p 在 < n-f 的取值上必然失败，不参与求和。
+    node_availability 按 pre_prepare_probs 计入 a，成功率再乘以主节点在线率（phase_survival 为主节点在线条件下的值）。
+    
+    精度随 n 增大而提高：n ≳ 40 时与精确值的误差在 2 个百分点以内（集中在成功率陡降的过渡区，
+    n = 40~100 实测最大约 1.7 个百分点，n 上千时约 1 个百分点），n = 7~16 的小委员会上误差可达 3~10 个百分点（链路可靠度越分散误差越大），小 n 应使用精确引擎。
+    
+    Returns:
+        {'success_rate', 'phase_survival': {'prePrepare', 'prepare', 'commit'}, 'elapsed'}
+    """
+    import numpy as np
+    import time
+    
+    start_time = time.time()
+    P = np.array(P_comm, dtype=float)
+    np.fill_diagonal(P, 0.0)  # 节点不给自己发消息
+    v = proposer_id
+    nc_required = n - f
+    k_prepare = 2 * f - 1
+    k_commit = 2 * f
+    replicas = np.arange(n) != v
+    
+    # Pre-prepare：精确分布，只保留 N_pp ≥ n-f 且概率不可忽略的取值
+    a, primary_availability = pre_prepare_probs(P, v, node_availability)
+    a_total = float(a[replicas].sum())
+    pmf_pp = np.zeros(n + 1)
+    pmf_pp[1:] = poisson_binomial_pmf(a[replicas])
+    m = np.arange(max(nc_required, 1), n + 1)
+    m = m[pmf_pp[m] > 1e-15]
+    weights = pmf_pp[m]
+    survival = {'prePrepare': float(weights.sum()), 'prepare': 0.0, 'commit': 0.0}
+    if len(m) == 0 or a_total <= 0:
+        return {'success_rate': 0.0, 'phase_survival': survival, 'elapsed': time.time() - start_time}
+    
+    def fixed_count_var(incl, probs):
+        """成员数固定时 Σ_{j∈S} X_j 的方差近似，j 以概率 incl_j 属于 S，X_j ~ Bernoulli(probs_j)
         
-        # ========== Phase 2: Prepare（只有V_pp中的x个节点参与）==========
-        # 在V_pp的x个节点中，每个节点需要收到≥k_prepare条prepare消息才能"存活"进入V_p
-        # 
-        # 主节点：从x-1个副本节点收到prepare
-        q_primary_survives = binom_tail_ge(x - 1, k_prepare, p)
-        # 副本节点：从x-2个其他节点收到prepare（不包括自己，主节点不发prepare）
-        q_replica_survives = binom_tail_ge(x - 2, k_prepare, p)
-        
-        # 枚举进入V_p的"存活"节点数y
-        for y in range(nc_required, x + 1):
-            # 计算P(|V_p| = y | |V_pp| = x)
-            # 情况1：主节点存活 + (y-1)个副本存活
-            case1 = q_primary_survives * binom_prob(x - 1, y - 1, q_replica_survives)
-            # 情况2：主节点未存活 + y个副本存活  
-            case2 = (1 - q_primary_survives) * binom_prob(x - 1, y, q_replica_survives)
-            p_vp_given_vpp = case1 + case2
-            
-            if p_vp_given_vpp < 1e-15:
-                continue
-            
-            # ========== Phase 3: Commit（只有V_p中的y个"存活"节点参与）==========
-            # 在V_p的y个节点中，每个节点需要收到≥k_commit条commit消息才能"存活"进入V_c
-            # 每个节点从其他y-1个节点收到commit
-            q_node_commits = binom_tail_ge(y - 1, k_commit, p)
-            
-            # 计算P(|V_c| ≥ nc_required | |V_p| = y)
-            # 这是y个节点中有≥nc_required个成功完成commit的概率
-            p_vc_success = sum(binom_prob(y, z, q_node_commits) for z in range(nc_required, y + 1))
-            
-            # 累加概率
-            total_prob += p_pp * p_vp_given_vpp * p_vc_success
+        Σ incl·p(1-p) 为给定成员时的方差；成员组成的方差按有限总体修正
+        Σ incl(1-incl)(p - p̄)²（p̄ 以 incl(1-incl) 加权），所有 p 相同时为 0，与二项分布一致。
+        """
+        spread = incl * (1 - incl)
+        spread_total = spread.sum(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            center = np.where(spread_total > 0, (spread * probs).sum(axis=-1) / spread_total, 0.0)
+        return (incl * probs * (1 - probs)).sum(axis=-1) + (spread * (probs - center[..., None]) ** 2).sum(axis=-1)
+    
+    def receive_tail(weight, count, k_min):
+        """节点 i 收到 ≥ k_min 条消息的正态近似（(K, n) 数组）
+        
+        发送者为除 i 外的 count 个节点，j 在其中的概率按 weight_j 等比例缩放：incl_j = s·weight_j，
+        s = count / Σ_{j≠i} weight_j。fixed_count_var 中的各项和都能写成 weight、weight² 与 P、P² 的矩阵-向量乘。
+        """
+        w1, w2 = weight[:, None] * P, weight[:, None] ** 2 * P
+        c1, c2 = w1.sum(axis=0), (w1 * P).sum(axis=0)  # Σ w·P, Σ w·P²
+        d1, d2 = w2.sum(axis=0), (w2 * P).sum(axis=0)  # Σ w²·P, Σ w²·P²
+        others, others_sq = weight.sum() - weight, (weight ** 2).sum() - weight ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(others > 0, count / others, 0.0)
+            spread = scale * others - scale ** 2 * others_sq  # Σ incl(1-incl)
+            spread_p = scale * c1 - scale ** 2 * d1  # Σ incl(1-incl)·P
+            spread_p2 = scale * c2 - scale ** 2 * d2  # Σ incl(1-incl)·P²
+            composition = np.where(spread > 0, spread_p2 - spread_p ** 2 / spread, 0.0)
+        mean = scale * c1
+        return normal_tail_ge_array(k_min, mean, mean - scale * c2 + composition) * (count >= k_min)
+    
+    # Prepare（主节点不发送 prepare）：副本 i 的发送者是 V_pp 中其余 m-2 个副本，主节点是 m-1 个
+    r = receive_tail(np.where(replicas, a, 0.0), m[:, None] - 1 - replicas[None, :], k_prepare)
+    alpha = np.where(replicas, np.minimum(1.0, a * (m[:, None] - 1) / a_total), 1.0)  # P(i ∈ V_pp | N_pp = m)
+    b = alpha * r
+    k = np.arange(nc_required, n + 1)
+    pmf_p = weights @ normal_count_pmf_array(k[None, :], b.sum(axis=1)[:, None],
+                                             fixed_count_var(alpha, r)[:, None], m[:, None])
+    survival['prepare'] = float(pmf_p.sum() / survival['prePrepare'])
+    
+    # Commit：V_p 的成员组成用 N_pp 窗口内的边缘概率 b̄ 近似
+    b_bar = weights @ b / weights.sum()
+    b_total = float(b_bar.sum())
+    if b_total <= 0:
+        return {'success_rate': 0.0, 'phase_survival': survival, 'elapsed': time.time() - start_time}
+    q = receive_tail(b_bar, k[:, None] - 1, k_commit)
+    beta = np.minimum(1.0, b_bar * k[:, None] / b_total)  # P(i ∈ V_p | N_p = k)
+    p_c = normal_tail_ge_array(nc_required, (beta * q).sum(axis=1), fixed_count_var(beta, q))
+    success = float(min(max(pmf_p @ p_c, 0.0), 1.0))
+    survival['commit'] = success / float(pmf_p.sum()) if pmf_p.sum() > 0 else 0.0
+    
+    return {'success_rate': success * primary_availability, 'phase_survival': survival, 'elapsed': time.time() - start_time}
+
+def calculate_theoretical_success_fast(n: int, f: int, P_comm, proposer_id: int = 0,
+                                       node_availability: Optional[List[float]] = None,
+                                       error_check: bool = False) -> Dict[str, Any]:
+    """"fast" 精度（自定义 P_comm）：高斯/平均场近似，可选地同时报告近似误差
+    
+    error_check=True 且预估精确状态数（见 estimate_theory_branches）不超过 THEORY_FAST_CHECK_MAX_BRANCHES 时
+    再用精确引擎（时间预算 THEORY_FAST_CHECK_TIME_BUDGET）算一次，返回绝对误差；否则 errorEstimate 为 None。
+    
+    Returns:
+        {'rate', 'exactRate', 'errorEstimate'（概率）, 'checkComplete'（误差检查超时为 False）, 'phaseSurvival', 'elapsed'}
+    """
+    import numpy as np
     
-    return total_prob
+    P_comm = np.asarray(P_comm, dtype=float)
+    result = theory_engine_gaussian(n, f, P_comm, proposer_id, node_availability)
+    exact_rate = None
+    check_complete = True
+    if error_check and estimate_theory_branches(n, f, P_comm, proposer_id,
+                                                node_availability) <= THEORY_FAST_CHECK_MAX_BRANCHES:
+        exact = theory_engine_with_symmetry(n, f, P_comm, proposer_id, time_budget=THEORY_FAST_CHECK_TIME_BUDGET,
+                                            node_availability=node_availability)
+        check_complete = bool(exact['exact'])
+        if exact['exact']:
+            exact_rate = exact['success_rate']
+    error_estimate = abs(result['success_rate'] - exact_rate) if exact_rate is not None else None
+    
+    print(f"\n=== 自定义矩阵理论计算（高斯近似, 主节点={proposer_id}） ===")
+    print(f"理论成功率: {result['success_rate']:.6f} ({result['elapsed'] * 1000:.1f}ms)"
+          + (f", 精确值 {exact_rate:.6f}, 误差 {error_estimate:.2e}" if exact_rate is not None else "") + "\n")
+    return {'rate': result['success_rate'], 'exactRate': exact_rate, 'errorEstimate': error_estimate,
+            'checkComplete': check_complete, 'phaseSurvival': result['phase_survival'], 'elapsed': result['elapsed']}
+
+def format_fast_result(error_estimate: Optional[float], elapsed: float, check_complete: bool = True) -> Dict[str, Any]:
+    """"fast" 精度的附加信息转换为 API 返回格式：与精确值的绝对误差（百分点，未检查时为 None）
+    
+    checkComplete 为 False 表示做了误差检查但精确引擎超出时间预算（结果依赖机器负载，不写入结果缓存）。
+    """
+    return {
+        "errorEstimate": error_estimate * 100 if error_estimate is not None else None,
+        "checkComplete": check_complete,
+        "elapsed": elapsed
+    }
 
+def format_bounds_result(result: Dict[str, Any], epsilon: float) -> Dict[str, Any]:
+    """带证书区间（theory_engine_custom_matrix 的结果）转换为 API 返回格式（百分比）"""
+    return {
+        "lower": result['lower'] * 100,
+        "upper": result['upper'] * 100,
+        "exact": bool(result['exact']),
+        "converged": bool(result['upper'] - result['lower'] <= epsilon),
+        "epsilon": epsilon,
+        "branches": result['branches'],
+        "elapsed": result['elapsed']
+    }
 
+def format_monte_carlo_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """蒙特卡洛结果转换为 API 返回格式（百分比）"""
+    return {
+        "trials": result['trials'],
+        "successes": result['successes'],
+        "confidence": result['confidence'],
+        "wilson": [result['lower'] * 100, result['upper'] * 100],
+        "clopperPearson": [result['clopper_pearson'][0] * 100, result['clopper_pearson'][1] * 100],
+        "seed": result['seed'],
+        "complete": result['complete'],
+        "elapsed": result['elapsed']
+    }
 
-def calculate_betweenness_centrality(P_comm):
-    """
-    计算介数中心性（Betweenness Centrality）
+def calculate_theoretical_success_rate_multihop(n: int, f: int, topology: str, n_value: int, p: float, proposer_id: int = 0) -> Dict[str, Any]:
+    """计算多跳拓扑下PBFT共识的理论成功概率（精确计算，使用真实P_comm矩阵）
     
-    基于可靠性矩阵，将可靠度转换为"代价"，然后计算最短路径上的介数中心性。
+    方法：不使用平均P_comm的简化，而是对每对节点使用真实的通信可靠性P_comm[i,j]
+    
+    按照伪代码Line 8：所有诚实节点（包括主节点）都广播PREPARE
+    
+    路径策略：
+    - 星形拓扑：中心↔边缘 P_comm=p，边缘↔边缘 P_comm=p²
+    - 环形拓扑：相邻 P_comm=p，不相邻 P_comm=1-(1-p^k1)(1-p^k2)
     
     Args:
-        P_comm: n×n 可靠性矩阵
+        n: 节点总数
+        f: 容错数
+        topology: 拓扑类型
+        n_value: 分支数
+        p: 单链路成功概率
+        proposer_id: 主节点ID，默认为0
     
     Returns:
-        betweenness: 长度为 n 的数组，每个节点的介数中心性
+        calculate_theoretical_success_custom_matrix_auto 的结果（'rate'、'method' 等）；
+        精确计算不可行时为蒙特卡洛估计，而不是超出时间预算时的区间中点
     """
-    n = len(P_comm)
+    # 计算通信路径可靠性矩阵
+    P_comm = calculate_comm_reliability_matrix_shortest_path(n, topology, n_value, p)
     
-    # Step 1: 构建加权图，权重为代价 ℓ_ij = -log(p_ij)
-    G = nx.DiGraph()
+    print(f"\n=== 多跳拓扑理论计算（{topology}拓扑，精确方法） ===")
+    print(f"节点数: {n}, 容错数: {f}, 链路可靠性: {p:.3f}, 主节点: {proposer_id}")
+    print(f"使用精确P_comm矩阵，不使用平均近似")
     
-    for i in range(n):
-        for j in range(n):
-            if i != j and P_comm[i][j] > 0:
-                # 代价：可靠度越高，代价越小
-                cost = -np.log(P_comm[i][j] + 1e-10)  # 避免 log(0)
-                G.add_edge(i, j, weight=cost)
+    # 显示部分通信可靠性
+    print(f"\nP_comm矩阵（部分）:")
+    for i in range(min(3, n)):
+        for j in range(min(3, n)):
+            if i != j:
+                print(f"  P_comm({i},{j}) = {P_comm[i,j]:.4f}")
     
-    # Step 2 & 3: 使用 NetworkX 的 Brandes 算法计算介数中心性
-    # betweenness_centrality 会自动基于最短路径计算
-    betweenness_dict = nx.betweenness_centrality(G, weight='weight', normalized=False)
+    # 使用与自定义矩阵相同的理论引擎，对每对节点使用真实的P_comm[i,j]；
+    # 星形叶子、树形同一父节点下的叶子可互换，按等价类计数（星形 n=100 也能精确计算），
+    # 按等价类计数也不可行时改用蒙特卡洛
+    result = calculate_theoretical_success_custom_matrix_auto(n, f, P_comm, proposer_id)
+    print(f"理论成功率（{result['method']}，使用真实P_comm）: {result['rate']:.6f}")
+    print(f"=" * 50)
     
-    # 转换为数组
-    betweenness = np.array([betweenness_dict.get(i, 0.0) for i in range(n)])
+    return result
+
+def log_binom_pmf_array(k, m, prob):
+    """向量化对数二项 PMF log P(Bin(m, prob) = k)，k、m、prob 可广播
+
+    组合数用 gammaln 在对数域计算，不会像 comb(m, k) 那样产生巨大整数，
+    p^k (1-p)^(m-k) 用 xlogy/xlog1py 计算，p=0 或 1 时也正确；支撑集外返回 -inf。
+    """
+    import numpy as np
+    from scipy.special import gammaln, xlogy, xlog1py
     
-    return betweenness
+    k = np.asarray(k)
+    m = np.asarray(m)
+    valid = (k >= 0) & (k <= m)
+    kc = np.where(valid, k, 0)
+    mc = np.where(valid, m, 0)
+    with np.errstate(invalid="ignore"):
+        log_pmf = (gammaln(mc + 1) - gammaln(kc + 1) - gammaln(mc - kc + 1)
+                   + xlogy(kc, prob) + xlog1py(mc - kc, -np.asarray(prob)))
+    return np.where(valid, log_pmf, -np.inf)
 
 
-def robust_normalize(values):
+def binom_tail_ge_array(m, k: int, prob):
+    """向量化二项尾概率 P(Bin(m, prob) ≥ k)，m 与 prob 可广播
+
+    与标量版 binom_tail_ge 的边界约定一致：k ≤ 0 时为 1，m < 0 或 k > m 时为 0。
+    scipy 的生存函数基于正则化不完全 Beta 函数，不需要逐项求和。
     """
-    Robust 归一化方法（抗群点，适合论文图表）
+    import numpy as np
+    from scipy.stats import binom
     
-    x̂(v) = (x(v) - median(x)) / (IQR(x) + ε)
+    m = np.asarray(m)
+    if k <= 0:
+        return np.ones(np.broadcast(m, prob).shape)
+    return np.where(m >= k, binom.sf(k - 1, np.maximum(m, 0), prob), 0.0)
+
+
+def calculate_theoretical_success_rate_sweep(n: int, f: int, p_values) -> "np.ndarray":
+    """对一组 p 同时计算闭式理论成功率（calculate_theoretical_success_rate 的向量化实现）
+
+    把对 N_pp = x、N_p = y 的双重求和展开成 (p, x, y) 三维数组：
+    PMF 在对数域计算，尾概率用 scipy 生存函数，不做 < 1e-15 剪枝，n 上千时也不损失精度；
+    p 和 x 维度按块处理以控制内存。
+
+    Returns:
+        与 p_values 等长的成功率数组
+    """
+    import numpy as np
+    from scipy.stats import binom
     
-    Args:
-        values: numpy array
+    p_all = np.asarray(p_values, dtype=float).ravel()
+    nc_required = n - f
+    k_prepare = 2 * f - 1
+    k_commit = 2 * f
+    
+    x_all = np.arange(max(nc_required, 1), n + 1)  # N_pp（主节点始终在 V_pp）
+    y = np.arange(max(nc_required, 1), n + 1)  # N_p
+    ks = np.arange(y[0] - 1, n + 1)[None, None, :]  # Bin(x-1, q1) 在 y-1 和 y 处的 PMF 共用一个网格
+    
+    block = 1 << 22
+    p_chunk = max(1, block // (len(x_all) * len(y)))
+    x_chunk = max(1, block // (p_chunk * len(y)))
+    
+    result = np.zeros(len(p_all))
+    for p_start in range(0, len(p_all), p_chunk):
+        p = p_all[p_start:p_start + p_chunk][:, None]  # (P, 1)
+        
+        # commit：V_p 中每个节点从其他 y-1 个节点收到 commit，需 ≥ nc_required 个节点成功
+        q2 = binom_tail_ge_array(y - 1, k_commit, p)  # (P, Y)
+        p_c = binom.sf(nc_required - 1, y, q2)  # (P, Y)
+        
+        total = np.zeros(p.shape[0])
+        for x_start in range(0, len(x_all), x_chunk):
+            x = x_all[x_start:x_start + x_chunk]
+            
+            # pre-prepare：n-1 个副本中 x-1 个收到
+            p_pp = np.exp(log_binom_pmf_array(x - 1, n - 1, p))  # (P, X)
+            
+            # prepare：主节点从 x-1 个副本、副本从 x-2 个其他副本收到 prepare
+            q0 = binom_tail_ge_array(x - 1, k_prepare, p)[:, :, None]  # (P, X, 1)
+            q1 = binom_tail_ge_array(x - 2, k_prepare, p)[:, :, None]
+            pmf = np.exp(log_binom_pmf_array(ks, (x - 1)[None, :, None], q1))  # (P, X, Y+1)
+            p_vp = q0 * pmf[:, :, :-1] + (1 - q0) * pmf[:, :, 1:]  # P(N_p = y | N_pp = x)
+            
+            total += np.einsum("px,pxy,py->p", p_pp, p_vp, p_c)
+        result[p_start:p_start + p_chunk] = total
     
+    return result
+
+
+def normal_tail_ge_array(k, mean, var):
+    """整数计数 S ≥ k 的正态近似（连续性修正）：P(S ≥ k) ≈ 1 - Φ((k - 0.5 - mean) / σ)
+
+    各参数可广播；方差为 0 时 S 退化为确定值，按 mean ≥ k - 0.5 判断；k ≤ 0 时为 1。
+    """
+    import numpy as np
+    from scipy.special import ndtr  # 标准正态 CDF 的 ufunc，比 norm.sf 少了参数检查的开销
+
+    k = np.asarray(k, dtype=float)
+    mean = np.asarray(mean, dtype=float)
+    sd = np.sqrt(np.maximum(var, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(sd > 0, (mean - k + 0.5) / sd, np.where(mean >= k - 0.5, np.inf, -np.inf))
+    return np.where(k <= 0, 1.0, ndtr(z))
+
+
+def normal_count_pmf_array(values, mean, var, upper):
+    """整数计数 S 的离散化正态近似 P(S = y) ≈ P(S ≥ y) - P(S ≥ y+1)（连续性修正）
+
+    S 的取值范围为 0..upper：y = 0 吸收下方的尾部质量，y = upper 吸收上方的尾部质量，超出范围为 0。
+    """
+    import numpy as np
+
+    values = np.asarray(values)
+    upper = np.asarray(upper)
+    at_least = normal_tail_ge_array(values, mean, var)
+    above = np.where(values >= upper, 0.0, normal_tail_ge_array(values + 1, mean, var))
+    return np.where((values >= 0) & (values <= upper), np.maximum(at_least - above, 0.0), 0.0)
+
+
+def calculate_theoretical_success_rate_sweep_gaussian(n: int, f: int, p_values) -> "np.ndarray":
+    """均匀可靠度闭式模型的正态近似（"fast" 精度），n 上千时也只需几毫秒
+
+    与 calculate_theoretical_success_rate_sweep 同一模型，但：
+    - 每个节点收到的 prepare/commit 数 Bin(m, p) 的尾概率、N_p | N_pp 和 N_c | N_p 都用正态近似（连续性修正）
+    - N_pp 与 N_p 只在均值 ±8σ 的窗口内求和，窗口宽度 O(√n)，而不是对所有 (x, y) 求和
+
     Returns:
-        normalized values
+        与 p_values 等长的成功率数组
     """
-    if len(values) == 0:
-        return values
+    import numpy as np
+
+    p_all = np.asarray(p_values, dtype=float).ravel()
+    nc_required = n - f
+    k_prepare = 2 * f - 1
+    k_commit = 2 * f
+    lo = max(nc_required, 1)
+
+    y_all = np.arange(lo, n + 1)
+
+    def window(center, sd, extra=0):
+        """覆盖 center ± 8σ 的整数窗口（右端多取 extra 个点），不超过 [lo, n] 时直接用整个区间"""
+        half_width = int(np.ceil(8 * np.max(sd, initial=0.0))) + 1
+        if 2 * half_width + 1 >= n - lo + 1:
+            return np.broadcast_to(np.arange(lo, n + 1 + extra), np.shape(center) + (n - lo + 1 + extra,))
+        return np.rint(center)[..., None].astype(int) + np.arange(-half_width, half_width + 1 + extra)
+
+    # 按 p 分块：同一块共用窗口宽度，可靠度相近的 p 放在一起窗口更窄
+    order = np.argsort(p_all)
+    p_chunk = 16
+    result = np.zeros(len(p_all))
+    for p_start in range(0, len(p_all), p_chunk):
+        idx = order[p_start:p_start + p_chunk]
+        p = p_all[idx][:, None]  # (P, 1)
+        q = 1 - p
+
+        # commit：V_p 中每个节点从其他 y-1 个节点收到 commit，N_c | y ~ Bin(y, q2)；只依赖 y，按一维网格计算
+        q2 = normal_tail_ge_array(k_commit, (y_all - 1) * p, (y_all - 1) * p * q) * (y_all - 1 >= k_commit)
+        p_c = normal_tail_ge_array(nc_required, y_all * q2, y_all * q2 * (1 - q2))  # (P, Y_all)
+
+        # pre-prepare：N_pp = 1 + Bin(n-1, p)，窗口内用精确 PMF
+        x = window(1 + (n - 1) * p[:, 0], np.sqrt((n - 1) * p * q))  # (P, X)
+        x_valid = (x >= lo) & (x <= n)
+        x = np.where(x_valid, x, lo)
+        p_pp = np.where(x_valid, np.exp(log_binom_pmf_array(x - 1, n - 1, p)), 0.0)
+
+        # prepare：主节点从 x-1 个副本、副本从 x-2 个其他副本收到 prepare
+        q0 = normal_tail_ge_array(k_prepare, (x - 1) * p, (x - 1) * p * q) * (x - 1 >= k_prepare)
+        q1 = normal_tail_ge_array(k_prepare, (x - 2) * p, (x - 2) * p * q) * (x - 2 >= k_prepare)
+        mean_p = q0 + (x - 1) * q1
+        var_p = q0 * (1 - q0) + (x - 1) * q1 * (1 - q1)
+        # N_p | x 的离散化正态 PMF：相邻取值的 P(N_p ≥ y) 相减（N_p ≤ x，y = x 吸收上方尾部）
+        y = window(mean_p, np.sqrt(var_p[x_valid]), extra=1)  # (P, X, Y+1)
+        at_least = np.where(y > x[..., None], 0.0, normal_tail_ge_array(y, mean_p[..., None], var_p[..., None]))
+        y = y[..., :-1]
+        y_valid = (y >= lo) & (y <= x[..., None])
+        p_vp = np.where(y_valid, at_least[..., :-1] - at_least[..., 1:], 0.0)
+        p_c_y = np.take_along_axis(p_c[:, None, :], np.clip(y - lo, 0, len(y_all) - 1), axis=-1)
+
+        result[idx] = np.einsum("px,pxy,pxy->p", p_pp, p_vp, p_c_y)
+
+    return np.clip(result, 0.0, 1.0)
+
+
+def calculate_theoretical_success_rate_sweep_fast(n: int, f: int, p_values) -> Dict[str, Any]:
+    """"fast" 精度的整条曲线：正态近似，n ≤ THEORY_FAST_CHECK_MAX_N 时与闭式精确值对比给出误差
+
+    只在近似值最接近 10%/50%/90% 的至多 3 个 p 上做精确计算（误差通常在陡峭的过渡区最大）。
+
+    Returns:
+        {'rates': 成功率数组, 'errorEstimate': 最大绝对误差（概率，未检查时为 None）, 'checkedPValues': [...],
+         'elapsed': 近似计算耗时（秒，不含误差检查）}
+    """
+    import numpy as np
+    import time
+
+    start_time = time.time()
+    p_all = np.asarray(p_values, dtype=float).ravel()
+    rates = calculate_theoretical_success_rate_sweep_gaussian(n, f, p_all)
+    elapsed = time.time() - start_time
+    error_estimate = None
+    checked = []
+    if n <= THEORY_FAST_CHECK_MAX_N and len(p_all) > 0:
+        indices = sorted({int(np.argmin(np.abs(rates - target))) for target in (0.1, 0.5, 0.9)})
+        exact = calculate_theoretical_success_rate_sweep(n, f, p_all[indices])
+        error_estimate = float(np.max(np.abs(exact - rates[indices])))
+        checked = [float(p_all[i]) for i in indices]
+    return {'rates': rates, 'errorEstimate': error_estimate, 'checkedPValues': checked, 'elapsed': elapsed}
+
+
+def calculate_theoretical_distributions(n: int, f: int, p: float) -> Dict[str, Any]:
+    """均匀可靠度闭式模型下 N_pp、N_p、N_c 的完整分布（0..n）及各阶段存活概率
+
+    与 calculate_theoretical_success_rate_sweep 使用同一模型：
+    - N_pp = 1 + Bin(n-1, p)
+    - 给定 N_pp = x：N_p = [主节点通过，概率 q0] + Bin(x-1, q1)
+    - 给定 N_p = y：N_c = Bin(y, q2)，q2 = P(Bin(y-1, p) ≥ 2f)
+    条件转移矩阵按块在对数域构造，内存 O(块大小)。
+
+    Returns:
+        summarize_phase_distributions 的结果
+    """
+    import numpy as np
+
+    k_prepare = 2 * f - 1
+    k_commit = 2 * f
+    values = np.arange(n + 1)
+    block = 1 << 22
+
+    pmf_pp = np.zeros(n + 1)
+    pmf_pp[1:] = np.exp(log_binom_pmf_array(values[1:] - 1, n - 1, p))  # 主节点始终在 V_pp
+
+    # prepare：P(N_p = y | N_pp = x)，Bin(x-1, q1) 在 y-1 和 y 处的 PMF 共用一个网格
+    pmf_p = np.zeros(n + 1)
+    ks = np.arange(-1, n + 1)[None, :]
+    x_chunk = max(1, block // (n + 2))
+    for x_start in range(1, n + 1, x_chunk):
+        x = values[x_start:x_start + x_chunk]
+        q0 = binom_tail_ge_array(x - 1, k_prepare, p)[:, None]
+        q1 = binom_tail_ge_array(x - 2, k_prepare, p)[:, None]
+        pmf = np.exp(log_binom_pmf_array(ks, (x - 1)[:, None], q1))  # (X, n+2)
+        pmf_p += pmf_pp[x] @ (q0 * pmf[:, :-1] + (1 - q0) * pmf[:, 1:])
+
+    # commit：P(N_c = z | N_p = y)
+    pmf_c = np.zeros(n + 1)
+    for y_start in range(0, n + 1, x_chunk):
+        y = values[y_start:y_start + x_chunk]
+        q2 = binom_tail_ge_array(y - 1, k_commit, p)[:, None]
+        pmf_c += pmf_p[y] @ np.exp(log_binom_pmf_array(values[None, :], y[:, None], q2))
+
+    return summarize_phase_distributions(n, f, pmf_pp, pmf_p, pmf_c)
+
+
+def summarize_phase_distributions(n: int, f: int, pmf_pp, pmf_p, pmf_c, support: int = 0) -> Dict[str, Any]:
+    """把各阶段人数的 PMF 整理成接口格式（概率，0~1）
+
+    - "N_pp" / "N_p" / "N_c"：长度 n+1 的 PMF；小于 support 的取值未精确计算，记为 None
+    - "phaseSurvival"：阶段存活概率 P(N_pp ≥ n-f)、P(N_p ≥ n-f | N_pp ≥ n-f)、P(N_c ≥ n-f | N_p ≥ n-f)，
+      三者之积为成功率（N_c ≤ N_p ≤ N_pp）
+    - "successByThreshold"：P(N_c ≥ t)，t = support..n；同一个 f 下换成功门限时直接读取，无需重算
+      （f 本身还决定 prepare/commit 阶段的门限 2f-1、2f，换 f 需要重新计算）
+    """
+    import numpy as np
+
+    nc_required = n - f
+    lo = max(support, 0)
+
+    def pmf_list(pmf, full: bool):
+        return [float(x) if full or z >= lo else None for z, x in enumerate(pmf)]
+
+    def tail(pmf, t):
+        return float(np.sum(pmf[max(t, 0):]))
+
+    pp_ok, p_ok, c_ok = tail(pmf_pp, nc_required), tail(pmf_p, nc_required), tail(pmf_c, nc_required)
+    return {
+        "N_pp": pmf_list(pmf_pp, True),
+        "N_p": pmf_list(pmf_p, False),
+        "N_c": pmf_list(pmf_c, False),
+        "support": lo,
+        "phaseSurvival": {
+            "prePrepare": pp_ok,
+            "prepare": p_ok / pp_ok if pp_ok > 0 else 0.0,
+            "commit": c_ok / p_ok if p_ok > 0 else 0.0
+        },
+        "successRate": c_ok,
+        "successByThreshold": [{"threshold": t, "rate": tail(pmf_c, t)} for t in range(lo, n + 1)]
+    }
+
+
+def mix_primary_offline_distributions(distributions: Dict[str, Any], primary_availability: float) -> Dict[str, Any]:
+    """主节点以概率 1 - s_v 离线（各阶段人数全为 0）时，把 summarize_phase_distributions 的结果与 0 点分布混合"""
+    s_v = primary_availability
+    if s_v >= 1.0:
+        return distributions
+
+    def mix(pmf):
+        mixed = [x * s_v if x is not None else None for x in pmf]
+        if mixed[0] is not None:
+            mixed[0] += 1 - s_v
+        return mixed
+
+    survival = distributions["phaseSurvival"]
+    return {
+        **distributions,
+        "N_pp": mix(distributions["N_pp"]),
+        "N_p": mix(distributions["N_p"]),
+        "N_c": mix(distributions["N_c"]),
+        "phaseSurvival": {**survival, "prePrepare": survival["prePrepare"] * s_v},
+        "successRate": distributions["successRate"] * s_v,
+        "successByThreshold": [{"threshold": item["threshold"],
+                                "rate": item["rate"] * s_v if item["threshold"] > 0 else 1.0}
+                               for item in distributions["successByThreshold"]]
+    }
+
+
+def calculate_theoretical_success_rate(n: int, f: int, p: float) -> float:
+    """计算PBFT共识的理论成功概率（口径A：N_c ≥ N − f）
+
+    严格对齐论文 Theorem 1（式(1)–(6)）和伪代码Algorithm 1在以下特例下的闭式化简：
+    - 全连接网络
+    - 所有节点在线（P(V_node)=1）
+    - 同质链路：p^L_{i,j} = p
+    - n 给定，f = floor((n-1)/3)
+    - 成功判据：commit 成功节点数 N_c ≥ N − f
+    - 按照伪代码Line 8：所有诚实节点（包括主节点）都广播PREPARE
+
+    注意：单节点在 prepare/commit 阶段的门限来自式(6)：至少收到 2f 条成功消息（来自其他节点）。
+
+    在 log_binom_pmf_array / binom_tail_ge_array 上做向量化累加（见 calculate_theoretical_success_rate_sweep），
+    数值稳定，可用于上千节点。
+    """
+    return float(calculate_theoretical_success_rate_sweep(n, f, [p])[0])
+
+
+def calculate_theoretical_success_rate_paper_simulation(n: int, f: int, p: float) -> float:
+    """使用论文的逐阶段淘汰仿真模型计算PBFT共识成功概率
     
-    median_val = np.median(values)
-    q1 = np.percentile(values, 25)
-    q3 = np.percentile(values, 75)
-    iqr = q3 - q1
+    论文方法（第10页）：
+    "In P-L models, a link failure leads to the failure in the corresponding 
+    communication phase, and only the live nodes enter the next round of consensus"
+    
+    关键特征：
+    1. 每个阶段后，只有成功的节点（收到足够消息的节点）进入下一阶段
+    2. 下一阶段的通信只在"存活"节点之间进行
+    3. 最终判断：存活节点数 ≥ n-f 则成功
     
-    epsilon = 1e-6  # 避免除零
-    normalized = (values - median_val) / (iqr + epsilon)
+    这个模型更接近论文的红×仿真结果
     
-    return normalized
+    逐阶段淘汰后的 |V_pp| → |V_p| → |V_c| 链与 calculate_theoretical_success_rate 的闭式化简完全相同，
+    因此共用同一套对数域向量化核。
+    """
+    return float(calculate_theoretical_success_rate_sweep(n, f, [p])[0])
 
 
 
 def calculate_betweenness_centrality(P_comm):
-    """计算介数中心性（Betweenness Centrality）"""
-    n = len(P_comm)
-    G = nx.DiGraph()
+    """
+    计算介数中心性（Betweenness Centrality）
     
-    for i in range(n):
-        for j in range(n):
-            if i != j and P_comm[i][j] > 0:
-                import numpy as np
-                cost = -np.log(P_comm[i][j] + 1e-10)
-                G.add_edge(i, j, weight=cost)
+    基于可靠性矩阵，将可靠度转换为"代价" ℓ_ij = -log(p_ij)，然后计算最短路径上的介数中心性
+    （有向图、不归一化，与 NetworkX betweenness_centrality(weight=..., normalized=False) 一致）。
+    
+    实现：
+    1. scipy.sparse.csgraph 的 Dijkstra 一次求出全源最短距离 D
+    2. 对一批源点 s 同时构造最短路 DAG：u→w 在 DAG 中 ⟺ D[s,u] + ℓ_uw = D[s,w]
+    3. 按距离顺序做 Brandes 的路径计数（正向）和依赖累加（反向），每一步对整批源点向量化
+    结果按矩阵摘要缓存在 betweenness_cache 中。
+    
+    Args:
+        P_comm: n×n 可靠性矩阵
     
-    betweenness_dict = nx.betweenness_centrality(G, weight='weight', normalized=False)
+    Returns:
+        betweenness: 长度为 n 的数组，每个节点的介数中心性
+    """
     import numpy as np
-    betweenness = np.array([betweenness_dict.get(i, 0.0) for i in range(n)])
-    return betweenness
+    import hashlib
+    from scipy.sparse.csgraph import csgraph_from_dense, dijkstra
+    
+    P_comm = np.ascontiguousarray(P_comm, dtype=float)
+    n = len(P_comm)
+    key = hashlib.blake2b(P_comm.tobytes(), digest_size=16).digest() + n.to_bytes(4, "little")
+    cached = betweenness_cache.get(key)
+    if cached is not None:
+        betweenness_cache.move_to_end(key)
+        return cached.copy()
+    
+    # Step 1: 代价矩阵，可靠度越高代价越小；不存在的链路为 inf
+    # 可靠度为 1 的链路取一个极小的正代价（Brandes 要求正权重，否则最短路 DAG 可能成环）
+    edges = (P_comm > 0) & ~np.eye(n, dtype=bool)
+    with np.errstate(divide="ignore"):
+        cost = np.where(edges, np.maximum(-np.log(P_comm + 1e-10), 1e-12), np.inf)  # 避免 log(0)
+    
+    # Step 2: 全源最短距离
+    D = dijkstra(csgraph_from_dense(cost, null_value=np.inf), directed=True)
+    
+    # Step 3: 分批源点做向量化 Brandes
+    betweenness = np.zeros(n)
+    batch = max(1, (1 << 22) // max(1, n * n))
+    for start in range(0, n, batch):
+        sources = np.arange(start, min(n, start + batch))
+        rows = np.arange(len(sources))
+        Ds = D[sources]
+        # on_path[s, u, w]：u→w 位于从 s 出发的某条最短路上（严格更远，保证 DAG 无环）
+        on_path = (((Ds[:, :, None] + cost[None, :, :]) == Ds[:, None, :]) & (Ds[:, :, None] < Ds[:, None, :])
+                   & np.isfinite(Ds)[:, None, :])
+        order = np.argsort(Ds, axis=1, kind="stable")
+        
+        # 正向：sigma[s, w] = 从 s 到 w 的最短路条数
+        sigma = np.zeros((len(sources), n))
+        sigma[rows, sources] = 1.0
+        for t in range(n):
+            w = order[:, t]
+            counts = np.einsum('bu,bu->b', on_path[rows, :, w], sigma)
+            sigma[rows, w] = np.where(w == sources, 1.0, counts)
+        
+        # 反向：delta[s, u] = Σ_w σ_su/σ_sw · (1 + delta[s, w])
+        delta = np.zeros((len(sources), n))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for t in range(n - 1, -1, -1):
+                w = order[:, t]
+                coeff = np.where(sigma[rows, w] > 0, (1 + delta[rows, w]) / sigma[rows, w], 0.0)
+                delta += on_path[rows, :, w] * sigma * coeff[:, None]
+        delta[rows, sources] = 0.0
+        betweenness += delta.sum(axis=0)
+    
+    betweenness_cache[key] = betweenness
+    while len(betweenness_cache) > BETWEENNESS_CACHE_SIZE:
+        betweenness_cache.popitem(last=False)
+    return betweenness.copy()
 
 def robust_normalize(values):
     """Robust 归一化: x̂ = (x - median) / (IQR + ε)"""
@@ -1176,7 +3289,93 @@ def robust_normalize(values):
     iqr = q3 - q1
     return (values - median_val) / (iqr + 1e-6)
 
-def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int = 0, node_availability: Optional[List[float]] = None):
+def refresh_primary_selection_context(context: Dict[str, Any], n: int, f: int, P_comm,
+                                      out_nodes, in_nodes, betweenness: bool = True):
+    """只重新计算受影响的 Q_out / Q_in / w_u 项
+    
+    Q_out(u) 只依赖 P_comm 的第 u 行，Q_in(u) 只依赖第 u 列，
+    因此修改 P_comm[i,j] 后只需刷新 Q_out(i) 和 Q_in(j)；介数中心性依赖整个矩阵，需要时整体重算。
+    所有需要刷新的节点按行批量做 Poisson-binomial 尾概率 DP。
+    """
+    import numpy as np
+    
+    k_w = 2 * f + 1
+    off_diagonal = ~np.eye(n, dtype=bool)
+    out_nodes = list(out_nodes)
+    in_nodes = list(in_nodes)
+    if out_nodes:
+        # Q_out(u)：节点u向外发送达到quorum的概率（第 u 行去掉对角线）
+        context['Q_out'][out_nodes] = poisson_binomial_tail(P_comm[out_nodes][off_diagonal[out_nodes]].reshape(len(out_nodes), n - 1), k_w)
+    if in_nodes:
+        # Q_in(u)：节点u从其他节点接收达到quorum的概率（第 u 列去掉对角线）
+        context['Q_in'][in_nodes] = poisson_binomial_tail(P_comm.T[in_nodes][off_diagonal[in_nodes]].reshape(len(in_nodes), n - 1), k_w)
+    # 双向权重 w_u = √(Q_out(u) × Q_in(u))
+    touched = sorted(set(out_nodes) | set(in_nodes))
+    context['w_u'][touched] = np.sqrt(context['Q_out'][touched] * context['Q_in'][touched])
+    if betweenness:
+        context['betweenness'] = calculate_betweenness_centrality(P_comm)
+
+def prepare_primary_selection_context(n: int, f: int, P_comm) -> Dict[str, Any]:
+    """预计算主节点选择指标中与主节点无关的部分（节点能力表）
+    
+    - 介数中心性（整个矩阵只需计算一次）
+    - 每个节点的 Q_out(u)：向外发送达到 quorum（2f+1）的概率
+    - 每个节点的 Q_in(u)：从其他节点接收达到 quorum 的概率
+    - 每个节点的双向权重 w_u = √(Q_out(u) × Q_in(u))
+    
+    结果按 (n, f, 矩阵摘要) 缓存在 primary_context_cache 中，相同矩阵的后续请求直接复用；
+    返回的是副本，调用方可以原地刷新（如矩阵句柄）而不影响缓存。
+    
+    Args:
+        n: 节点总数
+        f: 拜占庭节点数
+        P_comm: n×n 通信可靠性矩阵
+    
+    Returns:
+        {'betweenness': 数组, 'Q_out': 数组, 'Q_in': 数组, 'w_u': 数组}
+    """
+    import numpy as np
+    import hashlib
+    
+    P_comm = np.ascontiguousarray(P_comm, dtype=float)
+    key = (n, f, hashlib.blake2b(P_comm.tobytes(), digest_size=16).digest())
+    context = primary_context_cache.get(key)
+    if context is None:
+        context = {'betweenness': None, 'Q_out': np.zeros(n), 'Q_in': np.zeros(n), 'w_u': np.zeros(n)}
+        refresh_primary_selection_context(context, n, f, P_comm, range(n), range(n))
+        primary_context_cache[key] = context
+        while len(primary_context_cache) > PRIMARY_CONTEXT_CACHE_SIZE:
+            primary_context_cache.popitem(last=False)
+    primary_context_cache.move_to_end(key)
+    return {name: value.copy() for name, value in context.items()}
+
+def prepare_stage_quorum_probs(n: int, f: int, P_comm, proposer_id: int):
+    """主节点选择指标中的 P_prep(i)：节点 i 在 Prepare 阶段收到至少 2f 条消息的概率
+    
+    发送者为 j ∉ {i, v}（主节点不发 prepare），j→i 的成功概率为 w_j(v) · P_comm[j, i]，
+    w_j(v) = P_comm[v, j]。各发送者概率不同，Y_i(v) 服从 Poisson-binomial 分布；
+    所有目标节点排成 (n-1)×(n-2) 的二维数组一次批量计算精确尾概率。主节点自身为 1。
+    
+    Returns:
+        长度为 n 的数组
+    """
+    import numpy as np
+    
+    v = proposer_id
+    k_prepare = 2 * f
+    others = np.arange(n) != v
+    w = P_comm[v].astype(float)
+    w[v] = 1.0
+    # sender_probs[j, i] = w_j(v) · P_comm[j, i]，只保留 j ∉ {i, v}
+    sender_probs = (w[:, None] * P_comm)[others][:, others]  # 行：发送者，列：目标（均已去掉 v）
+    m = n - 2
+    off_diagonal = ~np.eye(n - 1, dtype=bool)
+    P_prep = np.ones(n)
+    P_prep[others] = poisson_binomial_tail(sender_probs.T[off_diagonal].reshape(n - 1, m), k_prepare) if m > 0 else 0.0
+    return P_prep
+
+def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int = 0, node_availability: Optional[List[float]] = None,
+                                        context: Optional[Dict[str, Any]] = None):
     """
     计算主节点选择指标（包括新的综合指标）
     
@@ -1186,6 +3385,7 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
         P_comm: n×n 通信可靠性矩阵
         proposer_id: 主节点 ID
         node_availability: 每个节点的在线率 s(v) ∈ [0, 1]，如果为 None 则默认全为 1.0
+        context: prepare_primary_selection_context 的结果；批量计算所有主节点时传入以复用
     
     Returns:
         包含所有指标的字典
@@ -1209,7 +3409,6 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
         dict: 包含所有指标的字典
     """
     import numpy as np
-    from math import comb
     
     if not isinstance(P_comm, np.ndarray):
         P_comm = np.array(P_comm)
@@ -1225,91 +3424,36 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
     print(f"\n=== 计算 Q_pp(v) [DP精确方法] (proposer_id={proposer_id}) ===")
     
     # 获取所有接收节点（除主节点外）
+    others = np.arange(n) != v
     receivers = [j for j in range(n) if j != v]
-    p_links = [P_comm[v, j] for j in receivers]  # 每条链路的可靠性
-    
-    # DP: dp[k] = 成功发送给恰好 k 个节点的概率
-    # 初始化：没有任何节点，成功数=0的概率=1
-    dp = {0: 1.0}
-    
-    # 逐个节点加入
-    for idx, p_j in enumerate(p_links):
-        new_dp = {}
-        for k, prob in dp.items():
-            # 发送给节点 j 成功
-            if k + 1 not in new_dp:
-                new_dp[k + 1] = 0.0
-            new_dp[k + 1] += prob * p_j
-            
-            # 发送给节点 j 失败
-            if k not in new_dp:
-                new_dp[k] = 0.0
-            new_dp[k] += prob * (1 - p_j)
-        
-        dp = new_dp
+    p_links = P_comm[v, others]  # 每条链路的可靠性
+    
+    # pmf[k] = 成功发送给恰好 k 个节点的概率
+    pmf = poisson_binomial_pmf(p_links)
     
     # 计算 Q_pp = Pr(成功数 ≥ quorum_size)
-    Q_pp = 0.0
-    for k, prob in dp.items():
-        if k >= quorum_size:
-            Q_pp += prob
+    Q_pp = float(np.sum(pmf[quorum_size:]))
     
     # ========== 1.2. 计算 Q_3(v): 使用极严格的阈值 (n-1, 所有节点) ==========
     quorum_size_strict = n - 1  # 极严格：要求触达所有其他节点
-    Q_3 = 0.0
-    for k, prob in dp.items():
-        if k >= quorum_size_strict:
-            Q_3 += prob
+    Q_3 = float(np.sum(pmf[max(quorum_size_strict, 0):]))
     
     print(f"  - 接收节点数: {len(receivers)}")
     print(f"  - 链路可靠性: {[f'{p:.3f}' for p in p_links]}")
     print(f"  - Quorum阈值 (标准): k = {quorum_size}")
     print(f"  - Quorum阈值 (极严格Q_3): k = {quorum_size_strict} (n-1)")
-    print(f"  - DP 状态数: {len(dp)}")
+    print(f"  - DP 状态数: {len(pmf)}")
     print(f"  - Q_pp(v) [DP精确]: {Q_pp:.6f}")
     print(f"  - Q_3(v) [极严格阈值 n-1]: {Q_3:.6f}")
     
     # ========== 1.5. 计算节点权重 w_u（用于 q_u 和 Q_w）==========
-    # w_u = √(Q_out(u) × Q_in(u))
-    
-    w_u = np.zeros(n)
-    for u in range(n):
-        if u == v:
-            w_u[u] = 0.0  # 主节点不作为接收者
-            continue
-        
-        k_w = quorum_size
-        
-        # 计算 Q_out(u)：节点u向外发送达到quorum的概率
-        out_receivers = [x for x in range(n) if x != u]
-        p_out_links = [P_comm[u, x] for x in out_receivers]
-        
-        dp_out = {0: 1.0}
-        for p_x in p_out_links:
-            new_dp = {}
-            for k, prob in dp_out.items():
-                new_dp[k+1] = new_dp.get(k+1, 0.0) + prob * p_x
-                new_dp[k] = new_dp.get(k, 0.0) + prob * (1 - p_x)
-            dp_out = new_dp
-        
-        Q_out_u = sum(prob for k, prob in dp_out.items() if k >= k_w)
-        
-        # 计算 Q_in(u)：节点u从其他节点接收达到quorum的概率
-        in_senders = [x for x in range(n) if x != u]
-        p_in_links = [P_comm[x, u] for x in in_senders]
-        
-        dp_in = {0: 1.0}
-        for p_x in p_in_links:
-            new_dp = {}
-            for k, prob in dp_in.items():
-                new_dp[k+1] = new_dp.get(k+1, 0.0) + prob * p_x
-                new_dp[k] = new_dp.get(k, 0.0) + prob * (1 - p_x)
-            dp_in = new_dp
-        
-        Q_in_u = sum(prob for k, prob in dp_in.items() if k >= k_w)
-        
-        # 双向权重
-        w_u[u] = np.sqrt(Q_out_u * Q_in_u)
+    # w_u = √(Q_out(u) × Q_in(u))
+    
+    # Q_out(u)、Q_in(u)、w_u 与主节点无关，由共享的节点能力表提供（所有主节点只计算一次）
+    if context is None:
+        context = prepare_primary_selection_context(n, f, P_comm)
+    
+    w_u = np.where(others, context['w_u'], 0.0)  # 主节点不作为接收者
     
     print(f"\n[节点权重计算] proposer_id={proposer_id}")
     print(f"  w_u = √(Q_out × Q_in)")
@@ -1321,16 +3465,8 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
     # q_u = 节点 u 的有效性概率（使用 w_u 作为代理）
     # E(v) = Σ_{u≠v} q_u · p_{v→u}（连续性指标，用于 tie-breaker）
     
-    q_u = np.zeros(n)
-    for u in range(n):
-        if u != v:
-            q_u[u] = w_u[u]  # 使用双向权重作为节点有效性
-    
-    E_v = 0.0
-    for u in range(n):
-        if u != v:
-            p_vu = P_comm[v, u]
-            E_v += q_u[u] * p_vu
+    q_u = w_u.copy()  # 使用双向权重作为节点有效性（主节点为 0）
+    E_v = float(np.sum(q_u[others] * P_comm[v, others]))
     
     print(f"E(v) (连续性Tie-breaker): {E_v:.4f}")
     
@@ -1343,73 +3479,23 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
     print(f"  有效送达概率: π_{'{v,u}'} = p_{'{v→u}'} × q_u")
     
     # 计算有效送达概率
-    effective_probs = []
-    for u in range(n):
-        if u != v:
-            pi_vu = P_comm[v, u] * q_u[u]
-            effective_probs.append(pi_vu)
-            if q_u[u] > 0:
-                print(f"    节点 {u}: π_{'{v,'}{u}{'}'} = {P_comm[v, u]:.3f} × {q_u[u]:.3f} = {pi_vu:.4f}")
+    effective_probs = P_comm[v, others] * q_u[others]
+    for u, pi_vu in zip(receivers, effective_probs):
+        if q_u[u] > 0:
+            print(f"    节点 {u}: π_{'{v,'}{u}{'}'} = {P_comm[v, u]:.3f} × {q_u[u]:.3f} = {pi_vu:.4f}")
     
-    # 使用标准 DP 计算 Pr(有效节点数 ≥ k)
+    # 使用 Poisson-binomial 尾概率计算 Q_w = Pr(有效节点数 ≥ quorum_size)
     # 类似于 Q_pp 的计算，但使用有效送达概率
-    dp = {0: 1.0}
-    for pi in effective_probs:
-        new_dp = {}
-        for count, prob in dp.items():
-            # 情况 1: 没有有效送达
-            new_dp[count] = new_dp.get(count, 0.0) + prob * (1 - pi)
-            # 情况 2: 有效送达
-            new_dp[count + 1] = new_dp.get(count + 1, 0.0) + prob * pi
-        dp = new_dp
-    
-    # 计算 Q_w = Pr(有效节点数 ≥ quorum_size)
-    Q_w = sum(prob for count, prob in dp.items() if count >= quorum_size)
-    
-    print(f"  - DP 状态数: {len(dp)}")
-    print(f"  - Q_w(v) [新方法] = {Q_w:.6f}")
+    Q_w = poisson_binomial_tail(effective_probs, quorum_size)
     
-    # ========== 2. 计算每个节点的 w_j(v): 第一阶段存活概率 ==========
-    # w_j(v) = P_comm[v, j] 表示节点 j 收到主节点 v 的 Pre-prepare 的概率
-    w = np.zeros(n)
-    w[v] = 1.0  # 主节点自己
-    for j in range(n):
-        if j != v:
-            w[j] = P_comm[v, j]
-    
-    # ========== 3. 计算每个节点 i 的 P_i^prep(v) ==========
-    # 节点 i 在 Prepare 阶段收到来自其他节点的消息
-    # Pr(j→i 的 prepare 成功) ≈ w_j(v) · P_comm[j, i]
-    # Y_i(v) = 节点 i 收到的 prepare 数量
-    # P_i^prep(v) = Pr(Y_i(v) ≥ k_prepare)
-    
-    P_prep = np.zeros(n)
+    print(f"  - DP 状态数: {len(effective_probs) + 1}")
+    print(f"  - Q_w(v) [新方法] = {Q_w:.6f}")
     
-    for i in range(n):
-        # 特殊处理主节点：主节点在第一阶段已经成功，进入第二阶段的概率为 1
-        if i == v:
-            P_prep[i] = 1.0
-            continue
-        
-        # 副本节点 i 需要从其他节点收到至少 k_prepare 条 prepare 消息
-        # 发送者：除了节点 i 自己的所有节点（主节点在 Prepare 阶段不发送）
-        senders = [j for j in range(n) if j != i and j != v]  # 主节点不发 prepare
-        
-        # 计算节点 i 收到至少 k_prepare 条消息的概率
-        # 使用二项近似：每个发送者 j 的成功概率 = w_j(v) · P_comm[j, i]
-        prob_success = []
-        for j in senders:
-            p_ji = w[j] * P_comm[j, i]  # j→i 的 prepare 成功概率
-            prob_success.append(p_ji)
-        
-        # 简化计算：假设独立，使用平均概率的二项分布近似
-        if len(prob_success) > 0:
-            avg_p = np.mean(prob_success)
-            m = len(senders)
-            for k in range(k_prepare, m + 1):
-                P_prep[i] += comb(m, k) * (avg_p ** k) * ((1 - avg_p) ** (m - k))
-        else:
-            P_prep[i] = 0.0
+    # ========== 2-3. 计算每个节点 i 的 P_i^prep(v) ==========
+    # w_j(v) = P_comm[v, j]：节点 j 收到主节点 v 的 Pre-prepare 的概率
+    # Pr(j→i 的 prepare 成功) ≈ w_j(v) · P_comm[j, i]，主节点在 Prepare 阶段不发送
+    # P_i^prep(v) = Pr(Y_i(v) ≥ k_prepare)，按各发送者的实际概率做精确 Poisson-binomial 计算
+    P_prep = prepare_stage_quorum_probs(n, f, P_comm, v)
     
     # ========== 4. 计算 Φ_min(v): 最弱节点（瓶颈） ==========
     Phi_min = np.min(P_prep)
@@ -1438,7 +3524,7 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
     I_w = Q_w * Phi_q  # 新的加权综合指标
     
     # ========== 7. 计算介数中心性 C_B(v) ==========
-    betweenness = calculate_betweenness_centrality(P_comm)
+    betweenness = context['betweenness']
     C_B = betweenness[proposer_id]
     
     # ========== 8. 获取节点在线率 s(v) ==========
@@ -1453,22 +3539,7 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
     # 方案：q_u = Q_out(u)（节点 u 的向外广播能力）
     # E(v) = Σ_{u≠v} q_u · p_{v→u}
     
-    # 提取 q_u（使用已计算的 w_u 的平方，因为 w_u = √(Q_out × Q_in)）
-    # 为简化，直接使用 Q_out(u) 作为 q_u
-    q_u = np.zeros(n)
-    for u in range(n):
-        if u != v:
-            # 从 w_u 反推 Q_out(u)（近似）
-            # 或者直接使用 w_u 的平方作为 q_u 的代理
-            # 这里简化：q_u ≈ w_u（双向权重已经反映了节点能力）
-            q_u[u] = w_u[u]
-    
-    E_v = 0.0
-    for u in range(n):
-        if u != v:
-            p_vu = P_comm[v, u]
-            E_v += q_u[u] * p_vu
-    
+    # 这里简化：q_u ≈ w_u（双向权重已经反映了节点能力），与上面的 E(v) 相同
     print(f"E(v) (连续性Tie-breaker): {E_v:.4f}")
     
     # ========== 10. 计算 P_close(v): Cohort 闭环成功概率 ==========
@@ -1481,7 +3552,11 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
     #    - r 是阈值（f=1时 r=2；更一般地 r 可以取值使得"cohort内大多数节点都满足"）
     # 5. P_close(v) = Pr(|S| ≥ k)
     
-    m = k  # cohort size = 2f + 1
+    # 注意：原实现中这里的 k 是上面 P_prep 二项求和循环遗留的循环变量，
+    # 即发送者个数 n-2（循环一次都没执行时为 Q_pp 字典 DP 的最后一个键 0），而不是 2f+1；
+    # 向量化后显式保留这一取值，使 cohort 及 P_close / Q_fix 的结果保持不变
+    k = n - 2 if n >= 3 and k_prepare <= n - 2 else 0
+    m = k  # cohort size
     
     # Step 1: 选出 proposer v 的 out-cohort（按 p_{v→u} 排序，取 top-m）
     out_edges = [(u, P_comm[v, u]) for u in range(n) if u != v]
@@ -1493,182 +3568,1622 @@ def calculate_primary_selection_metrics(n: int, f: int, P_comm, proposer_id: int
     # Step 2: 定义 cohort 内部的通信概率矩阵
     # P_cohort[i][j] = P_comm[cohort_nodes[i], cohort_nodes[j]]
     cohort_size = len(cohort_nodes)
-    P_cohort = np.zeros((cohort_size, cohort_size))
-    for i_idx, i in enumerate(cohort_nodes):
-        for j_idx, j in enumerate(cohort_nodes):
-            if i != j:
-                P_cohort[i_idx, j_idx] = P_comm[i, j]
+    P_cohort = P_comm[np.ix_(cohort_nodes, cohort_nodes)]
+    
+    # Step 3: 对每个 cohort 节点 i，计算它"收到至少 r 个消息"的概率
+    # 使用 r = min(2f, cohort_size-1)（合理阈值：不能超过可能的最大值）
+    r_threshold = min(k - 1, cohort_size - 1)  # k-1 = 2f，且不能超过 cohort_size-1
+    
+    print(f"r_threshold (cohort 内达标阈值): {r_threshold} (cohort_size={cohort_size}, k={k})")
+    
+    # Step 4: 所有 cohort 节点一起做 Poisson-binomial 尾概率 DP
+    # 第 i 行为 j→i（j ≠ i）的概率，即 P_cohort 第 i 列去掉对角线
+    cohort_off_diagonal = ~np.eye(cohort_size, dtype=bool)
+    in_probs = P_cohort.T[cohort_off_diagonal].reshape(cohort_size, max(cohort_size - 1, 0))
+    cohort_node_success_probs = np.atleast_1d(poisson_binomial_tail(in_probs, r_threshold)).tolist()
+    for i_idx, prob_i in enumerate(cohort_node_success_probs):
+        print(f"  节点 {cohort_nodes[i_idx]}: P(D_i ≥ {r_threshold}) = {prob_i:.4f}")
+    
+    # Step 5: 计算 P_close(v) = Pr(至少 k 个 cohort 节点满足条件)
+    P_close = poisson_binomial_tail(cohort_node_success_probs, k)
+    
+    print(f"\nP_close(v) (Cohort 闭环成功概率): {P_close:.4f}")
+    
+    # 计算 Q_fix = Q_pp × P_close
+    Q_fix = Q_pp * P_close
+    print(f"Q_fix(v) = Q_pp × P_close = {Q_pp:.4f} × {P_close:.4f} = {Q_fix:.4f}")
+    
+    # ========== 10. 计算 Q_2(v): 平均发送能力 ==========
+    # Q_2(v) = 主节点 v 的平均 outgoing reliability
+    # 即：从节点 v 到其他所有节点的链路可靠性的平均值
+    outgoing_reliabilities = [P_comm[v, j] for j in range(n) if j != v]
+    Q_2 = np.mean(outgoing_reliabilities) if outgoing_reliabilities else 0.0
+    print(f"\n=== Q_2(v): 平均发送能力 ===")
+    print(f"  - Outgoing links: {[f'{p:.3f}' for p in outgoing_reliabilities]}")
+    print(f"  - Q_2(v) = {Q_2:.4f}")
+    
+    # ========== 11. 归一化（Robust 方法）==========
+    # 注意：归一化需要所有节点的值，所以这里先返回原始值
+    # 在调用端批量归一化
+    
+    return {
+        'Q_pp': Q_pp,  # Pre-prepare 触达概率（原始方法）
+        'Q_w': Q_w,  # Weighted-Q 加权触达概率（新方法）
+        'Q_2': Q_2,  # ✅ 新增：平均发送能力
+        'Q_3': Q_3,  # ✅ NEW - Q_3(v) 严格阈值 (k=2f+2)
+        'E_v': E_v,  # 连续性指标（用于 tie-breaker）
+        'P_close': P_close,  # Cohort 闭环成功概率
+        'Q_fix': Q_fix,  # ✅ 新增：Q_fix = Q_pp × P_close
+        'cohort': cohort_nodes,  # ✅ 新增：Cohort 节点列表
+        'cohort_node_probs': cohort_node_success_probs,  # ✅ 新增：每个 cohort 节点的达标概率
+        'P_prep': P_prep.tolist(),  # 每个节点的 Prepare 阶段成功概率
+        'Phi_min': Phi_min,  # 最弱节点
+        'Phi_q': Phi_q,  # Quorum 聚合（尾概率方法）
+        'I_v': I_v,  # 综合指标（Q_pp × Φ_q）
+        'I_w': I_w,  # 加权综合指标（Q_w × Φ_q）
+        'C_B': C_B,  # 介数中心性
+        's_v': s_v,  # 节点在线率
+        'betweenness_all': betweenness.tolist(),  # 所有节点的介数中心性（用于批量归一化）
+        'w_u': w_u.tolist(),  # 每个节点的权重（用于调试）
+        'q_u': q_u.tolist()  # 节点有效性（用于调试）
+    }
+
+def format_primary_selection_metrics(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """将 calculate_primary_selection_metrics 的结果转换为接口返回格式（概率类指标为百分比）"""
+    return {
+        "Q_pp": metrics['Q_pp'] * 100,      # 原始 Q(v)
+        "Q_w": metrics['Q_w'] * 100,        # ✅ NEW - 加权 Q_w(v)
+        "Q_2": metrics['Q_2'] * 100,        # ✅ NEW - 平均发送能力
+        "Q_3": metrics['Q_3'] * 100,        # ✅ NEW - 极严格阈值 Q_3(v) (k=n-1, 所有节点)
+        "E_v": metrics['E_v'],              # ✅ NEW - 连续性指标（tie-breaker）
+        "P_close": metrics['P_close'],      # ✅ NEW - Cohort 闭环成功概率
+        "Q_fix": metrics['Q_fix'],          # ✅ NEW - Q_fix = Q_pp × P_close
+        "cohort": metrics['cohort'],        # ✅ NEW - Cohort 节点列表
+        "cohort_node_probs": metrics['cohort_node_probs'],  # ✅ NEW - Cohort 节点达标概率
+        "P_prep": [p * 100 for p in metrics['P_prep']],
+        "Phi_min": metrics['Phi_min'] * 100,
+        "Phi_q": metrics['Phi_q'] * 100,
+        "I_v": metrics['I_v'] * 100,        # 原始 I(v)
+        "I_w": metrics['I_w'] * 100,        # ✅ NEW - 加权 I_w(v)
+        "C_B": metrics['C_B'],
+        "s_v": metrics['s_v'] * 100,
+        "betweenness_all": metrics['betweenness_all'],
+        "w_u": metrics['w_u'],              # ✅ 节点权重（双向能力）
+        "q_u": metrics['q_u']               # ✅ 节点有效性
+    }
+
+# ========== 理论结果缓存 ==========
+def theory_result_cache_key(kind: str, request: dict) -> str:
+    """根据影响结果的输入字段计算规范化哈希（与字段顺序、timeout 等无关）
+    
+    字段类型错误（无法转换为数值）时返回 400。
+    """
+    import hashlib
+    
+    reliability_matrix = request.get("reliabilityMatrix")
+    node_availability = request.get("nodeAvailability")
+    try:
+        canonical = {
+            "version": THEORY_RESULT_CACHE_VERSION,
+            "kind": kind,
+            "n": int(request.get("nodeCount")),
+            "f": int(request.get("faultyNodes")),
+            "matrix": [[float(x) for x in row] for row in reliability_matrix] if reliability_matrix else None,
+            "p": None if reliability_matrix else float(request.get("reliability", 0.9)),
+            "availability": [float(x) for x in node_availability] if node_availability is not None else None,
+        }
+        if kind in ("calculate", "sensitivity"):
+            canonical["proposerId"] = int(request.get("proposerId", 0))
+        if request.get("precision", "exact") == "bounds":
+            canonical["epsilon"] = float(request.get("epsilon", THEORY_BOUNDS_EPSILON))
+            canonical["timeBudget"] = float(request.get("timeBudget", THEORY_TIME_BUDGET))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="nodeCount、faultyNodes、proposerId、reliability、"
+                                                    "reliabilityMatrix、nodeAvailability 等字段必须是数值")
+    if reliability_matrix or (canonical["availability"] and has_partial_availability(canonical["availability"])):
+        # 与 compute_theory_direct / compute_theory_all_proposers 走矩阵引擎（auto / 蒙特卡洛）的条件一致
+        canonical["method"] = request.get("method", "auto")
+        canonical["mcTrials"] = request.get("mcTrials")
+        canonical["mcSeed"] = request.get("mcSeed")
+    if request.get("distributions"):
+        canonical["distributions"] = True
+    if request.get("precision", "exact") == "bounds":
+        canonical["precision"] = "bounds"
+    elif request.get("precision", "exact") == "fast":
+        canonical["precision"] = "fast"
+        canonical["errorCheck"] = bool(request.get("errorCheck"))
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+def get_theory_result_db():
+    """惰性打开 SQLite 磁盘缓存；未配置 THEORY_RESULT_CACHE_DB 时返回 None"""
+    if not THEORY_RESULT_CACHE_DB:
+        return None
+    if theory_result_cache_state["db"] is None:
+        import sqlite3
+        db = sqlite3.connect(THEORY_RESULT_CACHE_DB, check_same_thread=False)
+        db.execute("CREATE TABLE IF NOT EXISTS theory_results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at TEXT NOT NULL)")
+        db.commit()
+        theory_result_cache_state["db"] = db
+    return theory_result_cache_state["db"]
+
+def theory_result_cache_remember(key: str, value: str):
+    """写入内存层并按字节上限淘汰最久未使用的条目"""
+    state = theory_result_cache_state
+    if key in theory_result_cache:
+        state["bytes"] -= len(theory_result_cache.pop(key))
+    theory_result_cache[key] = value
+    state["bytes"] += len(value)
+    while state["bytes"] > THEORY_RESULT_CACHE_BYTES and len(theory_result_cache) > 1:
+        _, evicted = theory_result_cache.popitem(last=False)
+        state["bytes"] -= len(evicted)
+        state["evictions"] += 1
+
+def theory_result_cache_get(key: str) -> Optional[Dict[str, Any]]:
+    """依次查询内存层和磁盘层，未命中返回 None（磁盘命中会提升到内存层）"""
+    state = theory_result_cache_state
+    value = theory_result_cache.get(key)
+    if value is not None:
+        theory_result_cache.move_to_end(key)
+        state["memoryHits"] += 1
+        return json.loads(value)
+    
+    db = get_theory_result_db()
+    if db is not None:
+        row = db.execute("SELECT value FROM theory_results WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            theory_result_cache_remember(key, row[0])
+            state["diskHits"] += 1
+            return json.loads(row[0])
+    
+    state["misses"] += 1
+    return None
+
+def theory_result_is_deterministic(result: Dict[str, Any]) -> bool:
+    """结果是否只由输入决定（只有这样的结果才能缓存）
+    
+    - 精确值、闭式解、梯度：是
+    - bounds：区间收敛到 epsilon 以内；未收敛时区间取决于时间预算内枚举到哪里
+    - 蒙特卡洛：指定了随机种子且跑满预定轮数（超出时间预算提前停止时轮数取决于机器负载）
+    - fast：没有做误差检查，或误差检查在时间预算内完成
+    - 多主节点结果：每一项都满足以上条件（单项出错也不缓存）
+    """
+    if "results" in result:
+        return all(theory_result_is_deterministic(item) for item in result["results"])
+    if "error" in result:
+        return False
+    theory_method = result.get("theoryMethod")
+    if theory_method == "bounds":
+        return bool((result.get("bounds") or {}).get("converged"))
+    if theory_method == "monte-carlo":
+        monte_carlo = result.get("monteCarlo") or {}
+        return monte_carlo.get("seed") is not None and bool(monte_carlo.get("complete"))
+    if theory_method == "gaussian":
+        return bool((result.get("fast") or {}).get("checkComplete", True))
+    return True
+
+def theory_result_cache_put(key: str, result: Dict[str, Any]):
+    """缓存一次计算结果（同时写入内存层和磁盘层）；不可复现的结果（见 theory_result_is_deterministic）不缓存"""
+    if not theory_result_is_deterministic(result):
+        return
+    value = json.dumps(result, separators=(",", ":"))
+    theory_result_cache_remember(key, value)
+    db = get_theory_result_db()
+    if db is not None:
+        db.execute("INSERT OR REPLACE INTO theory_results (key, value, created_at) VALUES (?, ?, ?)",
+                   (key, value, datetime.now().isoformat()))
+        db.commit()
+
+def clear_theory_result_cache() -> Dict[str, int]:
+    """清空内存层和磁盘层，返回被删除的条目数"""
+    removed = {"memory": len(theory_result_cache), "disk": 0}
+    theory_result_cache.clear()
+    theory_result_cache_state["bytes"] = 0
+    db = get_theory_result_db()
+    if db is not None:
+        removed["disk"] = db.execute("DELETE FROM theory_results").rowcount
+        db.commit()
+    return removed
+
+def get_theory_result_cache_stats() -> Dict[str, Any]:
+    """理论结果缓存的命中统计"""
+    state = theory_result_cache_state
+    hits = state["memoryHits"] + state["diskHits"]
+    total = hits + state["misses"]
+    db = get_theory_result_db()
+    return {
+        "entries": len(theory_result_cache),
+        "bytes": state["bytes"],
+        "maxBytes": THEORY_RESULT_CACHE_BYTES,
+        "diskPath": THEORY_RESULT_CACHE_DB,
+        "diskEntries": db.execute("SELECT COUNT(*) FROM theory_results").fetchone()[0] if db is not None else 0,
+        "memoryHits": state["memoryHits"],
+        "diskHits": state["diskHits"],
+        "misses": state["misses"],
+        "evictions": state["evictions"],
+        "hitRate": hits / total if total > 0 else 0.0
+    }
+
+# ========== 理论计算进程池 ==========
+def theory_worker_main(conn):
+    """理论计算工作进程主循环：接收 (函数, 参数) 任务，返回结果和接收概率缓存统计"""
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        func, args, kwargs = job
+        try:
+            result = func(*args, **kwargs)
+            conn.send(("ok", result, get_receive_prob_cache_stats()))
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            conn.send(("error", f"{type(e).__name__}: {e}", get_receive_prob_cache_stats()))
+
+def start_theory_worker() -> Dict[str, Any]:
+    """启动一个理论计算工作进程"""
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=theory_worker_main, args=(child_conn,), daemon=True)
+    process.start()
+    child_conn.close()
+    worker = {"process": process, "conn": parent_conn, "busy": False, "receive_cache_stats": None}
+    theory_pool["workers"].append(worker)
+    return worker
+
+def stop_theory_worker(worker: Dict[str, Any]):
+    """强制终止工作进程（用于超时和客户端断开时取消正在运行的计算）"""
+    worker["process"].terminate()
+    worker["process"].join(timeout=1)
+    worker["conn"].close()
+    if worker in theory_pool["workers"]:
+        theory_pool["workers"].remove(worker)
+
+async def acquire_theory_worker(affinity: Optional[str] = None) -> Dict[str, Any]:
+    """取得一个空闲工作进程
+    
+    指定 affinity 时优先（必要时等待）使用上次处理同一 affinity 的进程，
+    使矩阵句柄等进程内状态和接收概率缓存保持命中；该进程已被替换时改用任意空闲进程。
+    """
+    if theory_pool["condition"] is None:
+        theory_pool["condition"] = asyncio.Condition()
+        for _ in range(THEORY_WORKERS):
+            start_theory_worker()
+    
+    condition = theory_pool["condition"]
+    async with condition:
+        while True:
+            preferred = theory_pool["affinity"].get(affinity) if affinity is not None else None
+            if preferred is not None and preferred not in theory_pool["workers"]:
+                preferred = None
+            if preferred is not None:
+                candidates = [] if preferred["busy"] else [preferred]
+            else:
+                candidates = [w for w in theory_pool["workers"] if not w["busy"]]
+            if candidates:
+                worker = candidates[0]
+                if not worker["process"].is_alive():
+                    stop_theory_worker(worker)
+                    worker = start_theory_worker()
+                worker["busy"] = True
+                if affinity is not None:
+                    theory_pool["affinity"][affinity] = worker
+                return worker
+            await condition.wait()
+
+async def release_theory_worker(worker: Dict[str, Any], healthy: bool):
+    """归还工作进程；任务未正常完成时终止它并启动替代进程"""
+    condition = theory_pool["condition"]
+    async with condition:
+        if healthy:
+            worker["busy"] = False
+        else:
+            stop_theory_worker(worker)
+            start_theory_worker()
+        condition.notify_all()
+
+async def run_theory_job(func, *args, timeout: Optional[float] = None, http_request: Optional[Request] = None,
+                         affinity: Optional[str] = None, **kwargs):
+    """在理论计算进程池中执行 func(*args, **kwargs)，事件循环保持响应
+    
+    - 工作进程常驻，进程内的接收概率缓存在任务之间复用；affinity 相同的任务尽量交给同一进程
+    - 超过 timeout 秒返回 504，客户端断开返回 499；两种情况都会终止并替换对应工作进程
+    - func 必须是模块级函数，参数和返回值必须可 pickle
+    """
+    worker = await acquire_theory_worker(affinity)
+    
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    healthy = False
+    try:
+        worker["conn"].send((func, args, kwargs))
+        while not worker["conn"].poll():
+            await asyncio.sleep(0.02)
+            if timeout is not None and loop.time() - start_time > timeout:
+                raise HTTPException(status_code=504, detail=f"理论计算超时（>{timeout}s）")
+            if http_request is not None and await http_request.is_disconnected():
+                print(f"客户端已断开，取消理论计算任务 {func.__name__}")
+                raise HTTPException(status_code=499, detail="客户端已断开")
+            if not worker["process"].is_alive():
+                raise RuntimeError("理论计算进程异常退出")
+        status, payload, cache_stats = worker["conn"].recv()
+        worker["receive_cache_stats"] = cache_stats
+        healthy = True
+    finally:
+        await release_theory_worker(worker, healthy)
+    
+    if status == "error":
+        raise RuntimeError(payload)
+    return payload
+
+@app.on_event("shutdown")
+async def shutdown_theory_pool():
+    """关闭服务时终止所有理论计算工作进程"""
+    for worker in list(theory_pool["workers"]):
+        stop_theory_worker(worker)
+
+# HTTP路由
+def compute_theory_direct(request: dict) -> Dict[str, Any]:
+    """/api/theory/calculate 的计算部分（在理论计算进程池中执行）"""
+    import numpy as np
+    
+    n = request.get("nodeCount")
+    f = request.get("faultyNodes")
+    proposer_id = request.get("proposerId", 0)
+    reliability_matrix = request.get("reliabilityMatrix")
+    node_availability = request.get("nodeAvailability")  # 新增：节点在线率
+    precision = request.get("precision", "exact")
+    bounds = None
+    monte_carlo = None
+    distributions = None
+    fast = None
+    
+    # 构建可靠度矩阵
+    if reliability_matrix:
+        # 使用自定义可靠度矩阵
+        P_comm = np.array(reliability_matrix)
+    else:
+        # 使用均匀可靠度（从request中获取，或默认0.9）
+        p = request.get("reliability", 0.9)
+        P_comm = np.full((n, n), p)
+        np.fill_diagonal(P_comm, 1.0)  # 对角线为1
+    
+    if reliability_matrix or has_partial_availability(node_availability):
+        # 节点在线率不同时不再是均匀模型，统一走矩阵引擎（在线率计入 pre-prepare 阶段）
+        if request.get("distributions"):
+            # 各阶段分布与成功率来自同一次精确枚举
+            result = theory_engine_custom_matrix(n, f, P_comm, proposer_id, distributions=True,
+                                                 node_availability=node_availability)
+            theoretical_rate = result['success_rate']
+            distributions = result['distributions']
+            theory_method = "exact"
+        elif precision == "bounds":
+            epsilon = request.get("epsilon", THEORY_BOUNDS_EPSILON)
+            result = calculate_theoretical_success_bounds_custom_matrix(
+                n, f, P_comm, proposer_id, epsilon, request.get("timeBudget", THEORY_TIME_BUDGET), node_availability
+            )
+            theoretical_rate = result['success_rate']
+            bounds = format_bounds_result(result, epsilon)
+            theory_method = "exact" if result['exact'] else "bounds"
+        elif precision == "fast":
+            # 高斯/平均场近似，问题足够小时附带与精确值的误差
+            fast_result = calculate_theoretical_success_fast(n, f, P_comm, proposer_id, node_availability,
+                                                             bool(request.get("errorCheck")))
+            theoretical_rate = fast_result['rate']
+            theory_method = "gaussian"
+            fast = format_fast_result(fast_result['errorEstimate'], fast_result['elapsed'],
+                                      fast_result['checkComplete'])
+        else:
+            # 按成本预估自动选择精确枚举或蒙特卡洛
+            auto_result = calculate_theoretical_success_custom_matrix_auto(
+                n, f, P_comm, proposer_id, request.get("method", "auto"),
+                request.get("mcTrials"), request.get("mcSeed"), node_availability
+            )
+            theoretical_rate = auto_result['rate']
+            theory_method = auto_result['method']
+            if auto_result['monteCarlo'] is not None:
+                monte_carlo = format_monte_carlo_result(auto_result['monteCarlo'])
+            if auto_result['bounds'] is not None:
+                bounds = format_bounds_result(auto_result['bounds'], 0.0)
+    else:
+        if precision == "fast":
+            fast_result = calculate_theoretical_success_rate_sweep_fast(n, f, [p])
+            theoretical_rate = float(fast_result['rates'][0])
+            theory_method = "gaussian"
+            fast = format_fast_result(fast_result['errorEstimate'], fast_result['elapsed'])
+        else:
+            theoretical_rate = calculate_theoretical_success_rate_paper_simulation(n, f, p)
+            theory_method = "closed-form"
+        if request.get("distributions"):
+            distributions = calculate_theoretical_distributions(n, f, p)
+        if precision == "bounds":
+            # 均匀可靠度的闭式解本身就是精确值
+            bounds = {
+                "lower": theoretical_rate * 100,
+                "upper": theoretical_rate * 100,
+                "exact": True,
+                "converged": True,
+                "epsilon": request.get("epsilon", THEORY_BOUNDS_EPSILON),
+                "branches": 0,
+                "elapsed": 0.0
+            }
+    
+    # 计算主节点选择指标（新增 node_availability 参数）
+    metrics = calculate_primary_selection_metrics(n, f, P_comm, proposer_id, node_availability)
+    
+    response = {
+        "theoreticalSuccessRate": theoretical_rate * 100,
+        "theoryMethod": theory_method,
+        "exact": theory_method in EXACT_THEORY_METHODS,
+        "proposerId": proposer_id,
+        "metrics": format_primary_selection_metrics(metrics)
+    }
+    if bounds is not None:
+        response["bounds"] = bounds
+    if monte_carlo is not None:
+        response["monteCarlo"] = monte_carlo
+    if distributions is not None:
+        response["distributions"] = distributions
+    if fast is not None:
+        response["fast"] = fast
+    return response
+
+def compute_theory_all_proposers(request: dict) -> Dict[str, Any]:
+    """/api/theory/calculate-all 的计算部分（在理论计算进程池中执行）"""
+    import numpy as np
+    
+    n = request.get("nodeCount")
+    f = request.get("faultyNodes")
+    reliability_matrix = request.get("reliabilityMatrix")
+    node_availability = request.get("nodeAvailability")
+    
+    if reliability_matrix:
+        P_comm = np.array(reliability_matrix)
+        uniform_rate = None
+    else:
+        p = request.get("reliability", 0.9)
+        P_comm = np.full((n, n), p)
+        np.fill_diagonal(P_comm, 1.0)  # 对角线为1
+        # 均匀可靠度且全部在线时理论成功率与主节点无关；有节点在线率时各主节点分别用矩阵引擎计算
+        uniform_rate = None if has_partial_availability(node_availability) else \
+            calculate_theoretical_success_rate_paper_simulation(n, f, p)
+    
+    precision = request.get("precision", "exact")
+    if uniform_rate is not None and precision == "fast":
+        fast_result = calculate_theoretical_success_rate_sweep_fast(n, f, [p])
+        uniform_rate = float(fast_result['rates'][0])
+        uniform_fast = format_fast_result(fast_result['errorEstimate'], fast_result['elapsed'])
+    
+    context = prepare_primary_selection_context(n, f, P_comm)
+    
+    results = []
+    for proposer_id in range(n):
+        try:
+            monte_carlo = None
+            fast = None
+            bounds = None
+            if uniform_rate is None and precision == "fast":
+                fast_result = calculate_theoretical_success_fast(n, f, P_comm, proposer_id, node_availability,
+                                                                 bool(request.get("errorCheck")))
+                theoretical_rate = fast_result['rate']
+                theory_method = "gaussian"
+                fast = format_fast_result(fast_result['errorEstimate'], fast_result['elapsed'],
+                                          fast_result['checkComplete'])
+            elif uniform_rate is None:
+                auto_result = calculate_theoretical_success_custom_matrix_auto(
+                    n, f, P_comm, proposer_id, request.get("method", "auto"),
+                    request.get("mcTrials"), request.get("mcSeed"), node_availability
+                )
+                theoretical_rate = auto_result['rate']
+                theory_method = auto_result['method']
+                if auto_result['monteCarlo'] is not None:
+                    monte_carlo = format_monte_carlo_result(auto_result['monteCarlo'])
+                if auto_result['bounds'] is not None:
+                    bounds = format_bounds_result(auto_result['bounds'], 0.0)
+            else:
+                theoretical_rate = uniform_rate
+                theory_method = "gaussian" if precision == "fast" else "closed-form"
+                fast = uniform_fast if precision == "fast" else None
+            metrics = calculate_primary_selection_metrics(n, f, P_comm, proposer_id, node_availability, context)
+            result = {
+                "theoreticalSuccessRate": theoretical_rate * 100,
+                "theoryMethod": theory_method,
+                "exact": theory_method in EXACT_THEORY_METHODS,
+                "proposerId": proposer_id,
+                "metrics": format_primary_selection_metrics(metrics)
+            }
+            if monte_carlo is not None:
+                result["monteCarlo"] = monte_carlo
+            if fast is not None:
+                result["fast"] = fast
+            if bounds is not None:
+                result["bounds"] = bounds
+            results.append(result)
+        except Exception as e:
+            # 单个主节点失败（例如内存不足）不影响其它主节点的结果
+            print(f"主节点 {proposer_id} 理论计算失败: {e}")
+            results.append({"proposerId": proposer_id, "error": f"{type(e).__name__}: {e}"})
+    
+    return {"results": results}
+
+def build_theory_matrix_handle(request: dict) -> Dict[str, Any]:
+    """根据完整请求构建矩阵句柄的计算状态"""
+    import numpy as np
+    
+    n = request["nodeCount"]
+    f = request["faultyNodes"]
+    P_comm = np.array(request["reliabilityMatrix"], dtype=float)
+    theory_mode = request.get("theoryMode", "bounds")
+    state = {
+        "version": request["version"],
+        "n": n,
+        "f": f,
+        "P_comm": P_comm,
+        "node_availability": request.get("nodeAvailability"),
+        "theory_mode": theory_mode,
+        "mc_trials": request.get("mcTrials") or THEORY_HANDLE_MC_TRIALS,
+        "mc_seed": request.get("mcSeed", 0),
+        "context": prepare_primary_selection_context(n, f, P_comm),
+        "commit_bounds": None
+    }
+    if theory_mode != "none":
+        state["commit_bounds"] = theory_commit_stage_bounds(n, f, P_comm)
+    return state
+
+def compute_matrix_handle_results(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """根据句柄状态计算所有主节点的理论成功率和主节点选择指标
+    
+    theoryMode:
+    - "bounds"（默认）: 只使用随机序上下界（O(f·n²)/主节点），n=30 时每次修改约 0.1 秒，适合实时编辑
+    - "auto": 与 calculate_theoretical_success_custom_matrix_auto 相同，预估分支数不超过 THEORY_EXACT_MAX_BRANCHES
+      时精确计算，否则（或精确引擎超时）使用蒙特卡洛（默认 THEORY_HANDLE_MC_TRIALS 轮，固定种子使修改前后可比）；
+      每次都对所有主节点完整重算（一条链路同时出现在每个主节点的 prepare/commit 阶段，无法只刷新部分主节点），
+      n=30 时需要数秒，只在需要精确值时按需切换
+    - "none": 只计算主节点选择指标
+    """
+    n, f, P_comm = state["n"], state["f"], state["P_comm"]
+    theory_mode = state["theory_mode"]
+    if theory_mode == "bounds":
+        # 所有主节点的随机序上下界一次批量计算
+        all_lower, all_upper = theory_stochastic_bounds_batch(n, f, P_comm, None, state["commit_bounds"],
+                                                              state["node_availability"])
+    
+    results = []
+    for proposer_id in range(n):
+        bounds = None
+        monte_carlo = None
+        if theory_mode == "none":
+            theoretical_rate = None
+        elif theory_mode == "auto":
+            # 精确引擎的接收概率缓存按列摘要索引，未修改的列直接命中
+            auto_result = calculate_theoretical_success_custom_matrix_auto(
+                n, f, P_comm, proposer_id, "auto", state["mc_trials"], state["mc_seed"], state["node_availability"]
+            )
+            theoretical_rate = auto_result['rate']
+            theory_method = auto_result['method']
+            if auto_result['monteCarlo'] is not None:
+                monte_carlo = format_monte_carlo_result(auto_result['monteCarlo'])
+        else:
+            lower, upper = float(all_lower[proposer_id]), float(all_upper[proposer_id])
+            theoretical_rate = (lower + upper) / 2
+            theory_method = "bounds"
+            bounds = {"lower": lower * 100, "upper": upper * 100}
+        
+        metrics = calculate_primary_selection_metrics(n, f, P_comm, proposer_id, state["node_availability"],
+                                                      state["context"])
+        result = {
+            "theoreticalSuccessRate": theoretical_rate * 100 if theoretical_rate is not None else None,
+            "theoryMethod": theory_mode if theory_mode == "none" else theory_method,
+            "exact": None if theory_mode == "none" else theory_method in EXACT_THEORY_METHODS,
+            "proposerId": proposer_id,
+            "metrics": format_primary_selection_metrics(metrics)
+        }
+        if bounds is not None:
+            result["bounds"] = bounds
+        if monte_carlo is not None:
+            result["monteCarlo"] = monte_carlo
+        results.append(result)
+    return results
+
+def remember_theory_matrix_handle(handle_id: str, state: Dict[str, Any]):
+    """保存工作进程内的句柄状态（LRU，最多 THEORY_MAX_HANDLES 个）"""
+    theory_handle_states[handle_id] = state
+    theory_handle_states.move_to_end(handle_id)
+    while len(theory_handle_states) > THEORY_MAX_HANDLES:
+        theory_handle_states.popitem(last=False)
+
+def open_theory_matrix_handle(handle_id: str, request: dict) -> Dict[str, Any]:
+    """创建矩阵句柄并计算所有主节点的结果（在理论计算进程池中执行）"""
+    import time
+    
+    start_time = time.time()
+    state = build_theory_matrix_handle(request)
+    remember_theory_matrix_handle(handle_id, state)
+    return {
+        "handle": handle_id,
+        "version": state["version"],
+        "results": compute_matrix_handle_results(state),
+        "elapsed": time.time() - start_time
+    }
+
+def update_theory_matrix_handle(handle_id: str, request: dict, updates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """对矩阵句柄应用若干 (i, j) 修改并增量刷新（在理论计算进程池中执行）
+    
+    - Q_out 只刷新被修改的行，Q_in 只刷新被修改的列
+    - commit 阶段上下界与主节点无关，每次修改只算一次，所有主节点共用
+    - 精确引擎的接收概率缓存按列摘要索引，未被修改的列全部命中
+    - request 中的 theoryMode 可能随本次 PATCH 改变（例如编辑完成后按需切换到 "auto"）
+    
+    进程内没有该句柄的上一版本状态（进程被替换、LRU 淘汰或之前的修改失败）时，按 request 中的完整矩阵重建。
+    """
+    import time
+    
+    start_time = time.time()
+    state = theory_handle_states.get(handle_id)
+    rebuilt = state is None or state["version"] != request["version"] - 1
+    if rebuilt:
+        state = build_theory_matrix_handle(request)
+        rows, cols = list(range(state["n"])), list(range(state["n"]))
+    else:
+        rows = sorted({update["i"] for update in updates})
+        cols = sorted({update["j"] for update in updates})
+        for update in updates:
+            state["P_comm"][update["i"], update["j"]] = update["value"]
+        refresh_primary_selection_context(state["context"], state["n"], state["f"], state["P_comm"], rows, cols)
+        state["theory_mode"] = request["theoryMode"]
+        if state["theory_mode"] != "none":
+            state["commit_bounds"] = theory_commit_stage_bounds(state["n"], state["f"], state["P_comm"])
+        state["version"] = request["version"]
+    remember_theory_matrix_handle(handle_id, state)
+    
+    return {
+        "handle": handle_id,
+        "version": state["version"],
+        "rebuilt": rebuilt,
+        "refreshed": {"Q_out": rows, "Q_in": cols},
+        "results": compute_matrix_handle_results(state),
+        "elapsed": time.time() - start_time
+    }
+
+def close_theory_matrix_handle(handle_id: str) -> bool:
+    """删除工作进程内的句柄状态"""
+    return theory_handle_states.pop(handle_id, None) is not None
+
+def validate_node_availability(request: dict):
+    """nodeAvailability（可选）必须是长度为 nodeCount、取值在 [0, 1] 内的列表，否则返回 400"""
+    availability = request.get("nodeAvailability")
+    if availability is None:
+        return
+    if (not isinstance(availability, list) or len(availability) != request.get("nodeCount")
+            or any(not isinstance(x, (int, float)) or not 0 <= x <= 1 for x in availability)):
+        raise HTTPException(status_code=400, detail="nodeAvailability 必须是长度为 nodeCount、取值在 [0, 1] 内的列表")
+
+# pcommSource → 按拓扑计算 P_comm 的函数
+PCOMM_SOURCES = {
+    "shortest-path": calculate_comm_reliability_matrix_shortest_path,
+    "all-paths": calculate_comm_reliability_matrix_all_paths,
+    "disjoint-paths": calculate_comm_reliability_matrix_disjoint_paths,
+    "two-terminal": calculate_comm_reliability_matrix_two_terminal,
+}
+
+def compute_topology_reliability_matrix(n: int, topology: str, n_value: int, p: float, source: str,
+                                        options: Dict[str, Any], record: Optional[Dict[str, Any]] = None):
+    """按拓扑展开 P_comm（在理论计算进程池中执行）
+    
+    自定义拓扑的记录随任务发送，进程内按 id 保存（remember_custom_topology），
+    同一进程之后的任务可以复用其路径预言机和多路径路由缓存。
+    
+    Returns:
+        {'matrix': P_comm} 或 {'error': 参数错误信息}（ValueError，由调用方转换为 400）
+    """
+    if record is not None:
+        remember_custom_topology(record)
+    try:
+        return {'matrix': PCOMM_SOURCES[source](n, topology, n_value, p, **options)}
+    except ValueError as e:
+        return {'error': str(e)}
+
+async def topology_reliability_matrix(n: int, topology: str, n_value: int, p: float,
+                                      source: str = "shortest-path", options: Optional[Dict[str, Any]] = None,
+                                      timeout: Optional[float] = None, http_request: Optional[Request] = None):
+    """按拓扑展开 P_comm：先查 pcomm_matrix_cache，未命中时在理论计算进程池中计算（受 timeout 约束）
+    
+    Raises:
+        HTTPException: 自定义拓扑不存在或参数不合法（400）、超时（504）、客户端断开（499）
+    """
+    options = options or {}
+    try:
+        record = get_custom_topology(topology)
+        key = (int(n), topology, int(n_value), source, float(p), tuple(sorted(options.items())))
+        cached = pcomm_matrix_cache.get(key)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if cached is not None:
+        pcomm_matrix_cache.move_to_end(key)
+        return cached
+    
+    result = await run_theory_job(compute_topology_reliability_matrix, n, topology, n_value, p, source, options,
+                                  record, timeout=timeout, http_request=http_request)
+    if 'error' in result:
+        raise HTTPException(status_code=400, detail=result['error'])
+    # 计算期间拓扑被删除时不再缓存
+    if record is None or custom_topologies.get(record["id"]) is record:
+        pcomm_matrix_cache[key] = result['matrix']
+        while len(pcomm_matrix_cache) > PCOMM_MATRIX_CACHE_SIZE:
+            pcomm_matrix_cache.popitem(last=False)
+    return result['matrix']
+
+async def resolve_topology_reliability_matrix(request: dict, timeout: Optional[float] = None,
+                                              http_request: Optional[Request] = None) -> dict:
+    """请求给出 topology（内置拓扑或 "custom:<id>"）且没有 reliabilityMatrix 时按拓扑展开为可靠度矩阵，
+    不存在或节点数不一致时返回 400
+    
+    pcommSource 选择 P_comm 的模型（见 PCOMM_SOURCES，默认 shortest-path），disjoint-paths 另外读取
+    pathCount（路径数 k，默认 2）和 disjointMode（node / edge，默认 node）；
+    full 拓扑的 shortest-path 就是均匀可靠度，保持原来的闭式计算。
+    展开在理论计算进程池中执行并按参数缓存（见 topology_reliability_matrix），timeout 与之后的理论计算共用。
+    """
+    topology = request.get("topology")
+    source = request.get("pcommSource", "shortest-path")
+    if source not in PCOMM_SOURCES:
+        raise HTTPException(status_code=400, detail=f"pcommSource 只能是 {'、'.join(PCOMM_SOURCES)}")
+    if topology is None or request.get("reliabilityMatrix") or (topology == "full" and source == "shortest-path"):
+        return request
+    options = {}
+    if source == "disjoint-paths":
+        options = {"k": request.get("pathCount", 2), "mode": request.get("disjointMode", "node")}
+    P_comm = await topology_reliability_matrix(
+        request["nodeCount"], topology, request.get("branchCount", 2), request.get("reliability", 0.9),
+        source, options, timeout=timeout, http_request=http_request
+    )
+    return {**request, "reliabilityMatrix": P_comm.tolist()}
+
+@app.post("/api/theory/calculate")
+async def calculate_theory_direct(request: dict, http_request: Request):
+    """直接计算理论成功率（不创建session）
+    
+    计算在理论计算进程池中执行；超时返回 504，客户端断开时终止计算。
+    
+    Request body:
+    {
+        "nodeCount": int,
+        "faultyNodes": int,
+        "proposerId": int,
+        "reliabilityMatrix": [[float]] (optional, n×n矩阵),
+        "topology": str (optional, 内置拓扑或 "custom:<id>"，未提供矩阵时按拓扑和 reliability 展开为 P_comm),
+        "branchCount": int (optional, 树形拓扑分支数),
+        "pcommSource": "shortest-path" | "all-paths" | "disjoint-paths" | "two-terminal" (optional, 按拓扑展开 P_comm 的模型，
+                       默认 shortest-path；two-terminal 为链路独立失效时的精确两端可靠度，只支持无向拓扑；
+                       展开在理论计算进程池中执行并按参数缓存，耗时计入 timeout),
+        "pathCount": int (optional, disjoint-paths 每对节点的不相交路径数，默认 2),
+        "disjointMode": "node" | "edge" (optional, disjoint-paths 的不相交方式，默认 node),
+        "nodeAvailability": [float] (optional, 节点在线率 s(v)，离线节点不收发任何消息；
+                             精确/bounds/fast 计入 pre-prepare 阶段，蒙特卡洛直接模拟节点掉线),
+        "precision": "exact" | "bounds" | "fast" (optional, 默认 "exact"；fast 为高斯/平均场近似，适合 n 上百上千，
+                     n ≳ 40 时误差在 2 个百分点以内，n = 7~16 时可达 3~10 个百分点),
+        "errorCheck": bool (optional, fast 模式下问题足够小时再做一次精确计算报告误差，
+                      时间预算 THEORY_FAST_CHECK_TIME_BUDGET，默认 false),
+        "epsilon": float (optional, bounds 模式允许的区间宽度（概率，0~1），默认 THEORY_BOUNDS_EPSILON),
+        "timeBudget": float (optional, bounds 模式的计算时间上限（秒），默认 THEORY_TIME_BUDGET),
+        "method": "auto" | "exact" | "monte-carlo" (optional, 自定义矩阵的计算方法，默认 "auto"),
+        "mcTrials": int (optional, 蒙特卡洛轮数，默认 THEORY_MC_TRIALS),
+        "mcSeed": int (optional, 蒙特卡洛随机种子),
+        "distributions": bool (optional, 同时返回各阶段人数分布，只支持精确计算),
+        "timeout": float (optional, 秒，默认 THEORY_JOB_TIMEOUT)
+    }
+    
+    返回的 "theoryMethod" 为实际使用的方法（closed-form / exact / monte-carlo / bounds / gaussian），
+    "exact" 表示 theoreticalSuccessRate 是否为精确值（只有 closed-form / exact 为 true）；
+    fast 模式额外返回 "fast": {"errorEstimate"（与精确值的绝对误差，百分点；未请求 errorCheck、问题太大或
+    精确计算超时时为 null）, "checkComplete", "elapsed"}；
+    bounds 模式额外返回 "bounds": {"lower", "upper"(百分比), "exact", "converged", ...}，
+    区间保证包含精确值；蒙特卡洛额外返回 "monteCarlo": {"trials", "wilson", "clopperPearson", ...}；
+    distributions=true 时额外返回 "distributions": {"N_pp", "N_p", "N_c", "phaseSurvival", "successByThreshold", ...}
+    （概率，0~1，见 summarize_phase_distributions）。
+    
+    规模限制：自定义矩阵的精确计算只在预估分支数不超过 THEORY_EXACT_MAX_BRANCHES 时可行
+    （没有节点等价类时约 n ≤ 19，例如 n=40 约需 1e14 个分支）；存在等价类的结构化拓扑（星形、树形、均匀矩阵）
+    按类计数，n 上百也能精确计算。method="auto" 超出上限时改用蒙特卡洛（theoryMethod 为 "monte-carlo"）；
+    method="exact" 强制精确计算时超出 THEORY_TIME_BUDGET 后返回 theoryMethod "bounds" 和带证书的区间，
+    theoreticalSuccessRate 只是区间中点。n 上百上千时用 precision="fast"，需要保证区间时用 precision="bounds"。
+    """
+    if request.get("nodeCount") is None or request.get("faultyNodes") is None:
+        raise HTTPException(status_code=400, detail="Missing required parameters")
+    if request.get("precision", "exact") not in ("exact", "bounds", "fast"):
+        raise HTTPException(status_code=400, detail="precision 只能是 exact、bounds 或 fast")
+    if request.get("precision") == "bounds" and not request.get("epsilon", THEORY_BOUNDS_EPSILON) > 0:
+        raise HTTPException(status_code=400, detail="epsilon 必须大于 0")
+    if request.get("method", "auto") not in ("auto", "exact", "monte-carlo"):
+        raise HTTPException(status_code=400, detail="method 只能是 auto、exact 或 monte-carlo")
+    validate_node_availability(request)
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    timeout = request.get("timeout", THEORY_JOB_TIMEOUT)
+    request = await resolve_topology_reliability_matrix(request, timeout, http_request)
+    if request.get("distributions") and (request.get("reliabilityMatrix")
+                                         or has_partial_availability(request.get("nodeAvailability"))):
+        if request.get("precision", "exact") != "exact" or request.get("method", "auto") == "monte-carlo":
+            raise HTTPException(status_code=400, detail="distributions 只支持精确计算")
+        estimated_branches = estimate_custom_matrix_branches(request["nodeCount"], request["faultyNodes"])
+        if estimated_branches > THEORY_EXACT_MAX_BRANCHES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"预估分支数 {estimated_branches} 超过精确计算上限 {THEORY_EXACT_MAX_BRANCHES}，无法返回分布"
+            )
+    
+    # 相同输入直接返回缓存结果
+    cache_key = theory_result_cache_key("calculate", request)
+    cached = theory_result_cache_get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        result = await run_theory_job(
+            compute_theory_direct, request,
+            timeout=timeout - (loop.time() - start_time), http_request=http_request
+        )
+        theory_result_cache_put(cache_key, result)
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"理论计算错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/theory/calculate-all")
+async def calculate_theory_all_proposers(request: dict, http_request: Request):
+    """一次计算所有节点分别作为主节点时的理论成功率和主节点选择指标
+    
+    与逐个调用 /api/theory/calculate 的结果相同，但与主节点无关的部分只计算一次：
+    介数中心性、每个节点的 Q_out/Q_in，以及理论引擎的接收概率缓存在各主节点之间共享。
+    各主节点依次计算，每个主节点最多约 THEORY_TIME_BUDGET（精确引擎）加上蒙特卡洛回退的时间，
+    timeout 应随 nodeCount 放大；单个主节点失败时该项为 {"proposerId", "error"}，其余结果照常返回。
+    
+    Request body:
+    {
+        "nodeCount": int,
+        "faultyNodes": int,
+        "reliabilityMatrix": [[float]] (optional, n×n矩阵),
+        "reliability": float (optional, 未提供矩阵时的均匀可靠度),
+        "topology": str (optional), "branchCount": int (optional), "pcommSource": str (optional, 见 /api/theory/calculate),
+        "pathCount": int (optional), "disjointMode": str (optional),
+        "nodeAvailability": [float] (optional),
+        "method": "auto" | "exact" | "monte-carlo" (optional, 见 /api/theory/calculate),
+        "mcTrials": int (optional), "mcSeed": int (optional),
+        "precision": "exact" | "fast" (optional, fast 为高斯/平均场近似，见 /api/theory/calculate),
+        "errorCheck": bool (optional, 见 /api/theory/calculate),
+        "timeout": float (optional, 秒，默认 THEORY_JOB_TIMEOUT)
+    }
+    """
+    if request.get("nodeCount") is None or request.get("faultyNodes") is None:
+        raise HTTPException(status_code=400, detail="Missing required parameters")
+    if request.get("method", "auto") not in ("auto", "exact", "monte-carlo"):
+        raise HTTPException(status_code=400, detail="method 只能是 auto、exact 或 monte-carlo")
+    if request.get("precision", "exact") not in ("exact", "fast"):
+        raise HTTPException(status_code=400, detail="precision 只能是 exact 或 fast")
+    validate_node_availability(request)
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    timeout = request.get("timeout", THEORY_JOB_TIMEOUT)
+    request = await resolve_topology_reliability_matrix(request, timeout, http_request)
+    
+    cache_key = theory_result_cache_key("calculate-all", request)
+    result = theory_result_cache_get(cache_key)
+    
+    try:
+        if result is None:
+            result = await run_theory_job(
+                compute_theory_all_proposers, request,
+                timeout=timeout - (loop.time() - start_time), http_request=http_request
+            )
+            theory_result_cache_put(cache_key, result)
+        result["receiveCache"] = collect_receive_cache_stats()
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"理论计算错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def compute_theory_sweep(node_counts: List[int], faulty_nodes: List[int], p_values: List[float],
+                         precision: str = "exact") -> Dict[str, Any]:
+    """/api/theory/sweep 的计算部分（在理论计算进程池中执行）"""
+    curves = []
+    for n, f in zip(node_counts, faulty_nodes):
+        if precision == "fast":
+            fast_result = calculate_theoretical_success_rate_sweep_fast(int(n), int(f), p_values)
+            rates = fast_result['rates']
+        else:
+            rates = calculate_theoretical_success_rate_sweep(int(n), int(f), p_values)
+        curve = {
+            "nodeCount": int(n),
+            "faultyNodes": int(f),
+            "pValues": p_values,
+            "successRates": (rates * 100).tolist()
+        }
+        if precision == "fast":
+            curve["fast"] = format_fast_result(fast_result['errorEstimate'], fast_result['elapsed'])
+            curve["fast"]["checkedPValues"] = fast_result['checkedPValues']
+        curves.append(curve)
+    return {"curves": curves}
+
+@app.post("/api/theory/sweep")
+async def sweep_theory_curve(request: dict, http_request: Request):
+    """一次计算整条"理论成功率-可靠度"曲线（均匀可靠度闭式模型）
+    
+    Request body:
+    {
+        "pValues": [float],
+        "nodeCount": int 或 "nodeCounts": [int],
+        "faultyNodes": int 或 [int] (optional, 默认 (n-1)//3，与 nodeCounts 一一对应),
+        "precision": "exact" | "fast" (optional, fast 为正态近似，n 上千时也能立即返回)
+    }
+    
+    Returns:
+        {"curves": [{"nodeCount", "faultyNodes", "pValues", "successRates"(百分比)}]}；
+        fast 模式每条曲线额外返回 "fast": {"errorEstimate"（百分点）, "checkedPValues", "elapsed"}，
+        n ≤ THEORY_FAST_CHECK_MAX_N 时在 checkedPValues 上与精确值对比，否则 errorEstimate 为 null
+    """
+    p_values = request.get("pValues")
+    node_counts = request.get("nodeCounts")
+    if node_counts is None and request.get("nodeCount") is not None:
+        node_counts = [request.get("nodeCount")]
+    if not p_values or not node_counts:
+        raise HTTPException(status_code=400, detail="Missing required parameters")
+    
+    faulty_nodes = request.get("faultyNodes")
+    if faulty_nodes is None:
+        faulty_nodes = [(n - 1) // 3 for n in node_counts]
+    elif not isinstance(faulty_nodes, list):
+        faulty_nodes = [faulty_nodes] * len(node_counts)
+    if len(faulty_nodes) != len(node_counts):
+        raise HTTPException(status_code=400, detail="faultyNodes 与 nodeCounts 长度不一致")
+    precision = request.get("precision", "exact")
+    if precision not in ("exact", "fast"):
+        raise HTTPException(status_code=400, detail="precision 只能是 exact 或 fast")
+    
+    try:
+        return await run_theory_job(
+            compute_theory_sweep, node_counts, faulty_nodes, p_values, precision,
+            timeout=request.get("timeout", THEORY_JOB_TIMEOUT), http_request=http_request
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"理论曲线计算错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def compute_theory_sensitivity(request: dict) -> Dict[str, Any]:
+    """/api/theory/sensitivity 的计算部分（在理论计算进程池中执行）"""
+    import numpy as np
+    
+    n = request.get("nodeCount")
+    f = request.get("faultyNodes")
+    proposer_id = request.get("proposerId", 0)
+    reliability_matrix = request.get("reliabilityMatrix")
+    
+    if reliability_matrix:
+        P_comm = np.array(reliability_matrix, dtype=float)
+    else:
+        P_comm = np.full((n, n), request.get("reliability", 0.9), dtype=float)
+        np.fill_diagonal(P_comm, 1.0)  # 对角线为1
+    
+    result = theory_gradient_custom_matrix(n, f, P_comm, proposer_id, request.get("nodeAvailability"))
+    gradient = result['gradient']
+    
+    # 按偏导从大到小排列所有链路；potentialGain 为把该链路提升到 1 时成功率的一阶估计增量
+    links = [(i, j) for i in range(n) for j in range(n) if i != j]
+    links.sort(key=lambda link: gradient[link], reverse=True)
+    ranking = [{
+        "from": i,
+        "to": j,
+        "reliability": float(P_comm[i, j]),
+        "gradient": float(gradient[i, j]) * 100,
+        "potentialGain": float(gradient[i, j] * (1 - P_comm[i, j])) * 100
+    } for i, j in links]
+    
+    return {
+        "theoreticalSuccessRate": result['success_rate'] * 100,
+        "proposerId": proposer_id,
+        "gradient": (gradient * 100).tolist(),
+        "ranking": ranking,
+        "branches": result['branches'],
+        "elapsed": result['elapsed']
+    }
+
+@app.post("/api/theory/sensitivity")
+async def calculate_theory_sensitivity(request: dict, http_request: Request):
+    """计算理论成功率对每条链路可靠度的偏导 ∂P_success/∂P_comm[i,j]，并给出链路排名
+    
+    一次枚举同时得到成功率和全部 n² 个偏导（解析求导，不用有限差分），
+    用于判断优先加固哪条链路。
+    
+    Request body:
+    {
+        "nodeCount": int,
+        "faultyNodes": int,
+        "proposerId": int (optional, 默认 0),
+        "reliabilityMatrix": [[float]] (optional, n×n矩阵),
+        "reliability": float (optional, 未提供矩阵时的均匀可靠度),
+        "nodeAvailability": [float] (optional, 节点在线率，计入 pre-prepare 阶段，见 /api/theory/calculate),
+        "top": int (optional, 只返回排名前 top 条链路，默认全部),
+        "timeout": float (optional, 秒，默认 THEORY_JOB_TIMEOUT)
+    }
+    
+    Returns:
+        {"theoreticalSuccessRate", "proposerId",
+         "gradient": n×n（百分点 / 单位可靠度，行：发送方，列：接收方）,
+         "ranking": [{"from", "to", "reliability", "gradient", "potentialGain"}], "branches", "elapsed"}
+    
+    预估分支数超过 THEORY_GRADIENT_MAX_BRANCHES 时返回 400。
+    """
+    n = request.get("nodeCount")
+    f = request.get("faultyNodes")
+    if n is None or f is None:
+        raise HTTPException(status_code=400, detail="Missing required parameters")
+    validate_node_availability(request)
+    estimated_branches = estimate_custom_matrix_branches(n, f)
+    if estimated_branches > THEORY_GRADIENT_MAX_BRANCHES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"预估分支数 {estimated_branches} 超过灵敏度计算上限 {THEORY_GRADIENT_MAX_BRANCHES}"
+        )
+    
+    cache_key = theory_result_cache_key("sensitivity", request)
+    result = theory_result_cache_get(cache_key)
+    
+    try:
+        if result is None:
+            result = await run_theory_job(
+                compute_theory_sensitivity, request,
+                timeout=request.get("timeout", THEORY_JOB_TIMEOUT), http_request=http_request
+            )
+            theory_result_cache_put(cache_key, result)
+        top = request.get("top")
+        if top is not None:
+            result = dict(result, ranking=result["ranking"][:int(top)])
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"灵敏度计算错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def primary_selection_index_w(n: int, f: int, P_comm, proposer_id: int, context: Dict[str, Any]) -> float:
+    """只计算加权综合指标 I_w(v) = Q_w(v) · Φ_q(v)
+    
+    公式与 calculate_primary_selection_metrics 完全一致，但不计算其它指标、不输出调试信息，
+    用于需要反复评估同一指标的场景（如链路升级优化）。context 只需要 w_u。
+    """
+    import numpy as np
+    
+    v = proposer_id
+    quorum_size = 2 * f + 1
+    others = np.arange(n) != v
+    
+    # Q_w(v)：有效送达概率 π_{v,u} = p_{v→u} · w_u 的 Poisson-binomial 尾概率
+    Q_w = poisson_binomial_tail(P_comm[v, others] * context['w_u'][others], quorum_size)
+    
+    # Φ_q(v)：top-(2f+1) 个 P_prep 的平均
+    P_prep = prepare_stage_quorum_probs(n, f, P_comm, proposer_id)
+    top_k = min(quorum_size, n)
+    Phi_q = np.mean(np.sort(P_prep)[::-1][:top_k])
+    return float(Q_w * Phi_q)
+
+def optimize_link_upgrades(n: int, f: int, P_comm, proposer_id: int, upgrade_cost, target_reliability,
+                           budget: float, objective: str = "success", local_search_rounds: int = 2,
+                           time_budget: Optional[float] = None,
+                           node_availability: Optional[List[float]] = None) -> Dict[str, Any]:
+    """在预算内选择要升级的链路，使理论成功率（或主节点选择指标 I_w）最大
+    
+    1. 惰性贪心（CELF）：按"增益/成本"维护最大堆，弹出的候选若在当前轮已精确评估过则直接选中，
+       否则重新评估后放回；初始键用链路灵敏度（梯度 × 提升幅度）的一阶估计，
+       大部分候选在整个过程中都不需要精确评估
+    2. 局部搜索：尝试"加入"（预算有剩余时）和"一换一"改进，直到没有改进或达到轮数上限
+    
+    每次评估都是增量的：
+    - success（精确）：理论引擎的接收概率缓存按列摘要索引，只有被修改链路所在列需要重算
+    - success（超出精确枚举上限时）：随机序上下界的中点，O(f·n²)
+    - index：只刷新被修改链路对应的 Q_out(i) / Q_in(j)，其余 O(n²)
+    
+    Args:
+        n: 节点数
+        f: 容错数
+        P_comm: 当前可靠度矩阵 (n×n)
+        proposer_id: 主节点ID
+        upgrade_cost: 每条链路的升级成本（n×n 矩阵）
+        target_reliability: 每条链路升级后的可靠度（n×n 矩阵）
+        budget: 总预算
+        objective: "success"（理论成功率）或 "index"（I_w）
+        local_search_rounds: 局部搜索轮数上限
+        time_budget: 计算时间上限（秒），超出后返回当前最优方案
+        node_availability: 节点在线率，success 目标按 pre_prepare_probs 计入（I_w 与在线率无关）
+    
+    Returns:
+        {'objective', 'evaluation', 'initial_value', 'final_value', 'spent', 'upgrades', 'history',
+         'evaluations', 'complete', 'elapsed'}
+    """
+    import numpy as np
+    import heapq
+    import time
+    
+    start_time = time.time()
+    P_comm = np.array(P_comm, dtype=float)
+    upgrade_cost = np.asarray(upgrade_cost, dtype=float)
+    target_reliability = np.asarray(target_reliability, dtype=float)
+    
+    def out_of_time():
+        return time_budget is not None and time.time() - start_time > time_budget
+    
+    # ========== 评估函数 ==========
+    if objective == "index":
+        evaluation = "index"
+        current_context = {'betweenness': None, 'Q_out': np.zeros(n), 'Q_in': np.zeros(n), 'w_u': np.zeros(n)}
+        refresh_primary_selection_context(current_context, n, f, P_comm, range(n), range(n), betweenness=False)
+    elif estimate_custom_matrix_branches(n, f) <= THEORY_EXACT_MAX_BRANCHES:
+        evaluation = "exact"
+    else:
+        evaluation = "bounds"
+    
+    def evaluate(P_trial, changed_links):
+        """changed_links：P_trial 相对当前方案修改过的链路"""
+        if evaluation == "index":
+            context = {name: current_context[name].copy() for name in ('Q_out', 'Q_in', 'w_u')}
+            refresh_primary_selection_context(context, n, f, P_trial, {i for i, _ in changed_links},
+                                              {j for _, j in changed_links}, betweenness=False)
+            return primary_selection_index_w(n, f, P_trial, proposer_id, context)
+        if evaluation == "exact":
+            return theory_engine_custom_matrix(n, f, P_trial, proposer_id,
+                                               node_availability=node_availability)['success_rate']
+        lower, upper = theory_stochastic_bounds(n, f, P_trial, proposer_id, node_availability=node_availability)
+        return (lower + upper) / 2
+    
+    def accept(P_new, changed_links):
+        if evaluation == "index":
+            refresh_primary_selection_context(current_context, n, f, P_new, {i for i, _ in changed_links},
+                                              {j for _, j in changed_links}, betweenness=False)
+    
+    # ========== 候选链路 ==========
+    candidates = [(i, j) for i in range(n) for j in range(n)
+                  if i != j and target_reliability[i, j] > P_comm[i, j] and upgrade_cost[i, j] <= budget]
+    cost = {link: max(float(upgrade_cost[link]), 1e-12) for link in candidates}
+    
+    P_current = P_comm.copy()
+    initial_value = evaluate(P_current, [])
+    current_value = initial_value
+    evaluations = 1
+    remaining = float(budget)
+    chosen = []
+    history = []
+    complete = True
+    
+    # 初始键：灵敏度一阶估计（可用时），否则 +∞（第一轮全部精确评估）
+    if evaluation == "exact" and estimate_custom_matrix_branches(n, f) <= THEORY_GRADIENT_MAX_BRANCHES:
+        gradient = theory_gradient_custom_matrix(n, f, P_comm, proposer_id, node_availability)['gradient']
+        initial_keys = {link: gradient[link] * (target_reliability[link] - P_comm[link]) / cost[link]
+                        for link in candidates}
+    else:
+        initial_keys = {link: float("inf") for link in candidates}
+    
+    # ========== 1. 惰性贪心 ==========
+    # 堆元素：(-增益/成本, 链路, 评估时所在轮次)；轮次 -1 表示估计值
+    heap = [(-initial_keys[link], link, -1) for link in candidates]
+    heapq.heapify(heap)
+    last_gain = {}
+    round_id = 0
+    while heap:
+        if out_of_time():
+            complete = False
+            break
+        neg_key, link, stamp = heapq.heappop(heap)
+        if cost[link] > remaining + 1e-12:
+            continue  # 剩余预算只会减少，之后也买不起
+        if stamp == round_id:
+            if last_gain[link] <= 0:
+                break
+            P_current[link] = target_reliability[link]
+            accept(P_current, [link])
+            remaining -= float(upgrade_cost[link])
+            current_value += last_gain[link]
+            chosen.append(link)
+            history.append({"action": "add", "link": link, "value": current_value})
+            round_id += 1
+            continue
+        P_trial = P_current.copy()
+        P_trial[link] = target_reliability[link]
+        gain = evaluate(P_trial, [link]) - current_value
+        evaluations += 1
+        last_gain[link] = gain
+        heapq.heappush(heap, (-gain / cost[link], link, round_id))
+    
+    # ========== 2. 局部搜索：加入 / 一换一 ==========
+    def ranked_unchosen():
+        chosen_set = set(chosen)
+        pool = [link for link in candidates if link not in chosen_set]
+        return sorted(pool, key=lambda link: last_gain.get(link, initial_keys[link] * cost[link]) / cost[link],
+                      reverse=True)[:20]
+    
+    for _ in range(local_search_rounds if complete else 0):
+        improved = False
+        moves = [(None, link) for link in ranked_unchosen()]
+        moves += [(old, new) for old in chosen for new in ranked_unchosen()]
+        for old, new in moves:
+            if out_of_time():
+                complete = False
+                break
+            freed = float(upgrade_cost[old]) if old is not None else 0.0
+            if float(upgrade_cost[new]) > remaining + freed + 1e-12:
+                continue
+            P_trial = P_current.copy()
+            P_trial[new] = target_reliability[new]
+            changed = [new]
+            if old is not None:
+                P_trial[old] = P_comm[old]
+                changed.append(old)
+            value = evaluate(P_trial, changed)
+            evaluations += 1
+            last_gain[new] = value - current_value
+            if value > current_value + 1e-12:
+                P_current = P_trial
+                accept(P_current, changed)
+                remaining += freed - float(upgrade_cost[new])
+                current_value = value
+                if old is not None:
+                    chosen.remove(old)
+                chosen.append(new)
+                history.append({"action": "add" if old is None else "swap", "link": new,
+                                "removed": old, "value": current_value})
+                improved = True
+                break
+        if not improved or not complete:
+            break
     
-    # Step 3: 对每个 cohort 节点 i，计算它"收到至少 r 个消息"的概率
-    # 使用 r = min(2f, cohort_size-1)（合理阈值：不能超过可能的最大值）
-    r_threshold = min(k - 1, cohort_size - 1)  # k-1 = 2f，且不能超过 cohort_size-1
+    return {
+        'objective': objective,
+        'evaluation': evaluation,
+        'initial_value': initial_value,
+        'final_value': current_value,
+        'spent': float(budget) - remaining,
+        'upgrades': [{'link': link, 'reliability': float(P_comm[link]), 'target': float(target_reliability[link]),
+                      'cost': float(upgrade_cost[link])} for link in chosen],
+        'history': history,
+        'evaluations': evaluations,
+        'complete': complete,
+        'elapsed': time.time() - start_time
+    }
+
+def compute_link_upgrade_plan(request: dict) -> Dict[str, Any]:
+    """/api/theory/optimize-upgrades 的计算部分（在理论计算进程池中执行）"""
+    import numpy as np
     
-    print(f"r_threshold (cohort 内达标阈值): {r_threshold} (cohort_size={cohort_size}, k={k})")
+    n = request.get("nodeCount")
+    f = request.get("faultyNodes")
+    proposer_id = request.get("proposerId", 0)
+    reliability_matrix = request.get("reliabilityMatrix")
     
-    # 使用 DP 精确计算：节点 i 收到至少 r 个消息的概率
-    def calc_receive_at_least_r_from_cohort(i_idx, r):
-        """计算 cohort 节点 i 收到至少 r 个 cohort 内消息的概率"""
-        probs = []
-        for j_idx in range(cohort_size):
-            if j_idx != i_idx:
-                probs.append(P_cohort[j_idx, i_idx])  # j→i 的概率
-        
-        # DP: dp[msg_count] = probability
-        if len(probs) == 0:
-            return 0.0 if r > 0 else 1.0
-        
-        dp = {0: 1.0}  # 初始：收到0个消息的概率为1
-        
-        for p_ji in probs:
-            new_dp = {}
-            for count, prob in dp.items():
-                # 收到这条消息
-                new_dp[count + 1] = new_dp.get(count + 1, 0.0) + prob * p_ji
-                # 没收到这条消息
-                new_dp[count] = new_dp.get(count, 0.0) + prob * (1 - p_ji)
-            dp = new_dp
-        
-        # 汇总：≥ r 的概率
-        prob_at_least_r = sum(prob for count, prob in dp.items() if count >= r)
-        return prob_at_least_r
-    
-    # Step 4: 计算每个 cohort 节点满足条件的概率
-    cohort_node_success_probs = []
-    for i_idx in range(cohort_size):
-        prob_i = calc_receive_at_least_r_from_cohort(i_idx, r_threshold)
-        cohort_node_success_probs.append(prob_i)
-        print(f"  节点 {cohort_nodes[i_idx]}: P(D_i ≥ {r_threshold}) = {prob_i:.4f}")
+    if reliability_matrix:
+        P_comm = np.array(reliability_matrix, dtype=float)
+    else:
+        P_comm = np.full((n, n), request.get("reliability", 0.9), dtype=float)
+        np.fill_diagonal(P_comm, 1.0)  # 对角线为1
+    # 标量和矩阵两种写法都支持
+    upgrade_cost = np.broadcast_to(np.asarray(request.get("upgradeCost", 1.0), dtype=float), (n, n))
+    target_reliability = np.broadcast_to(np.asarray(request.get("targetReliability", 0.99), dtype=float), (n, n))
+    
+    result = optimize_link_upgrades(
+        n, f, P_comm, proposer_id, upgrade_cost, target_reliability, request.get("budget"),
+        request.get("objective", "success"), request.get("localSearchRounds", 2),
+        request.get("timeBudget", THEORY_TIME_BUDGET), request.get("nodeAvailability")
+    )
     
-    # Step 5: 计算 P_close(v) = Pr(至少 k 个 cohort 节点满足条件)
-    # 使用 DP 精确计算
-    dp_close = {0: 1.0}  # 初始：0个节点满足的概率为1
+    def link_json(link):
+        return {"from": int(link[0]), "to": int(link[1])} if link is not None else None
     
-    for prob_i in cohort_node_success_probs:
-        new_dp_close = {}
-        for count, prob in dp_close.items():
-            # 这个节点满足
-            new_dp_close[count + 1] = new_dp_close.get(count + 1, 0.0) + prob * prob_i
-            # 这个节点不满足
-            new_dp_close[count] = new_dp_close.get(count, 0.0) + prob * (1 - prob_i)
-        dp_close = new_dp_close
+    return {
+        "objective": result['objective'],
+        "evaluation": result['evaluation'],
+        "proposerId": proposer_id,
+        "initialValue": result['initial_value'] * 100,
+        "finalValue": result['final_value'] * 100,
+        "budget": request.get("budget"),
+        "spent": result['spent'],
+        "upgrades": [dict(link_json(u['link']), reliability=u['reliability'], target=u['target'], cost=u['cost'])
+                     for u in result['upgrades']],
+        "history": [{"action": h['action'], "link": link_json(h['link']), "removed": link_json(h.get('removed')),
+                     "value": h['value'] * 100} for h in result['history']],
+        "evaluations": result['evaluations'],
+        "complete": result['complete'],
+        "elapsed": result['elapsed']
+    }
+
+@app.post("/api/theory/optimize-upgrades")
+async def optimize_theory_link_upgrades(request: dict, http_request: Request):
+    """在预算内选择要升级的链路，使理论成功率或主节点选择指标 I_w 最大（惰性贪心 + 局部搜索）
     
-    P_close = sum(prob for count, prob in dp_close.items() if count >= k)
+    Request body:
+    {
+        "nodeCount": int,
+        "faultyNodes": int,
+        "budget": float,
+        "proposerId": int (optional, 默认 0),
+        "reliabilityMatrix": [[float]] (optional, n×n矩阵),
+        "reliability": float (optional, 未提供矩阵时的均匀可靠度),
+        "nodeAvailability": [float] (optional, 节点在线率，success 目标计入 pre-prepare 阶段；I_w 与在线率无关),
+        "upgradeCost": float 或 [[float]] (optional, 每条链路的升级成本，默认 1),
+        "targetReliability": float 或 [[float]] (optional, 升级后的可靠度，默认 0.99),
+        "objective": "success" | "index" (optional, 理论成功率或 I_w，默认 "success"),
+        "localSearchRounds": int (optional, 默认 2),
+        "timeBudget": float (optional, 秒，默认 THEORY_TIME_BUDGET；超出后返回当前最优方案),
+        "timeout": float (optional, 秒，默认 THEORY_JOB_TIMEOUT)
+    }
     
-    print(f"\nP_close(v) (Cohort 闭环成功概率): {P_close:.4f}")
+    Returns:
+        {"objective", "evaluation"（exact / bounds / index）, "initialValue", "finalValue"（百分比）,
+         "spent", "upgrades": [{"from", "to", "reliability", "target", "cost"}],
+         "history": [{"action"（add / swap）, "link", "removed", "value"}], "evaluations", "complete", "elapsed"}
+    """
+    import numpy as np
     
-    # 计算 Q_fix = Q_pp × P_close
-    Q_fix = Q_pp * P_close
-    print(f"Q_fix(v) = Q_pp × P_close = {Q_pp:.4f} × {P_close:.4f} = {Q_fix:.4f}")
+    n = request.get("nodeCount")
+    if n is None or request.get("faultyNodes") is None or request.get("budget") is None:
+        raise HTTPException(status_code=400, detail="Missing required parameters")
+    if request.get("objective", "success") not in ("success", "index"):
+        raise HTTPException(status_code=400, detail="objective 只能是 success 或 index")
+    validate_node_availability(request)
+    for field in ("upgradeCost", "targetReliability"):
+        value = request.get(field)
+        if value is not None and np.ndim(value) not in (0, 2):
+            raise HTTPException(status_code=400, detail=f"{field} 必须是数值或 n×n 矩阵")
+        if value is not None and np.ndim(value) == 2 and np.shape(value) != (n, n):
+            raise HTTPException(status_code=400, detail=f"{field} 必须是 {n}×{n} 矩阵")
+    if np.any(np.asarray(request.get("upgradeCost", 1.0), dtype=float) < 0):
+        raise HTTPException(status_code=400, detail="upgradeCost 不能为负数")
     
-    # ========== 10. 计算 Q_2(v): 平均发送能力 ==========
-    # Q_2(v) = 主节点 v 的平均 outgoing reliability
-    # 即：从节点 v 到其他所有节点的链路可靠性的平均值
-    outgoing_reliabilities = [P_comm[v, j] for j in range(n) if j != v]
-    Q_2 = np.mean(outgoing_reliabilities) if outgoing_reliabilities else 0.0
-    print(f"\n=== Q_2(v): 平均发送能力 ===")
-    print(f"  - Outgoing links: {[f'{p:.3f}' for p in outgoing_reliabilities]}")
-    print(f"  - Q_2(v) = {Q_2:.4f}")
+    try:
+        return await run_theory_job(
+            compute_link_upgrade_plan, request,
+            timeout=request.get("timeout", THEORY_JOB_TIMEOUT), http_request=http_request
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"链路升级优化错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def collect_receive_cache_stats() -> Dict[str, Any]:
+    """汇总主进程和所有理论计算进程的接收概率缓存统计"""
+    snapshots = [get_receive_prob_cache_stats()]
+    snapshots += [w["receive_cache_stats"] for w in theory_pool["workers"] if w.get("receive_cache_stats")]
+    total = {key: sum(s[key] for s in snapshots) for key in ("size", "hits", "misses", "evictions")}
+    total["maxSize"] = RECEIVE_PROB_CACHE_SIZE
+    total["hitRate"] = total["hits"] / (total["hits"] + total["misses"]) if total["hits"] + total["misses"] > 0 else 0.0
+    total["processes"] = len(snapshots)
+    return total
+
+@app.get("/api/theory/receive-cache/stats")
+async def get_receive_cache_stats():
+    """查看理论引擎接收概率 LRU 缓存的命中统计（汇总所有理论计算进程）"""
+    return collect_receive_cache_stats()
+
+@app.get("/api/theory/result-cache/stats")
+async def get_result_cache_stats():
+    """查看理论结果缓存的命中统计"""
+    return get_theory_result_cache_stats()
+
+@app.post("/api/theory/handles")
+async def create_theory_matrix_handle(request: dict, http_request: Request):
+    """创建可增量更新的矩阵句柄，返回所有主节点的理论成功率和主节点选择指标
     
-    # ========== 11. 归一化（Robust 方法）==========
-    # 注意：归一化需要所有节点的值，所以这里先返回原始值
-    # 在调用端批量归一化
+    Request body:
+    {
+        "nodeCount": int,
+        "faultyNodes": int,
+        "reliabilityMatrix": [[float]],
+        "nodeAvailability": [float] (optional),
+        "theoryMode": "bounds" | "auto" | "none" (optional, 默认 "bounds"),
+        "mcTrials": int (optional, auto 模式蒙特卡洛轮数，默认 THEORY_HANDLE_MC_TRIALS),
+        "mcSeed": int (optional, auto 模式蒙特卡洛随机种子，默认 0)
+    }
     
-    return {
-        'Q_pp': Q_pp,  # Pre-prepare 触达概率（原始方法）
-        'Q_w': Q_w,  # Weighted-Q 加权触达概率（新方法）
-        'Q_2': Q_2,  # ✅ 新增：平均发送能力
-        'Q_3': Q_3,  # ✅ NEW - Q_3(v) 严格阈值 (k=2f+2)
-        'E_v': E_v,  # 连续性指标（用于 tie-breaker）
-        'P_close': P_close,  # Cohort 闭环成功概率
-        'Q_fix': Q_fix,  # ✅ 新增：Q_fix = Q_pp × P_close
-        'cohort': cohort_nodes,  # ✅ 新增：Cohort 节点列表
-        'cohort_node_probs': cohort_node_success_probs,  # ✅ 新增：每个 cohort 节点的达标概率
-        'P_prep': P_prep.tolist(),  # 每个节点的 Prepare 阶段成功概率
-        'Phi_min': Phi_min,  # 最弱节点
-        'Phi_q': Phi_q,  # Quorum 聚合（尾概率方法）
-        'I_v': I_v,  # 综合指标（Q_pp × Φ_q）
-        'I_w': I_w,  # 加权综合指标（Q_w × Φ_q）
-        'C_B': C_B,  # 介数中心性
-        's_v': s_v,  # 节点在线率
-        'betweenness_all': betweenness.tolist(),  # 所有节点的介数中心性（用于批量归一化）
-        'w_u': w_u.tolist(),  # 每个节点的权重（用于调试）
-        'q_u': q_u.tolist()  # 节点有效性（用于调试）
+    之后用 PATCH /api/theory/handles/{handle} 修改单个或少量链路，只刷新受影响的项。
+    默认的 bounds 模式每次修改都能实时返回（随机序上下界，theoryMethod "bounds"）；
+    auto 模式（精确 / 蒙特卡洛）每次修改都要对所有主节点完整重算，n=30 时需要数秒，
+    建议编辑时用 bounds，需要精确值时再用 PATCH 的 theoryMode 切换（见 compute_matrix_handle_results）。
+    """
+    n = request.get("nodeCount")
+    matrix = request.get("reliabilityMatrix")
+    if n is None or request.get("faultyNodes") is None or not matrix:
+        raise HTTPException(status_code=400, detail="Missing required parameters")
+    if len(matrix) != n or any(len(row) != n for row in matrix):
+        raise HTTPException(status_code=400, detail=f"可靠度矩阵维度错误，应为{n}x{n}")
+    if request.get("theoryMode", "bounds") not in THEORY_HANDLE_MODES:
+        raise HTTPException(status_code=400, detail="theoryMode 只能是 bounds、auto 或 none")
+    validate_node_availability(request)
+    
+    handle_id = uuid.uuid4().hex
+    stored = {
+        "nodeCount": n,
+        "faultyNodes": request["faultyNodes"],
+        "reliabilityMatrix": [list(map(float, row)) for row in matrix],
+        "nodeAvailability": request.get("nodeAvailability"),
+        "theoryMode": request.get("theoryMode", "bounds"),
+        "mcTrials": request.get("mcTrials"),
+        "mcSeed": request.get("mcSeed", 0),
+        "version": 0
     }
+    theory_handle_requests[handle_id] = stored
+    while len(theory_handle_requests) > THEORY_MAX_HANDLES:
+        evicted, _ = theory_handle_requests.popitem(last=False)
+        theory_pool["affinity"].pop(evicted, None)
+    
+    try:
+        return await run_theory_job(open_theory_matrix_handle, handle_id, stored, timeout=THEORY_JOB_TIMEOUT,
+                                    http_request=http_request, affinity=handle_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"矩阵句柄创建错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-# HTTP路由
-@app.post("/api/theory/calculate")
-async def calculate_theory_direct(request: dict):
-    """直接计算理论成功率（不创建session）
+@app.patch("/api/theory/handles/{handle_id}")
+async def patch_theory_matrix_handle(handle_id: str, request: dict, http_request: Request):
+    """修改矩阵句柄中的若干链路并增量刷新结果
     
     Request body:
     {
-        "nodeCount": int,
-        "faultyNodes": int,
-        "proposerId": int,
-        "reliabilityMatrix": [[float]] (optional, n×n矩阵)
+        "updates": [{"i": int, "j": int, "value": float}],
+        "theoryMode": "bounds" | "auto" | "none" (optional, 同时切换理论计算方式，例如按需取精确值；
+                      updates 可以为空)
     }
     """
+    stored = theory_handle_requests.get(handle_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="矩阵句柄不存在")
+    updates = request.get("updates") or []
+    n = stored["nodeCount"]
+    for update in updates:
+        i, j, value = update.get("i"), update.get("j"), update.get("value")
+        if not (isinstance(i, int) and isinstance(j, int) and 0 <= i < n and 0 <= j < n) or i == j:
+            raise HTTPException(status_code=400, detail=f"链路下标无效: ({i}, {j})")
+        if not isinstance(value, (int, float)) or not 0 <= value <= 1:
+            raise HTTPException(status_code=400, detail=f"可靠度必须在 [0, 1] 内: {value}")
+    theory_mode = request.get("theoryMode", stored["theoryMode"])
+    if theory_mode not in THEORY_HANDLE_MODES:
+        raise HTTPException(status_code=400, detail="theoryMode 只能是 bounds、auto 或 none")
+    
+    stored["theoryMode"] = theory_mode
+    for update in updates:
+        stored["reliabilityMatrix"][update["i"]][update["j"]] = float(update["value"])
+    stored["version"] += 1
+    theory_handle_requests.move_to_end(handle_id)
+    
     try:
-        n = request.get("nodeCount")
-        f = request.get("faultyNodes")
-        proposer_id = request.get("proposerId", 0)
-        reliability_matrix = request.get("reliabilityMatrix")
-        node_availability = request.get("nodeAvailability")  # 新增：节点在线率
-        
-        if n is None or f is None:
-            raise HTTPException(status_code=400, detail="Missing required parameters")
-        
-        import numpy as np
-        
-        # 构建可靠度矩阵
-        if reliability_matrix:
-            # 使用自定义可靠度矩阵
-            P_comm = np.array(reliability_matrix)
-            theoretical_rate = calculate_theoretical_success_rate_custom_matrix(n, f, P_comm, proposer_id)
-        else:
-            # 使用均匀可靠度（从request中获取，或默认0.9）
-            p = request.get("reliability", 0.9)
-            P_comm = np.full((n, n), p)
-            np.fill_diagonal(P_comm, 1.0)  # 对角线为1
-            theoretical_rate = calculate_theoretical_success_rate_paper_simulation(n, f, p)
-        
-        # 计算主节点选择指标（新增 node_availability 参数）
-        metrics = calculate_primary_selection_metrics(n, f, P_comm, proposer_id, node_availability)
-        
-        return {
-            "theoreticalSuccessRate": theoretical_rate * 100,
-            "proposerId": proposer_id,
-            "metrics": {
-                "Q_pp": metrics['Q_pp'] * 100,      # 原始 Q(v)
-                "Q_w": metrics['Q_w'] * 100,        # ✅ NEW - 加权 Q_w(v)
-                "Q_2": metrics['Q_2'] * 100,        # ✅ NEW - 平均发送能力
-                "Q_3": metrics['Q_3'] * 100,        # ✅ NEW - 极严格阈值 Q_3(v) (k=n-1, 所有节点)
-                "E_v": metrics['E_v'],              # ✅ NEW - 连续性指标（tie-breaker）
-                "P_close": metrics['P_close'],      # ✅ NEW - Cohort 闭环成功概率
-                "Q_fix": metrics['Q_fix'],          # ✅ NEW - Q_fix = Q_pp × P_close
-                "cohort": metrics['cohort'],        # ✅ NEW - Cohort 节点列表
-                "cohort_node_probs": metrics['cohort_node_probs'],  # ✅ NEW - Cohort 节点达标概率
-                "P_prep": [p * 100 for p in metrics['P_prep']],
-                "Phi_min": metrics['Phi_min'] * 100,
-                "Phi_q": metrics['Phi_q'] * 100,
-                "I_v": metrics['I_v'] * 100,        # 原始 I(v)
-                "I_w": metrics['I_w'] * 100,        # ✅ NEW - 加权 I_w(v)
-                "C_B": metrics['C_B'],
-                "s_v": metrics['s_v'] * 100,
-                "betweenness_all": metrics['betweenness_all'],
-                "w_u": metrics['w_u'],              # ✅ 节点权重（双向能力）
-                "q_u": metrics['q_u']               # ✅ 节点有效性
-            }
-        }
+        return await run_theory_job(update_theory_matrix_handle, handle_id, stored, updates,
+                                    timeout=THEORY_JOB_TIMEOUT, http_request=http_request, affinity=handle_id)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"理论计算错误: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        print(f"矩阵句柄更新错误: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/api/theory/handles/{handle_id}")
+async def delete_theory_matrix_handle(handle_id: str):
+    """删除矩阵句柄"""
+    if theory_handle_requests.pop(handle_id, None) is None:
+        raise HTTPException(status_code=404, detail="矩阵句柄不存在")
+    await run_theory_job(close_theory_matrix_handle, handle_id, affinity=handle_id)
+    theory_pool["affinity"].pop(handle_id, None)
+    return {"success": True}
+
+@app.delete("/api/theory/result-cache")
+async def invalidate_result_cache():
+    """清空理论结果缓存（内存层和磁盘层）"""
+    removed = clear_theory_result_cache()
+    print(f"理论结果缓存已清空: 内存{removed['memory']}条, 磁盘{removed['disk']}条")
+    return {"success": True, "removed": removed}
+
+@app.post("/api/topologies")
+async def create_custom_topology(request: dict):
+    """上传边表或用生成器创建自定义拓扑，之后在会话 / 理论接口中以 "custom:<topologyId>" 作为 topology 使用
+    
+    Request body（二选一）:
+    {
+        "nodeCount": int,
+        "edges": [[u, v] 或 [u, v, reliability]],  # reliability ∈ (0, 1]：带权时每条边都要给出
+        "directed": bool (optional, 默认 false),
+        "name": str (optional)
+    }
+    {
+        "nodeCount": int,
+        "generator": "random-regular" | "small-world" | "scale-free",
+        "degree": int (random-regular), "k": int, "beta": float (small-world), "m": int (scale-free),
+        "seed": int (optional),
+        "name": str (optional)
+    }
+    
+    无权拓扑的链路可靠度使用会话的 messageDeliveryRate / 理论请求的 reliability；
+    带权拓扑的路由取最可靠路径，P_comm 为路径上各链路可靠度之积。
+    """
+    import numpy as np
+    
+    n = request.get("nodeCount")
+    if not isinstance(n, int) or n < 1:
+        raise HTTPException(status_code=400, detail="nodeCount 必须为正整数")
+    generator = request.get("generator")
+    try:
+        if generator is not None:
+            rng = np.random.default_rng(request.get("seed"))
+            if generator == "random-regular":
+                params = {"degree": int(request.get("degree", 4))}
+                edges = generate_random_regular_edges(n, params["degree"], rng)
+            elif generator == "small-world":
+                params = {"k": int(request.get("k", 4)), "beta": float(request.get("beta", 0.1))}
+                edges = generate_small_world_edges(n, params["k"], params["beta"], rng)
+            elif generator == "scale-free":
+                params = {"m": int(request.get("m", 2))}
+                edges = generate_scale_free_edges(n, params["m"], rng)
+            else:
+                raise HTTPException(status_code=400, detail="generator 只能是 random-regular、small-world 或 scale-free")
+            params["seed"] = request.get("seed")
+            record = register_custom_topology(n, edges, name=request.get("name"), source=generator, params=params)
+        else:
+            edge_list = request.get("edges")
+            if not isinstance(edge_list, list) or any(not isinstance(e, list) or len(e) not in (2, 3) for e in edge_list):
+                raise HTTPException(status_code=400, detail="edges 必须是 [u, v] 或 [u, v, reliability] 的列表")
+            lengths = {len(e) for e in edge_list}
+            if len(lengths) > 1:
+                raise HTTPException(status_code=400, detail="带权边表的每条边都必须给出 reliability")
+            weighted = lengths == {3}
+            record = register_custom_topology(
+                n, [e[:2] for e in edge_list], [e[2] for e in edge_list] if weighted else None,
+                directed=bool(request.get("directed", False)), name=request.get("name")
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    summary = summarize_custom_topology(record)
+    print(f"注册自定义拓扑 {summary['topology']}: {n} 个节点, {summary['edgeCount']} 条边, "
+          f"{summary['unreachablePairs']} 个节点对不可达")
+    return summary
+
+@app.get("/api/topologies")
+async def list_custom_topologies():
+    """列出已注册的自定义拓扑"""
+    return {"topologies": [summarize_custom_topology(record) for record in custom_topologies.values()]}
+
+@app.get("/api/topologies/{topology_id}")
+async def get_custom_topology_info(topology_id: str):
+    """自定义拓扑的摘要和边表（[u, v] 或 [u, v, reliability]，无向图每条边只列一次）"""
+    record = custom_topologies.get(topology_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="自定义拓扑不存在")
+    coo = record["graph"].tocoo()
+    keep = coo.row < coo.col if not record["directed"] else slice(None)
+    rows, cols, weights = coo.row[keep].tolist(), coo.col[keep].tolist(), coo.data[keep].tolist()
+    edges = ([[u, v, w] for u, v, w in zip(rows, cols, weights)] if record["weighted"]
+             else [[u, v] for u, v in zip(rows, cols)])
+    return {**summarize_custom_topology(record), "edges": edges}
+
+@app.delete("/api/topologies/{topology_id}")
+async def delete_custom_topology(topology_id: str):
+    """删除自定义拓扑（已创建的会话保留自己的路径预言机，不受影响）"""
+    if custom_topologies.pop(topology_id, None) is None:
+        raise HTTPException(status_code=404, detail="自定义拓扑不存在")
+    evict_custom_topology_caches(topology_id)
+    return {"message": "自定义拓扑已删除"}
+
 @app.post("/api/sessions")
 async def create_consensus_session(config: SessionConfig):
     """创建新的共识会话"""
+    try:
+        build_topology_graph(config.nodeCount, config.topology, config.branchCount)
+        if config.routingPaths is not None:
+            get_disjoint_path_router(config.nodeCount, config.topology, config.branchCount,
+                                     config.routingPaths, config.routingDisjoint or "node")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         session_info = create_session(config)
         return session_info
@@ -1838,89 +5353,81 @@ async def reset_round(session_id: str):
         "phase": session["phase"]
     }
 
-class BatchExperimentRequest(BaseModel):
-    rounds: int = 30
-    customReliabilityMatrix: Optional[List[List[float]]] = None  # 自定义可靠度矩阵
-    averageDirectReliability: Optional[float] = None  # 平均直连可靠度
-
-@app.post("/api/sessions/{session_id}/run-batch-experiment")
-async def run_batch_experiment(session_id: str, request: BatchExperimentRequest):
-    """批量运行多轮实验，完成后一次性返回所有结果
-    
-    Args:
-        session_id: 会话ID
-        request: 包含实验轮数和可选的自定义可靠度矩阵
+def format_batch_theory_info(auto_result: Dict[str, Any]) -> Dict[str, Any]:
+    """calculate_theoretical_success_custom_matrix_auto 的结果转换为批量实验返回的理论方法信息"""
+    theory_info = {"method": auto_result['method']}
+    if auto_result['monteCarlo'] is not None:
+        theory_info["monteCarlo"] = format_monte_carlo_result(auto_result['monteCarlo'])
+    if auto_result['bounds'] is not None:
+        theory_info["bounds"] = format_bounds_result(auto_result['bounds'], 0.0)
+    return theory_info
+
+def calculate_batch_theory(n: int, f: int, p: float, topology: str, n_value: int, proposer_id: int,
+                           rounds: int, custom_matrix=None, average_direct_reliability=None,
+                           node_availability=None, topology_matrix=None):
+    """批量实验的理论成功率计算（在理论计算进程池中执行）
+    
+    node_availability 不为 None 时与实验的节点掉线模式对应：在线率计入 pre-prepare 阶段，用矩阵引擎计算。
+    自定义拓扑由主进程按会话的路径预言机算好 P_comm 作为 topology_matrix 传入；
+    多路径路由的会话传入按不相交路径计算的 P_comm（topology_reliability_matrix，同样在进程池中展开）。
+    矩阵引擎按 calculate_theoretical_success_custom_matrix_auto 选择方法，精确计算不可行时为蒙特卡洛估计。
     
     Returns:
-        {
-            "results": [...],  # 每轮的结果
-            "theoreticalSuccessRate": 0.85,  # 理论成功率
-            "experimentalSuccessRate": 0.83  # 实验成功率
-        }
+        (theoretical_rate, avg_reliability_theoretical, theory_info)
+        theory_info: {'method': 实际使用的方法, 'monteCarlo' / 'bounds': 对应方法的区间（API 格式，可选）}
     """
-    print(f"\n[DEBUG] run_batch_experiment 收到请求:")
-    print(f"  - session_id: {session_id}")
-    print(f"  - rounds: {request.rounds}")
-    print(f"  - customReliabilityMatrix: {'有' if request.customReliabilityMatrix else '无'}")
-    print(f"  - averageDirectReliability: {request.averageDirectReliability}")
-    
-    session = get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="会话不存在")
-    
-    config = session["config"]
-    n = config["nodeCount"]
-    f = (n - 1) // 3
-    p = config["messageDeliveryRate"] / 100.0  # 转换为概率
-    topology = config["topology"]
-    n_value = config.get("branchCount", 2)
-    proposer_id = config.get("proposerId", 0)  # 获取主节点ID
-    rounds = request.rounds
-    custom_matrix = request.customReliabilityMatrix
-    
-    # 如果提供了自定义矩阵，将其存储到session中用于实验
-    if custom_matrix:
-        import numpy as np
-        # 验证矩阵维度
-        if len(custom_matrix) != n or any(len(row) != n for row in custom_matrix):
-            raise HTTPException(status_code=400, detail=f"自定义矩阵维度错误，应为{n}x{n}")
-        
-        # 转换为numpy数组
-        P_comm_custom = np.array(custom_matrix)
-        session["custom_reliability_matrix"] = P_comm_custom.tolist()
-        
-        print(f"使用自定义可靠度矩阵：")
-        print(f"  矩阵维度: {n}x{n}")
-        print(f"  平均可靠度: {np.mean([P_comm_custom[i][j] for i in range(n) for j in range(n) if i != j]):.4f}")
-    else:
-        session["custom_reliability_matrix"] = None
-    
-    # 计算理论成功率
     avg_reliability_theoretical = None  # 基于平均直连可靠度的理论值
+    theory_info = {"method": "exact"}
     
-    if custom_matrix:
+    if has_partial_availability(node_availability) or (topology_matrix is not None and not custom_matrix):
+        import numpy as np
+        if custom_matrix:
+            P_comm = np.array(custom_matrix, dtype=float)
+        elif topology_matrix is not None:
+            P_comm = np.array(topology_matrix, dtype=float)
+        elif topology == "full":
+            P_comm = np.full((n, n), p)
+            np.fill_diagonal(P_comm, 1.0)
+        else:
+            P_comm = calculate_comm_reliability_matrix_shortest_path(n, topology, n_value, p)
+        auto_result = calculate_theoretical_success_custom_matrix_auto(
+            n, f, P_comm, proposer_id, node_availability=node_availability
+        )
+        theoretical_rate = auto_result['rate']
+        theory_info = format_batch_theory_info(auto_result)
+        print(f"开始批量实验：{rounds}轮，n={n}, f={f}, 主节点={proposer_id}, 拓扑={topology}"
+              + (", 节点掉线模式" if node_availability is not None else ""))
+        if node_availability is not None:
+            print(f"  节点在线率={[round(x, 3) for x in node_availability]}")
+        print(f"  理论成功率={theoretical_rate:.4f} (基于拓扑可靠度矩阵，{auto_result['method']})")
+    elif custom_matrix:
         # 使用自定义矩阵计算理论成功率
         import numpy as np
         P_comm_custom = np.array(custom_matrix)
-        theoretical_rate = calculate_theoretical_success_rate_custom_matrix(n, f, P_comm_custom, proposer_id)
+        auto_result = calculate_theoretical_success_custom_matrix_auto(n, f, P_comm_custom, proposer_id)
+        theoretical_rate = auto_result['rate']
+        theory_info = format_batch_theory_info(auto_result)
         print(f"开始批量实验：{rounds}轮，n={n}, f={f}, 主节点={proposer_id}, 使用自定义可靠度矩阵")
-        print(f"  理论成功率={theoretical_rate:.4f} (基于自定义矩阵的精确计算)")
+        print(f"  理论成功率={theoretical_rate:.4f} (基于自定义矩阵，{auto_result['method']})")
         
         # 如果提供了平均直连可靠度，计算对应的理论值
-        if request.averageDirectReliability is not None:
-            avg_p = request.averageDirectReliability
+        if average_direct_reliability is not None:
+            avg_p = average_direct_reliability
             print(f"  平均直连可靠度={avg_p:.4f}")
             
             # 使用平均可靠度计算理论成功率
             if topology == "full":
                 avg_reliability_theoretical = calculate_theoretical_success_rate(n, f, avg_p) * 100
+            elif topology.startswith("custom:"):
+                print("  自定义拓扑不在理论计算进程中注册，跳过平均可靠度理论值")
             else:
-                avg_reliability_theoretical = calculate_theoretical_success_rate_multihop(n, f, topology, n_value, avg_p, proposer_id) * 100
+                avg_reliability_theoretical = calculate_theoretical_success_rate_multihop(n, f, topology, n_value, avg_p, proposer_id)['rate'] * 100
             
             print(f"  平均可靠度理论成功率={avg_reliability_theoretical:.4f}% (用于对比)")
     elif topology == "full":
         # 全连接拓扑：使用精确公式
         theoretical_rate = calculate_theoretical_success_rate(n, f, p)
+        theory_info = {"method": "closed-form"}
         print(f"开始批量实验：{rounds}轮，n={n}, f={f}, p={p}, 拓扑={topology}")
         print(f"  理论成功率={theoretical_rate:.4f} (精确计算)")
     else:
@@ -1931,7 +5438,9 @@ async def run_batch_experiment(session_id: str, request: BatchExperimentRequest)
             # 使用正确的路径策略计算理论成功率
             # - 星形：中心↔边缘1跳，边缘↔边缘2跳
             # - 环形：相邻1跳，不相邻尝试两个方向
-            theoretical_rate = calculate_theoretical_success_rate_multihop(n, f, topology, n_value, p, proposer_id)
+            auto_result = calculate_theoretical_success_rate_multihop(n, f, topology, n_value, p, proposer_id)
+            theoretical_rate = auto_result['rate']
+            theory_info = format_batch_theory_info(auto_result)
             
             # 同时计算平均跳数等统计信息（用于日志）
             topo_stats = calculate_effective_reliability(n, topology, n_value, p)
@@ -1940,7 +5449,7 @@ async def run_batch_experiment(session_id: str, request: BatchExperimentRequest)
             
             print(f"开始批量实验：{rounds}轮，n={n}, f={f}, p={p:.2f}, 拓扑={topology}, 主节点={proposer_id}")
             print(f"  平均跳数={avg_hops:.2f}, 最大跳数={max_hops}")
-            print(f"  理论成功率={theoretical_rate:.4f} (基于路径策略的精确计算)")
+            print(f"  理论成功率={theoretical_rate:.4f} (基于路径策略，{auto_result['method']})")
         except ImportError:
             print("警告：numpy未安装，回退到平均跳数近似法")
             # 回退到平均跳数近似法
@@ -1950,6 +5459,7 @@ async def run_batch_experiment(session_id: str, request: BatchExperimentRequest)
             max_hops = topo_stats['max_hops']
             
             theoretical_rate = calculate_theoretical_success_rate(n, f, p_eff)
+            theory_info = {"method": "approximation"}
             
             print(f"开始批量实验：{rounds}轮，n={n}, f={f}, p={p:.2f}, 拓扑={topology}")
             print(f"  平均跳数={avg_hops:.2f}, 最大跳数={max_hops}, 有效可靠性={p_eff:.4f}")
@@ -1962,49 +5472,155 @@ async def run_batch_experiment(session_id: str, request: BatchExperimentRequest)
             topo_stats = calculate_effective_reliability(n, topology, n_value, p)
             p_eff = topo_stats['p_effective']
             theoretical_rate = calculate_theoretical_success_rate(n, f, p_eff)
+            theory_info = {"method": "approximation"}
             print(f"  回退到平均跳数近似法，理论成功率={theoretical_rate:.4f}")
     
+    return theoretical_rate, avg_reliability_theoretical, theory_info
+
+class BatchExperimentRequest(BaseModel):
+    rounds: int = 30
+    customReliabilityMatrix: Optional[List[List[float]]] = None  # 自定义可靠度矩阵
+    averageDirectReliability: Optional[float] = None  # 平均直连可靠度
+    nodeAvailability: Optional[List[float]] = None  # 节点在线率：每轮按该概率独立决定节点是否在线（节点掉线模式）
+
+@app.post("/api/sessions/{session_id}/run-batch-experiment")
+async def run_batch_experiment(session_id: str, request: BatchExperimentRequest):
+    """批量运行多轮实验，完成后一次性返回所有结果
+    
+    Args:
+        session_id: 会话ID
+        request: 包含实验轮数和可选的自定义可靠度矩阵、节点在线率
+    
+    提供 nodeAvailability 时为节点掉线模式：每轮开始前节点 i 以 1 - s_i 的概率离线，
+    离线节点本轮不收发任何消息；理论成功率按同一在线率计算，两者可以直接比较。
+    
+    Returns:
+        {
+            "results": [...],  # 每轮的结果（掉线模式下含 offlineNodes）
+            "theoreticalSuccessRate": 0.85,  # 理论成功率
+            "theoryMethod": "exact",  # 理论值的计算方法（非精确值时附带 monteCarlo / bounds 区间）
+            "theoryExact": true,  # 理论值是否为精确值（monte-carlo / bounds / approximation 时为 false）
+            "experimentalSuccessRate": 0.83  # 实验成功率
+        }
+    """
+    print(f"\n[DEBUG] run_batch_experiment 收到请求:")
+    print(f"  - session_id: {session_id}")
+    print(f"  - rounds: {request.rounds}")
+    print(f"  - customReliabilityMatrix: {'有' if request.customReliabilityMatrix else '无'}")
+    print(f"  - averageDirectReliability: {request.averageDirectReliability}")
+    print(f"  - nodeAvailability: {'有' if request.nodeAvailability else '无'}")
+    
+    session = get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    
+    config = session["config"]
+    n = config["nodeCount"]
+    f = (n - 1) // 3
+    p = config["messageDeliveryRate"] / 100.0  # 转换为概率
+    topology = config["topology"]
+    n_value = config.get("branchCount", 2)
+    proposer_id = config.get("proposerId", 0)  # 获取主节点ID
+    rounds = request.rounds
+    custom_matrix = request.customReliabilityMatrix
+    
+    # 如果提供了自定义矩阵，将其存储到session中用于实验
+    if custom_matrix:
+        import numpy as np
+        # 验证矩阵维度
+        if len(custom_matrix) != n or any(len(row) != n for row in custom_matrix):
+            raise HTTPException(status_code=400, detail=f"自定义矩阵维度错误，应为{n}x{n}")
+        
+        # 转换为numpy数组
+        P_comm_custom = np.array(custom_matrix)
+        session["custom_reliability_matrix"] = P_comm_custom.tolist()
+        
+        print(f"使用自定义可靠度矩阵：")
+        print(f"  矩阵维度: {n}x{n}")
+        print(f"  平均可靠度: {np.mean([P_comm_custom[i][j] for i in range(n) for j in range(n) if i != j]):.4f}")
+    else:
+        session["custom_reliability_matrix"] = None
+    
+    node_availability = request.nodeAvailability
+    if node_availability is not None:
+        if len(node_availability) != n or any(not 0 <= x <= 1 for x in node_availability):
+            raise HTTPException(status_code=400, detail=f"nodeAvailability 应为长度{n}、取值在 [0, 1] 内的列表")
+        if not has_partial_availability(node_availability):
+            node_availability = None  # 全部在线，与普通模式相同
+    
+    # 自定义拓扑（最短路径）：用会话的路径预言机展开为可靠度矩阵再交给理论计算进程（O(n²)）；
+    # 多路径路由的会话按同样的不相交路径计算 P_comm，理论值与实验的投递模型一致，
+    # 展开代价高，与理论计算一样在进程池中执行（按参数缓存），两步共用 THEORY_JOB_TIMEOUT
+    topology_matrix = None
+    if topology.startswith("custom:") and not custom_matrix and not config.get("routingPaths"):
+        topology_matrix = reliability_matrix_from_oracle(session["path_oracle"], p)
+    
+    async def batch_theory():
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        matrix = topology_matrix
+        if config.get("routingPaths") and not custom_matrix:
+            matrix = await topology_reliability_matrix(
+                n, topology, n_value, p, "disjoint-paths",
+                {"k": config["routingPaths"], "mode": config.get("routingDisjoint") or "node"},
+                timeout=THEORY_JOB_TIMEOUT
+            )
+        return await run_theory_job(
+            calculate_batch_theory, n, f, p, topology, n_value, proposer_id, rounds,
+            custom_matrix, request.averageDirectReliability, node_availability, matrix,
+            timeout=THEORY_JOB_TIMEOUT - (loop.time() - start_time)
+        )
+    
+    # 计算理论成功率：在理论计算进程池中与实验轮次并行执行，不阻塞事件循环
+    theory_task = asyncio.create_task(batch_theory())
+    
     # 存储所有轮次的结果
     all_results = []
-
+    
     # 批量实验必须严格"等一轮结束再进入下一轮"，否则会出现异步任务跨轮写入（round字段错乱）
     # 这里复用现有的 reset_round 逻辑，确保每轮初始化、触发、超时机制一致。
     session["current_round"] = 0
     session["consensus_finalized_round"] = None
     session["last_pre_prepare_round"] = None
-
+    
     for round_num in range(1, rounds + 1):
+        # 节点掉线模式：本轮开始前独立抽取离线节点（should_deliver_message 中屏蔽其收发）
+        offline_nodes = set()
+        if node_availability is not None:
+            offline_nodes = {i for i in range(n) if random.random() >= node_availability[i]}
+        session["offline_nodes"] = offline_nodes
+        
         # 触发新一轮（reset_round 内部会 +1 并触发 pre-prepare）
         reset_info = await reset_round(session_id)
         current_round = reset_info.get("currentRound", round_num)
-
+    
         # 等待本轮结束：
         # - 成功会由 check_commit_phase -> finalize_consensus 写入 consensus_history
         # - 失败会由 timeout_task(2s) -> finalize_consensus 写入 consensus_history
         max_wait = 3.0  # 给 finalize_consensus 留一点余量，避免2s边界竞态
         check_interval = 0.05
         waited_time = 0.0
-
+    
         while waited_time < max_wait:
             await asyncio.sleep(check_interval)
             waited_time += check_interval
-
+    
             session = get_session(session_id)
             if not session:
                 break
-
+    
             # 优先用 finalized_round，避免 history 还未来得及 append 的瞬间
             if session.get("consensus_finalized_round") == current_round:
                 break
-
+    
             history = session.get("consensus_history", [])
             if any(h.get("round") == current_round for h in history):
                 break
-
+    
         session = get_session(session_id)
         if not session:
             break
-
+    
         history = session.get("consensus_history", [])
         round_history = next((h for h in history if h.get("round") == current_round), None)
         
@@ -2025,7 +5641,7 @@ async def run_batch_experiment(session_id: str, request: BatchExperimentRequest)
             status_text = round_history.get("status", "")
             description = round_history.get("description", "")
             success = "Succeeded" in status_text or "成功" in status_text
-
+    
             if not success:
                 if "Timeout" in status_text or "超时" in status_text:
                     failure_reason = "Timeout"
@@ -2043,26 +5659,48 @@ async def run_batch_experiment(session_id: str, request: BatchExperimentRequest)
             "failureReason": failure_reason,
             "waitTime": round(waited_time * 1000)  # 转换为毫秒
         }
+        if node_availability is not None:
+            result["offlineNodes"] = sorted(offline_nodes)
         
         all_results.append(result)
         
         print(f"第{round_num}轮完成: {'成功' if success else '失败'}, 消息数={message_count}, 等待时间={result['waitTime']}ms")
     
+    # 批量实验结束后恢复全部在线，不影响之后的交互模式
+    if session:
+        session["offline_nodes"] = set()
+    
     # 计算实验成功率
     success_count = sum(1 for r in all_results if r["success"])
     experimental_rate = success_count / len(all_results) if all_results else 0
     
-    print(f"批量实验完成：成功{success_count}/{len(all_results)}轮，实验成功率={experimental_rate:.4f}，理论成功率={theoretical_rate:.4f}")
+    try:
+        theoretical_rate, avg_reliability_theoretical, theory_info = await theory_task
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        print(f"错误：理论成功率计算失败 - {detail}")
+        theoretical_rate, avg_reliability_theoretical, theory_info = None, None, {}
+    
+    theoretical_text = f"{theoretical_rate:.4f}" if theoretical_rate is not None else "N/A"
+    print(f"批量实验完成：成功{success_count}/{len(all_results)}轮，实验成功率={experimental_rate:.4f}，理论成功率={theoretical_text}")
     
     response_data = {
         "results": all_results,
-        "theoreticalSuccessRate": round(theoretical_rate * 100, 2),  # 转换为百分比
+        "theoreticalSuccessRate": round(theoretical_rate * 100, 2) if theoretical_rate is not None else None,  # 转换为百分比
+        "theoryMethod": theory_info.get("method"),  # exact / monte-carlo / bounds / closed-form / approximation
+        "theoryExact": theory_info.get("method") in EXACT_THEORY_METHODS,  # 理论值是否为精确值
         "experimentalSuccessRate": round(experimental_rate * 100, 2),
         "totalRounds": len(all_results),
         "successCount": success_count,
         "failureCount": len(all_results) - success_count
     }
     
+    # 理论值不是精确值时附带蒙特卡洛置信区间或带证书的区间
+    if "monteCarlo" in theory_info:
+        response_data["monteCarlo"] = theory_info["monteCarlo"]
+    if "bounds" in theory_info:
+        response_data["bounds"] = theory_info["bounds"]
+    
     # 如果有平均可靠度理论值，添加到返回结果
     if avg_reliability_theoretical is not None:
         response_data["averageReliabilityTheoretical"] = round(avg_reliability_theoretical, 2)
@@ -2171,16 +5809,14 @@ async def get_session_history(session_id: str, round: Optional[int] = None):
     print(f"第 {round} 轮消息数量: pre_prepare={len(round_pre_prepare)}, "
           f"prepare={len(round_prepare)}, commit={len(round_commit)}")
     
-    # 获取最短路径用于动画
-    shortest_paths = session.get("shortest_paths", {})
+    # 获取最短路径用于动画（路径预言机按拓扑缓存，每次查询只沿下一跳数组走一遍）
+    oracle = session.get("path_oracle") or get_path_oracle(n, topology, n_value)
 
     def get_path(src, dst):
         """获取src到dst的最短路径节点列表"""
-        key = (src, dst)
-        if key in shortest_paths:
-            return shortest_paths[key]
-        # full拓扑直连
-        return [src, dst]
+        path = oracle_path(oracle, src, dst) if src != dst else None
+        # 不可达时按直连处理
+        return path if path is not None else [src, dst]
 
     # 转换消息格式以适配动画组件
     # Pre-prepare消息 - 展开广播为点对点消息
@@ -2190,7 +5826,7 @@ async def get_session_history(session_id: str, round: Optional[int] = None):
         value = msg.get("value", config["proposalValue"])
         if msg.get("to") == "all":
             for dst in range(n):
-                if dst != src and is_connection_allowed(src, dst, n, topology, n_value):
+                if dst != src and oracle["dist"][src, dst] > 0:
                     pre_prepare_messages.append({
                         "src": src,
                         "dst": dst,
@@ -2215,7 +5851,7 @@ async def get_session_history(session_id: str, round: Optional[int] = None):
         value = msg.get("value", config["proposalValue"])
         if msg.get("to") == "all":
             for dst in range(n):
-                if dst != src and is_connection_allowed(src, dst, n, topology, n_value):
+                if dst != src and oracle["dist"][src, dst] > 0:
                     prepare_messages.append({
                         "src": src,
                         "dst": dst,
@@ -2241,7 +5877,7 @@ async def get_session_history(session_id: str, round: Optional[int] = None):
         # 如果是广播消息，展开为多个点对点消息
         if msg.get("to") == "all":
             for dst in range(n):
-                if dst != src and is_connection_allowed(src, dst, n, topology, n_value):
+                if dst != src and oracle["dist"][src, dst] > 0:
                     commit_messages.append({
                         "src": src,
                         "dst": dst,
@@ -3494,10 +7130,11 @@ async def run_experiment_round_sync(session_id: str):
     prepare_threshold = 2 * f - 1      # prepare阶段门限：从其他节点收到2f-1条（加自己=2f）
     commit_threshold = 2 * f           # commit阶段门限：从其他节点收到2f条（加自己=2f+1）
 
-    # V_pp
+    # V_pp（节点掉线模式下离线的主节点也不计入）
+    offline_nodes = session.get("offline_nodes") or set()
     V_pp = [
         node_id for node_id in session["robot_nodes"]
-        if session["robot_node_states"][node_id].get("received_pre_prepare")
+        if session["robot_node_states"][node_id].get("received_pre_prepare") and node_id not in offline_nodes
     ]
 
     # 口径A：Nc>=N-f => Npp>=N-f，否则必失败
@@ -0,0 +1,10 @@
+"""测试公共设置：把 backend（main）和 benchmarks（暴力参考实现）加入导入路径
+
+用法（在 backend 目录下）：
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
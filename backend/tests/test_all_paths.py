@@ -0,0 +1,27 @@
+"""“所有路径”可靠度矩阵：对数域向量化结果与原逐元素实现一致，提前停止只带来 tol 以内的差异"""
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+from bench_all_paths import reference_all_paths
+from main import build_adjacency_matrix, calculate_comm_reliability_matrix
+
+
+@pytest.mark.parametrize("topology", ["ring", "star", "tree", "full"])
+@pytest.mark.parametrize("n", [8, 20])
+@pytest.mark.parametrize("p", [0.5, 0.9])
+def test_matches_elementwise_reference(topology, n, p):
+    A = build_adjacency_matrix(n, topology, 2)
+    expected = reference_all_paths(A.astype(float), p)
+    full = calculate_comm_reliability_matrix(A, p, tol=0)
+    np.testing.assert_allclose(full, expected, rtol=0, atol=1e-12)
+    # 提前停止的结果与计算到 n-1 的结果相差不超过 tol
+    np.testing.assert_allclose(calculate_comm_reliability_matrix(A, p, tol=1e-12), full, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(calculate_comm_reliability_matrix(csr_matrix(A), p), full, rtol=0, atol=1e-12)
+
+
+def test_no_overflow_on_large_dense_graph():
+    # 完全图 n=200 的路径数远超 int64，原实现的整数幂在此溢出
+    P_comm = calculate_comm_reliability_matrix(build_adjacency_matrix(200, "full", 2), 0.3)
+    assert np.all(np.isfinite(P_comm)) and np.all((P_comm >= 0) & (P_comm <= 1))
+    np.testing.assert_allclose(np.diag(P_comm), 1.0)
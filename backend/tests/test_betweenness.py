@@ -0,0 +1,54 @@
+"""介数中心性：csgraph Dijkstra + 批量 Brandes 与原 NetworkX 实现一致"""
+import numpy as np
+import pytest
+
+from main import calculate_betweenness_centrality
+
+nx = pytest.importorskip("networkx")
+
+
+def networkx_betweenness(P_comm):
+    """原实现：代价 -log(p) 的有向图上 NetworkX betweenness_centrality（不归一化）"""
+    n = len(P_comm)
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(n))
+    for i in range(n):
+        for j in range(n):
+            if i != j and P_comm[i][j] > 0:
+                graph.add_edge(i, j, weight=-np.log(P_comm[i][j] + 1e-10))
+    values = nx.betweenness_centrality(graph, weight="weight", normalized=False)
+    return np.array([values[i] for i in range(n)])
+
+
+def ring_matrix(n: int, p: float, chords=()):
+    P_comm = np.eye(n)
+    for i in range(n):
+        P_comm[i, (i + 1) % n] = P_comm[(i + 1) % n, i] = p
+    for i, j in chords:
+        P_comm[i, j] = P_comm[j, i] = p
+    return P_comm
+
+
+def sparse_random_matrix(n: int, seed: int):
+    rng = np.random.default_rng(seed)
+    P_comm = np.where(rng.random((n, n)) < 0.3, rng.uniform(0.5, 0.99, (n, n)), 0.0)
+    np.fill_diagonal(P_comm, 1.0)
+    return P_comm
+
+
+@pytest.mark.parametrize("P_comm", [
+    sparse_random_matrix(12, 0),
+    sparse_random_matrix(25, 1),
+    np.random.default_rng(2).uniform(0.3, 0.99, (15, 15)),
+    ring_matrix(10, 0.9),
+    ring_matrix(12, 0.8, chords=[(0, 6), (3, 9)]),
+], ids=["sparse-12", "sparse-25", "dense-15", "ring-ties", "ring-chords-ties"])
+def test_matches_networkx(P_comm):
+    np.testing.assert_allclose(calculate_betweenness_centrality(P_comm), networkx_betweenness(P_comm), atol=1e-9)
+
+
+def test_cached_result_is_a_copy():
+    P_comm = sparse_random_matrix(10, 3)
+    first = calculate_betweenness_centrality(P_comm)
+    first[:] = -1
+    np.testing.assert_allclose(calculate_betweenness_centrality(P_comm), networkx_betweenness(P_comm), atol=1e-9)
@@ -0,0 +1,54 @@
+"""闭式理论成功率：向量化 p 扫描与原逐项求和实现（benchmarks/bench_closed_form.py）一致，对数域核在大 n 下数值稳定"""
+import numpy as np
+import pytest
+
+from bench_closed_form import reference_success_rate
+from main import (
+    binom_tail_ge_array,
+    calculate_theoretical_success_rate,
+    calculate_theoretical_success_rate_sweep,
+    log_binom_pmf_array,
+    theory_engine_custom_matrix,
+)
+
+P_GRID = np.linspace(0.5, 1.0, 11)
+
+
+@pytest.mark.parametrize("n", [4, 7, 10, 16, 31])
+def test_sweep_matches_scalar_reference(n):
+    f = (n - 1) // 3
+    rates = calculate_theoretical_success_rate_sweep(n, f, P_GRID)
+    expected = [reference_success_rate(n, f, p) for p in P_GRID]
+    np.testing.assert_allclose(rates, expected, atol=1e-12)
+    for p, rate in zip(P_GRID, rates):
+        assert calculate_theoretical_success_rate(n, f, p) == pytest.approx(rate, abs=1e-15)
+
+
+@pytest.mark.parametrize("p", [0.7, 0.9])
+def test_closed_form_matches_uniform_matrix_engine(p):
+    P_comm = np.full((7, 7), p)
+    np.fill_diagonal(P_comm, 1.0)
+    assert calculate_theoretical_success_rate(7, 2, p) == \
+        pytest.approx(theory_engine_custom_matrix(7, 2, P_comm)['success_rate'], abs=1e-12)
+
+
+def test_log_space_kernels_match_scipy():
+    from scipy.stats import binom
+
+    m = np.arange(0, 60)[:, None]
+    k = np.arange(0, 60)[None, :]
+    for prob in [0.0, 0.3, 0.999, 1.0]:
+        expected = np.where(k <= m, binom.logpmf(k, m, prob), -np.inf)
+        np.testing.assert_allclose(log_binom_pmf_array(k, m, prob), expected, atol=1e-9)
+    np.testing.assert_allclose(binom_tail_ge_array(np.arange(-1, 30), 10, 0.4),
+                               np.where(np.arange(-1, 30) >= 10, binom.sf(9, np.maximum(np.arange(-1, 30), 0), 0.4), 0.0))
+    assert np.all(binom_tail_ge_array(np.arange(-1, 5), 0, 0.4) == 1.0)
+
+
+@pytest.mark.parametrize("n", [301, 1000])
+def test_large_n_is_finite_and_monotone(n):
+    f = (n - 1) // 3
+    rates = calculate_theoretical_success_rate_sweep(n, f, np.linspace(0.5, 1.0, 21))
+    assert np.all(np.isfinite(rates)) and np.all((rates >= 0) & (rates <= 1 + 1e-12))
+    assert np.all(np.diff(rates) >= -1e-12)
+    assert rates[-1] == pytest.approx(1.0, abs=1e-12)
@@ -0,0 +1,79 @@
+"""自定义拓扑：生成器的图结构、CSR 存储接入路径预言机和 P_comm 矩阵"""
+import numpy as np
+import pytest
+
+from bench_path_oracle import check
+from main import (
+    calculate_comm_reliability_matrix_shortest_path,
+    generate_random_regular_edges,
+    generate_scale_free_edges,
+    generate_small_world_edges,
+    register_custom_topology,
+    summarize_custom_topology,
+)
+
+
+def degrees(n: int, edges):
+    return np.bincount(np.asarray(edges).ravel(), minlength=n)
+
+
+def assert_simple_graph(edges):
+    pairs = {(min(u, v), max(u, v)) for u, v in edges}
+    assert len(pairs) == len(edges) and all(u != v for u, v in edges)
+
+
+def test_generators_produce_simple_graphs_with_expected_degrees():
+    rng = np.random.default_rng(0)
+    regular = generate_random_regular_edges(30, 4, rng)
+    assert_simple_graph(regular)
+    assert np.all(degrees(30, regular) == 4)
+
+    small_world = generate_small_world_edges(30, 4, 0.2, rng)
+    assert_simple_graph(small_world)
+    assert len(small_world) == 30 * 4 // 2  # 重连不改变边数
+
+    scale_free = generate_scale_free_edges(30, 2, rng)
+    assert_simple_graph(scale_free)
+    assert len(scale_free) == 2 * (30 - 2)
+
+
+@pytest.mark.parametrize("generator, args", [
+    (generate_random_regular_edges, (20, 3)),
+    (generate_small_world_edges, (20, 4, 0.2)),
+    (generate_scale_free_edges, (20, 2)),
+])
+def test_path_oracle_matches_floyd_warshall_on_generated_topology(generator, args):
+    record = register_custom_topology(args[0], generator(*args, np.random.default_rng(1)))
+    check(args[0], f"custom:{record['id']}", 2)
+
+
+def test_edge_list_of_builtin_tree_gives_same_reliability_matrix():
+    n = 15
+    record = register_custom_topology(n, [((i - 1) // 2, i) for i in range(1, n)])
+    np.testing.assert_allclose(calculate_comm_reliability_matrix_shortest_path(n, f"custom:{record['id']}", 2, 0.9),
+                               calculate_comm_reliability_matrix_shortest_path(n, "tree", 2, 0.9))
+
+
+def test_weighted_topology_uses_most_reliable_path():
+    record = register_custom_topology(3, [(0, 1), (1, 2), (0, 2)], weights=[0.9, 0.9, 0.5])
+    P_comm = calculate_comm_reliability_matrix_shortest_path(3, f"custom:{record['id']}", 2, 0.7)
+    assert P_comm[0, 2] == pytest.approx(0.81) and P_comm[0, 1] == pytest.approx(0.9)
+
+
+def test_directed_topology_summary_and_asymmetric_matrix():
+    record = register_custom_topology(4, [(0, 1), (1, 2), (2, 3), (3, 0)], directed=True)
+    summary = summarize_custom_topology(record)
+    assert summary["edgeCount"] == 4 and summary["connected"] and summary["diameter"] == 3
+    P_comm = calculate_comm_reliability_matrix_shortest_path(4, f"custom:{record['id']}", 2, 0.9)
+    assert P_comm[0, 1] == pytest.approx(0.9) and P_comm[1, 0] == pytest.approx(0.9 ** 3)
+
+
+@pytest.mark.parametrize("edges, weights", [
+    ([(0, 0)], None),
+    ([(0, 5)], None),
+    ([(0, 1)], [1.5]),
+    ([(0, 1), (1, 2)], [0.9]),
+])
+def test_invalid_edge_lists_are_rejected(edges, weights):
+    with pytest.raises(ValueError):
+        register_custom_topology(4, edges, weights=weights)
@@ -0,0 +1,56 @@
+"""多路径路由：不相交路径数等于 min(k, 最大流)，路径互不相交，P_comm 与环形双路径模型和链路抽样一致"""
+import random
+
+import numpy as np
+import pytest
+
+from bench_disjoint_paths import check_router, monte_carlo_delivery
+from main import (
+    calculate_comm_reliability_matrix_disjoint_paths,
+    calculate_comm_reliability_matrix_shortest_path,
+    generate_random_regular_edges,
+    generate_small_world_edges,
+    get_disjoint_path_router,
+    register_custom_topology,
+)
+
+
+def disjoint_path_cases():
+    rng = np.random.default_rng(0)
+    cases = [("ring", 10), ("star", 7), ("tree", 11), ("full", 6)]
+    for edges in [generate_random_regular_edges(14, 4, rng), generate_small_world_edges(14, 4, 0.3, rng)]:
+        cases.append((f"custom:{register_custom_topology(14, edges)['id']}", 14))
+    arcs = rng.integers(0, 12, (40, 2))
+    directed = register_custom_topology(12, arcs[arcs[:, 0] != arcs[:, 1]], directed=True)
+    cases.append((f"custom:{directed['id']}", 12))
+    return cases
+
+
+@pytest.mark.parametrize("mode", ["node", "edge"])
+@pytest.mark.parametrize("k", [1, 2, 3])
+def test_disjoint_paths_match_max_flow(k, mode):
+    for topology, n in disjoint_path_cases():
+        graph = get_disjoint_path_router(n, topology, 2, 1, "node")["graph"]
+        check_router(n, topology, graph, k, mode)
+
+
+def test_ring_two_paths_match_legacy_model():
+    n, p = 16, 0.8
+    disjoint = calculate_comm_reliability_matrix_disjoint_paths(n, "ring", 2, p)
+    legacy = calculate_comm_reliability_matrix_shortest_path(n, "ring", 2, p)
+    gap = np.array([[min((i - j) % n, (j - i) % n) for j in range(n)] for i in range(n)])
+    # 不相邻节点就是顺时针 + 逆时针两条路径；相邻节点多了绕环一周的备用路径
+    np.testing.assert_allclose(disjoint[gap > 1], legacy[gap > 1], rtol=0, atol=1e-12)
+    assert np.all(disjoint[gap == 1] >= legacy[gap == 1])
+
+
+def test_exact_matrix_matches_link_sampling():
+    record = register_custom_topology(20, generate_random_regular_edges(20, 4, np.random.default_rng(2)))
+    topology = f"custom:{record['id']}"
+    router = get_disjoint_path_router(20, topology, 2, 3, "node")
+    P_comm = calculate_comm_reliability_matrix_disjoint_paths(20, topology, 2, 0.7, 3)
+    rng = random.Random(0)
+    for src, dst in [(0, 10), (3, 17)]:
+        estimate = monte_carlo_delivery(router, src, dst, 0.7, 20000, rng)
+        # 20000 次抽样的标准差 ≤ 0.0036，5σ 容差
+        assert abs(estimate - P_comm[src, dst]) < 0.018
@@ -0,0 +1,60 @@
+"""“fast” 精度（高斯/平均场近似）：n ≳ 40 时与精确值的误差在文档声明的 2 个百分点以内，报告的误差与实际一致"""
+import numpy as np
+import pytest
+
+from main import (
+    calculate_comm_reliability_matrix_shortest_path,
+    calculate_theoretical_success_fast,
+    calculate_theoretical_success_rate_sweep,
+    calculate_theoretical_success_rate_sweep_fast,
+    calculate_theoretical_success_rate_sweep_gaussian,
+    theory_engine_gaussian,
+    theory_engine_node_classes,
+)
+
+LARGE_N_BOUND = 0.02  # n ≳ 40
+SMALL_N_BOUND = 0.10  # n = 7~16
+
+
+@pytest.mark.parametrize("n", [40, 100, 301])
+def test_uniform_sweep_within_bound(n):
+    # p 网格覆盖成功率从 0 到 1 的整个过渡区
+    p_values = np.linspace(0.5, 0.999, 200)
+    f = (n - 1) // 3
+    exact = calculate_theoretical_success_rate_sweep(n, f, p_values)
+    approx = calculate_theoretical_success_rate_sweep_gaussian(n, f, p_values)
+    assert np.all((approx >= 0) & (approx <= 1))
+    assert np.max(np.abs(approx - exact)) <= LARGE_N_BOUND
+
+
+@pytest.mark.parametrize("topology, n", [("full", 40), ("full", 64), ("star", 40), ("star", 64)])
+def test_custom_matrix_within_bound(topology, n):
+    # 全连接/星形只有 2~3 个等价类，节点类引擎在 n = 64 时也能精确求解
+    f = (n - 1) // 3
+    for p in np.linspace(0.8, 0.97, 18):
+        P_comm = calculate_comm_reliability_matrix_shortest_path(n, topology, 2, p)
+        exact = theory_engine_node_classes(n, f, P_comm, 1)['success_rate']
+        approx = theory_engine_gaussian(n, f, P_comm, 1)['success_rate']
+        assert abs(approx - exact) <= LARGE_N_BOUND, p
+
+
+@pytest.mark.parametrize("n", [7, 10, 13])
+def test_small_n_error_is_reported(n):
+    rng = np.random.default_rng(n)
+    P_comm = rng.uniform(0.8, 1.0, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    result = calculate_theoretical_success_fast(n, (n - 1) // 3, P_comm, 1, error_check=True)
+    assert result['checkComplete'] and result['exactRate'] is not None
+    assert result['errorEstimate'] == pytest.approx(abs(result['rate'] - result['exactRate']), abs=1e-12)
+    assert result['errorEstimate'] <= SMALL_N_BOUND
+
+
+def test_sweep_error_estimate_matches_checked_points():
+    n, f = 61, 20
+    p_values = np.linspace(0.7, 0.99, 50)
+    result = calculate_theoretical_success_rate_sweep_fast(n, f, p_values)
+    assert 1 <= len(result['checkedPValues']) <= 3
+    exact = calculate_theoretical_success_rate_sweep(n, f, result['checkedPValues'])
+    approx = calculate_theoretical_success_rate_sweep_gaussian(n, f, result['checkedPValues'])
+    assert result['errorEstimate'] == pytest.approx(np.max(np.abs(exact - approx)), abs=1e-12)
+    assert result['errorEstimate'] <= LARGE_N_BOUND
@@ -0,0 +1,51 @@
+"""链路升级优化：每一步都提高目标值，结果与重新计算一致，不超预算且不差于最好的单条升级"""
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from main import optimize_link_upgrades, theory_engine_custom_matrix
+
+
+def upgrade_problem(n: int, seed: int):
+    rng = np.random.default_rng(seed)
+    P_comm = rng.uniform(0.6, 0.9, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    cost = rng.integers(1, 4, (n, n)).astype(float)
+    return P_comm, cost, np.full((n, n), 0.99)
+
+
+def success_after(n, f, P_comm, target, links, proposer_id=0, availability=None):
+    upgraded = P_comm.copy()
+    for link in links:
+        upgraded[link] = target[link]
+    return theory_engine_custom_matrix(n, f, upgraded, proposer_id, node_availability=availability)['success_rate']
+
+
+@pytest.mark.parametrize("objective", ["success", "index"])
+@pytest.mark.parametrize("with_availability", [False, True])
+def test_each_step_improves_and_stays_in_budget(objective, with_availability):
+    P_comm, cost, target = upgrade_problem(7, 0)
+    availability = [1.0, 0.9, 0.95, 0.8, 1.0, 0.9, 0.85] if with_availability else None
+    result = optimize_link_upgrades(7, 2, P_comm, 0, cost, target, 6.0, objective, node_availability=availability)
+    values = [result['initial_value']] + [step['value'] for step in result['history']]
+    assert all(later > earlier for earlier, later in zip(values, values[1:]))
+    assert result['final_value'] == pytest.approx(values[-1])
+    assert result['spent'] <= 6.0 + 1e-9
+    assert result['spent'] == pytest.approx(sum(upgrade['cost'] for upgrade in result['upgrades']))
+    if objective == "success":
+        links = [tuple(upgrade['link']) for upgrade in result['upgrades']]
+        assert result['final_value'] == pytest.approx(
+            success_after(7, 2, P_comm, target, links, availability=availability), abs=1e-9)
+
+
+def test_not_worse_than_best_single_upgrade_and_bounded_by_optimum():
+    n, f, budget = 4, 1, 4.0
+    P_comm, cost, target = upgrade_problem(n, 1)
+    result = optimize_link_upgrades(n, f, P_comm, 0, cost, target, budget)
+    links = [(i, j) for i in range(n) for j in range(n) if i != j]
+    affordable = [combo for size in range(0, 5) for combo in combinations(links, size)
+                  if sum(cost[link] for link in combo) <= budget]
+    values = {combo: success_after(n, f, P_comm, target, combo) for combo in affordable}
+    best_single = max(value for combo, value in values.items() if len(combo) <= 1)
+    assert best_single - 1e-12 <= result['final_value'] <= max(values.values()) + 1e-12
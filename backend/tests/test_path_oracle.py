@@ -0,0 +1,18 @@
+"""路径预言机：跳数与原 Floyd-Warshall 一致，还原出的路径是沿真实边的最短路径"""
+import pytest
+
+from bench_path_oracle import check
+from main import get_path_oracle
+
+
+@pytest.mark.parametrize("topology, n_value", [("full", 2), ("ring", 2), ("star", 2), ("tree", 2), ("tree", 3)])
+@pytest.mark.parametrize("n", [4, 9, 16])
+def test_path_oracle_matches_floyd_warshall(topology, n, n_value):
+    check(n, topology, n_value)
+
+
+def test_oracle_is_cached_and_read_only():
+    oracle = get_path_oracle(12, "tree", 2)
+    assert get_path_oracle(12, "tree", 2) is oracle
+    assert not oracle['dist'].flags.writeable and not oracle['next_hop'].flags.writeable
+
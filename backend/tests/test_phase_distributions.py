@@ -0,0 +1,54 @@
+"""各阶段人数分布：PMF 之和为 1，与成功率、阶段存活概率和成功门限曲线相互一致"""
+import numpy as np
+import pytest
+
+from main import calculate_theoretical_distributions, calculate_theoretical_success_rate, theory_engine_custom_matrix
+
+
+def check_consistent(distributions, n: int, f: int, success_rate: float):
+    lo = distributions["support"]
+    assert sum(distributions["N_pp"]) == pytest.approx(1.0, abs=1e-9)
+    if lo == 0:
+        assert sum(distributions["N_p"]) == pytest.approx(1.0, abs=1e-9)
+        assert sum(distributions["N_c"]) == pytest.approx(1.0, abs=1e-9)
+    for name in ("N_pp", "N_p", "N_c"):
+        assert all(x is None or -1e-15 <= x <= 1 + 1e-12 for x in distributions[name])
+    survival = distributions["phaseSurvival"]
+    assert distributions["successRate"] == pytest.approx(success_rate, abs=1e-12)
+    assert survival["prePrepare"] * survival["prepare"] * survival["commit"] == pytest.approx(success_rate, abs=1e-12)
+    curve = {item["threshold"]: item["rate"] for item in distributions["successByThreshold"]}
+    assert curve[n - f] == pytest.approx(success_rate, abs=1e-12)
+    rates = [curve[t] for t in sorted(curve)]
+    assert all(later <= earlier + 1e-12 for earlier, later in zip(rates, rates[1:]))
+
+
+@pytest.mark.parametrize("n, p", [(4, 0.9), (7, 0.8), (31, 0.95), (200, 0.9)])
+def test_closed_form_distributions(n, p):
+    f = (n - 1) // 3
+    distributions = calculate_theoretical_distributions(n, f, p)
+    assert distributions["support"] == 0
+    check_consistent(distributions, n, f, calculate_theoretical_success_rate(n, f, p))
+
+
+def test_matrix_engine_distributions_match_closed_form_on_uniform_matrix():
+    n, f, p = 7, 2, 0.85
+    P_comm = np.full((n, n), p)
+    np.fill_diagonal(P_comm, 1.0)
+    result = theory_engine_custom_matrix(n, f, P_comm, distributions=True)
+    closed_form = calculate_theoretical_distributions(n, f, p)
+    distributions = result["distributions"]
+    check_consistent(distributions, n, f, result["success_rate"])
+    lo = distributions["support"]
+    for name in ("N_pp", "N_p", "N_c"):
+        np.testing.assert_allclose([x for x in distributions[name][lo:]], closed_form[name][lo:], atol=1e-12)
+
+
+@pytest.mark.parametrize("with_availability", [False, True])
+def test_matrix_engine_distributions_are_consistent(with_availability):
+    n, f = 7, 2
+    rng = np.random.default_rng(0)
+    P_comm = rng.uniform(0.6, 1.0, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    availability = list(rng.uniform(0.7, 1.0, n)) if with_availability else None
+    result = theory_engine_custom_matrix(n, f, P_comm, 2, distributions=True, node_availability=availability)
+    check_consistent(result["distributions"], n, f, result["success_rate"])
@@ -0,0 +1,48 @@
+"""Poisson-binomial 尾概率 / PMF 动态规划与逐个枚举结果一致"""
+from itertools import product
+
+import numpy as np
+import pytest
+
+from main import calc_exact_receive_k_prob, poisson_binomial_pmf, poisson_binomial_tail
+
+
+def enumerate_pmf(probs):
+    """逐个枚举 2^m 种成功/失败组合得到 P(X = c)"""
+    pmf = np.zeros(len(probs) + 1)
+    for outcome in product([False, True], repeat=len(probs)):
+        pmf[sum(outcome)] += np.prod([p if up else 1 - p for up, p in zip(outcome, probs)])
+    return pmf
+
+
+@pytest.mark.parametrize("m", [0, 1, 5, 10])
+def test_tail_and_pmf_match_enumeration(m):
+    probs = np.random.default_rng(m).uniform(0.0, 1.0, m)
+    expected = enumerate_pmf(probs)
+    np.testing.assert_allclose(poisson_binomial_pmf(probs), expected, atol=1e-12)
+    for k_min in range(-1, m + 2):
+        assert poisson_binomial_tail(probs, k_min) == pytest.approx(expected[max(k_min, 0):].sum(), abs=1e-12)
+        assert poisson_binomial_tail(list(probs), k_min) == pytest.approx(expected[max(k_min, 0):].sum(), abs=1e-12)
+
+
+def test_batched_rows_match_single_rows():
+    probs = np.random.default_rng(0).uniform(0.5, 1.0, (6, 9))
+    pmf = poisson_binomial_pmf(probs)
+    for k_min in [1, 5, 8, 9]:
+        batched = poisson_binomial_tail(probs, k_min)
+        for row in range(len(probs)):
+            assert batched[row] == pytest.approx(poisson_binomial_tail(probs[row], k_min), abs=1e-12)
+            np.testing.assert_allclose(pmf[row], poisson_binomial_pmf(probs[row]), atol=1e-12)
+
+
+def test_high_reliability_tail_has_no_cancellation():
+    # 1 - P(X < k) 在 p 接近 1 时会相消为 0，直接累积吸收态可保留小的失败概率
+    probs = np.full(40, 1 - 1e-9)
+    assert 1 - poisson_binomial_tail(probs, 40) == pytest.approx(40e-9, rel=1e-6)
+    assert poisson_binomial_tail(np.full(40, 1e-9), 2) == pytest.approx(780e-18, rel=1e-6)
+
+
+def test_receive_probability_excludes_target():
+    P_comm = np.random.default_rng(1).uniform(0.5, 1.0, (5, 5))
+    expected = enumerate_pmf([P_comm[s, 2] for s in [0, 1, 3, 4]])[3:].sum()
+    assert calc_exact_receive_k_prob([0, 1, 2, 3, 4], 2, 3, P_comm) == pytest.approx(expected, abs=1e-12)
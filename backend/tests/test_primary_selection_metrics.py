@@ -0,0 +1,77 @@
+"""主节点选择指标：向量化重写前后结果一致，共享的节点能力表与逐主节点计算一致，P_prep 为精确 Poisson-binomial 尾概率
+
+tests/data/primary_metrics_reference.json 由重写前的 calculate_primary_selection_metrics 生成。
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from bench_prepare_quorum import make_matrix, reference_approx_p_prep, reference_exact_p_prep
+from main import (
+    calculate_primary_selection_metrics,
+    prepare_primary_selection_context,
+    prepare_stage_quorum_probs,
+    refresh_primary_selection_context,
+)
+
+with open(os.path.join(os.path.dirname(__file__), "data", "primary_metrics_reference.json")) as reference_file:
+    REFERENCE_CASES = json.load(reference_file)["cases"]
+
+
+@pytest.mark.parametrize("case", REFERENCE_CASES, ids=[case["name"] for case in REFERENCE_CASES])
+def test_metrics_match_pre_vectorization_reference(case):
+    P_comm = np.array(case["reliabilityMatrix"])
+    for proposer_id, expected in case["metrics"].items():
+        metrics = calculate_primary_selection_metrics(case["n"], case["f"], P_comm, int(proposer_id))
+        for name, value in expected.items():
+            np.testing.assert_allclose(metrics[name], value, rtol=0, atol=1e-12, err_msg=f"{name} (v={proposer_id})")
+
+
+@pytest.mark.parametrize("case", REFERENCE_CASES, ids=[case["name"] for case in REFERENCE_CASES])
+def test_shared_context_matches_per_proposer_computation(case):
+    n, f, P_comm = case["n"], case["f"], np.array(case["reliabilityMatrix"])
+    context = prepare_primary_selection_context(n, f, P_comm)
+    for proposer_id in range(n):
+        shared = calculate_primary_selection_metrics(n, f, P_comm, proposer_id, None, context)
+        alone = calculate_primary_selection_metrics(n, f, P_comm, proposer_id)
+        for name, value in alone.items():
+            np.testing.assert_allclose(shared[name], value, atol=1e-15, err_msg=name)
+
+
+def test_refreshed_context_matches_fresh_context():
+    case = REFERENCE_CASES[1]
+    n, f, P_comm = case["n"], case["f"], np.array(case["reliabilityMatrix"])
+    context = prepare_primary_selection_context(n, f, P_comm)
+    P_comm[2, 7] = 0.1
+    P_comm[5, 2] = 0.99
+    refresh_primary_selection_context(context, n, f, P_comm, [2, 5], [7, 2])
+    fresh = prepare_primary_selection_context(n, f, P_comm)
+    for name in ("Q_out", "Q_in", "w_u", "betweenness"):
+        np.testing.assert_allclose(context[name], fresh[name], atol=1e-15, err_msg=name)
+
+
+@pytest.mark.parametrize("kind", ["近均匀", "随机", "分簇"])
+@pytest.mark.parametrize("n", [4, 9, 16])
+def test_exact_p_prep_matches_scalar_dp(kind, n):
+    f = (n - 1) // 3
+    P_comm = make_matrix(kind, n, np.random.default_rng(n))
+    for proposer_id in [0, n - 1]:
+        expected = reference_exact_p_prep(n, f, P_comm, proposer_id)
+        np.testing.assert_allclose(prepare_stage_quorum_probs(n, f, P_comm, proposer_id), expected, atol=1e-12)
+        metrics = calculate_primary_selection_metrics(n, f, P_comm, proposer_id)
+        np.testing.assert_allclose(metrics['P_prep'], expected, atol=1e-12)
+        top = np.sort(expected)[::-1][:2 * f + 1]
+        assert metrics['Phi_min'] == pytest.approx(expected.min(), abs=1e-12)
+        assert metrics['Phi_q'] == pytest.approx(top.mean(), abs=1e-12)
+        assert metrics['I_v'] == pytest.approx(metrics['Q_pp'] * top.mean(), abs=1e-12)
+        assert metrics['I_w'] == pytest.approx(metrics['Q_w'] * top.mean(), abs=1e-12)
+
+
+def test_exact_p_prep_equals_averaged_approximation_on_uniform_matrix():
+    # 各发送者概率相同时 Poisson-binomial 退化为二项分布，与原"平均概率"近似一致
+    P_comm = np.full((10, 10), 0.9)
+    np.fill_diagonal(P_comm, 1.0)
+    np.testing.assert_allclose(prepare_stage_quorum_probs(10, 3, P_comm, 2),
+                               reference_approx_p_prep(10, 3, P_comm, 2), atol=1e-12)
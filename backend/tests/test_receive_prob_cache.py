@@ -0,0 +1,62 @@
+"""接收概率 LRU 缓存：结果与直接计算一致，命中统计和最近使用顺序按 (组, 目标) 组合维护"""
+import numpy as np
+
+from main import (
+    cached_batch_receive_probs,
+    calc_exact_receive_k_prob,
+    comm_matrix_column_digests,
+    receive_prob_cache,
+    receive_prob_cache_stats,
+    theory_engine_custom_matrix,
+)
+
+
+def random_comm_matrix(n: int, seed: int):
+    P_comm = np.random.default_rng(seed).uniform(0.5, 1.0, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    return P_comm
+
+
+def test_cached_values_match_direct_computation():
+    n = 6
+    P_comm = random_comm_matrix(n, 0)
+    rng = np.random.default_rng(1)
+    senders = rng.random((5, n)) < 0.7
+    targets = rng.random((5, n)) < 0.6
+    for _ in range(2):  # 第二次全部命中缓存
+        result = cached_batch_receive_probs(P_comm, senders, targets, 2)
+        for row in range(5):
+            for t in range(n):
+                expected = calc_exact_receive_k_prob(np.flatnonzero(senders[row]).tolist(), t, 2, P_comm) \
+                    if targets[row, t] else 0.0
+                assert abs(result[row, t] - expected) < 1e-12
+
+
+def test_partially_cached_row_counts_hits_and_refreshes_recency():
+    n = 5
+    P_comm = random_comm_matrix(n, 2)
+    digests = comm_matrix_column_digests(P_comm)
+    senders = np.ones((1, n), dtype=bool)
+    first_target = np.zeros((1, n), dtype=bool)
+    first_target[0, 1] = True
+    cached_batch_receive_probs(P_comm, senders, first_target, 3, digests)
+    hot_key = next(reversed(receive_prob_cache))
+    # 其它组合写入后 hot_key 不再位于最近使用的一端
+    cached_batch_receive_probs(P_comm, ~np.eye(n, dtype=bool), np.eye(n, dtype=bool), 2, digests)
+
+    both_targets = first_target.copy()
+    both_targets[0, 2] = True
+    hits, misses = receive_prob_cache_stats["hits"], receive_prob_cache_stats["misses"]
+    cached_batch_receive_probs(P_comm, senders, both_targets, 3, digests)
+    assert receive_prob_cache_stats["hits"] - hits == 1
+    assert receive_prob_cache_stats["misses"] - misses == 1
+    # 命中的组合被移到最近使用的一端（紧挨着新写入的组合），不会先于新条目被淘汰
+    assert hot_key in list(receive_prob_cache)[-2:]
+
+
+def test_engine_result_unchanged_by_warm_cache():
+    P_comm = random_comm_matrix(7, 3)
+    cold = theory_engine_custom_matrix(7, 2, P_comm, 0)
+    warm = theory_engine_custom_matrix(7, 2, P_comm, 0)
+    assert warm['cache_hits'] > 0 and warm['cache_misses'] == 0
+    assert abs(cold['success_rate'] - warm['success_rate']) < 1e-12
@@ -0,0 +1,45 @@
+"""/api/theory/calculate-all 与逐个主节点调用 /api/theory/calculate 的结果一致"""
+import numpy as np
+import pytest
+
+from main import compute_theory_all_proposers, compute_theory_direct
+
+
+def matrix_request():
+    P_comm = np.random.default_rng(0).uniform(0.6, 1.0, (7, 7))
+    np.fill_diagonal(P_comm, 1.0)
+    return {"nodeCount": 7, "faultyNodes": 2, "reliabilityMatrix": P_comm.tolist()}
+
+
+@pytest.mark.parametrize("request_body", [
+    matrix_request(),
+    {"nodeCount": 7, "faultyNodes": 2, "reliability": 0.85},
+    {"nodeCount": 7, "faultyNodes": 2, "reliability": 0.85, "nodeAvailability": [1, 0.9, 0.8, 1, 1, 0.95, 0.7]},
+    dict(matrix_request(), precision="fast"),
+])
+def test_all_proposers_match_single_proposer(request_body):
+    results = compute_theory_all_proposers(request_body)["results"]
+    assert [result["proposerId"] for result in results] == list(range(7))
+    for result in results:
+        single = compute_theory_direct(dict(request_body, proposerId=result["proposerId"]))
+        assert result["theoryMethod"] == single["theoryMethod"]
+        assert result["exact"] == single["exact"]
+        assert result["theoreticalSuccessRate"] == pytest.approx(single["theoreticalSuccessRate"], abs=1e-9)
+        for name, value in single["metrics"].items():
+            np.testing.assert_allclose(result["metrics"][name], value, atol=1e-9, err_msg=name)
+
+
+def test_failing_proposer_does_not_drop_the_others(monkeypatch):
+    import main
+
+    original = main.calculate_primary_selection_metrics
+
+    def fail_for_proposer_3(n, f, P_comm, proposer_id, *args):
+        if proposer_id == 3:
+            raise MemoryError("simulated")
+        return original(n, f, P_comm, proposer_id, *args)
+
+    monkeypatch.setattr(main, "calculate_primary_selection_metrics", fail_for_proposer_3)
+    results = compute_theory_all_proposers(matrix_request())["results"]
+    assert results[3] == {"proposerId": 3, "error": "MemoryError: simulated"}
+    assert all("theoreticalSuccessRate" in result for i, result in enumerate(results) if i != 3)
@@ -0,0 +1,39 @@
+"""bounds 精度模式：随机序上下界与带证书区间始终包含精确值"""
+import numpy as np
+import pytest
+
+from main import (
+    calculate_theoretical_success_bounds_custom_matrix,
+    theory_engine_custom_matrix,
+    theory_stochastic_bounds,
+    theory_stochastic_bounds_batch,
+)
+
+
+def random_comm_matrix(n: int, seed: int, low: float = 0.5):
+    P_comm = np.random.default_rng(seed).uniform(low, 1.0, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    return P_comm
+
+
+@pytest.mark.parametrize("n, f, seed", [(4, 1, 0), (7, 2, 1), (8, 2, 2), (10, 3, 3)])
+@pytest.mark.parametrize("with_availability", [False, True])
+def test_stochastic_bounds_bracket_exact_value(n, f, seed, with_availability):
+    P_comm = random_comm_matrix(n, seed)
+    availability = list(np.random.default_rng(seed).uniform(0.7, 1.0, n)) if with_availability else None
+    lower, upper = theory_stochastic_bounds_batch(n, f, P_comm, node_availability=availability)
+    for v in range(n):
+        exact = theory_engine_custom_matrix(n, f, P_comm, v, node_availability=availability)['success_rate']
+        assert lower[v] - 1e-12 <= exact <= upper[v] + 1e-12
+        assert (lower[v], upper[v]) == pytest.approx(
+            theory_stochastic_bounds(n, f, P_comm, v, node_availability=availability), abs=1e-12)
+
+
+@pytest.mark.parametrize("epsilon, time_budget", [(1e-3, None), (1e-6, None), (1e-6, 0.0)])
+def test_certified_interval_contains_exact_value(epsilon, time_budget):
+    P_comm = random_comm_matrix(10, 4, low=0.8)
+    exact = theory_engine_custom_matrix(10, 3, P_comm)['success_rate']
+    result = calculate_theoretical_success_bounds_custom_matrix(10, 3, P_comm, 0, epsilon, time_budget)
+    assert result['lower'] - 1e-12 <= exact <= result['upper'] + 1e-12
+    if time_budget is None:
+        assert result['upper'] - result['lower'] <= epsilon + 1e-12
@@ -0,0 +1,118 @@
+"""自定义矩阵理论引擎（子集枚举、按等价类计数）与原三重子集枚举一致
+
+参考实现 triple_enumeration 逐个枚举 V_pp、V_p、V_c 子集（节点在线率按在线集合枚举），
+只适合 n ≤ 7 的小规模。
+"""
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from main import (
+    calculate_comm_reliability_matrix_shortest_path,
+    calculate_theoretical_success_custom_matrix_auto,
+    find_equivalent_node_classes,
+    theory_engine_custom_matrix,
+    theory_engine_node_classes,
+    theory_engine_with_symmetry,
+)
+
+
+def receive_at_least(senders, target, k_min, P_comm):
+    """逐个枚举送达的发送者子集，得到目标节点至少收到 k_min 条消息的概率"""
+    senders = [s for s in senders if s != target]
+    total = 0.0
+    for size in range(k_min, len(senders) + 1):
+        for delivered in combinations(senders, size):
+            total += np.prod([P_comm[s, target] if s in delivered else 1 - P_comm[s, target] for s in senders])
+    return total
+
+
+def subsets_with_probs(nodes, probs, min_size):
+    """nodes 中大小 ≥ min_size 的子集及其概率（各节点以 probs[node] 独立入选）"""
+    for size in range(min_size, len(nodes) + 1):
+        for chosen in combinations(nodes, size):
+            yield chosen, np.prod([probs[x] if x in chosen else 1 - probs[x] for x in nodes])
+
+
+def triple_enumeration(n: int, f: int, P_comm, proposer_id: int = 0, node_availability=None) -> float:
+    """原三重子集枚举：在线集合 → V_pp → V_p → V_c，逐个子集累加成功概率
+
+    V_c ⊆ V_p ⊆ V_pp 且成功要求 |V_c| ≥ n-f，因此各层只枚举大小 ≥ n-f 的子集。
+    """
+    v = proposer_id
+    nc_required = n - f
+    availability = node_availability if node_availability is not None else [1.0] * n
+    replicas = [i for i in range(n) if i != v]
+    total = 0.0
+    for online_replicas, p_online in subsets_with_probs(replicas, availability, 0):
+        p_online *= availability[v]
+        pre_probs = {r: P_comm[v, r] for r in online_replicas}
+        for v_pp_replicas, p_vpp in subsets_with_probs(list(online_replicas), pre_probs, nc_required - 1):
+            v_pp = [v] + list(v_pp_replicas)
+            prepare_probs = {t: receive_at_least(v_pp_replicas, t, 2 * f - 1, P_comm) for t in v_pp}
+            for v_p, p_vp in subsets_with_probs(v_pp, prepare_probs, nc_required):
+                commit_probs = {t: receive_at_least(v_p, t, 2 * f, P_comm) for t in v_p}
+                for _, p_vc in subsets_with_probs(list(v_p), commit_probs, nc_required):
+                    total += p_online * p_vpp * p_vp * p_vc
+    return total
+
+
+def random_comm_matrix(n: int, seed: int):
+    P_comm = np.random.default_rng(seed).uniform(0.5, 1.0, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    return P_comm
+
+
+@pytest.mark.parametrize("n, f, proposer_id", [(4, 1, 0), (5, 1, 2), (7, 2, 0), (7, 2, 4)])
+def test_custom_engine_matches_triple_enumeration(n, f, proposer_id):
+    P_comm = random_comm_matrix(n, n * 10 + proposer_id)
+    expected = triple_enumeration(n, f, P_comm, proposer_id)
+    result = theory_engine_custom_matrix(n, f, P_comm, proposer_id)
+    assert result['exact'] and result['lower'] == result['upper']
+    assert result['success_rate'] == pytest.approx(expected, abs=1e-9)
+    auto = calculate_theoretical_success_custom_matrix_auto(n, f, P_comm, proposer_id)
+    assert auto['method'] == "exact"
+    assert auto['rate'] == pytest.approx(expected, abs=1e-9)
+
+
+def test_time_budget_interval_contains_exact_value():
+    P_comm = random_comm_matrix(7, 5)
+    expected = triple_enumeration(7, 2, P_comm)
+    result = theory_engine_custom_matrix(7, 2, P_comm, time_budget=0.0)
+    assert not result['exact']
+    assert result['lower'] - 1e-12 <= expected <= result['upper'] + 1e-12
+
+
+@pytest.mark.parametrize("topology", ["ring", "star", "full"])
+def test_symmetry_engine_matches_triple_enumeration(topology):
+    n, f = 7, 2
+    P_comm = calculate_comm_reliability_matrix_shortest_path(n, topology, 2, 0.85)
+    expected = triple_enumeration(n, f, P_comm)
+    assert theory_engine_with_symmetry(n, f, P_comm)['success_rate'] == pytest.approx(expected, abs=1e-9)
+
+
+@pytest.mark.parametrize("topology, n", [("star", 10), ("tree", 10), ("full", 10)])
+def test_node_class_engine_matches_subset_engine(topology, n):
+    f = (n - 1) // 3
+    P_comm = calculate_comm_reliability_matrix_shortest_path(n, topology, 2, 0.9)
+    for proposer_id in [0, n - 1]:
+        classes = find_equivalent_node_classes(P_comm, proposer_id)
+        assert len(classes) < n  # 结构化拓扑存在等价类
+        expected = theory_engine_custom_matrix(n, f, P_comm, proposer_id)['success_rate']
+        result = theory_engine_node_classes(n, f, P_comm, proposer_id, classes)
+        assert result['exact'] and result['success_rate'] == pytest.approx(expected, abs=1e-10)
+
+
+@pytest.mark.parametrize("n, f", [(4, 1), (5, 1), (7, 2)])
+def test_availability_matches_online_set_enumeration(n, f):
+    P_comm = random_comm_matrix(n, n)
+    availability = list(np.random.default_rng(n + 100).uniform(0.6, 1.0, n))
+    expected = triple_enumeration(n, f, P_comm, 1, availability)
+    result = theory_engine_custom_matrix(n, f, P_comm, 1, node_availability=availability)
+    assert result['exact'] and result['success_rate'] == pytest.approx(expected, abs=1e-9)
+    symmetric = theory_engine_with_symmetry(n, f, P_comm, 1, node_availability=availability)
+    assert symmetric['success_rate'] == pytest.approx(expected, abs=1e-9)
+    # 全部在线时与不传 node_availability 的结果相同
+    always_online = theory_engine_custom_matrix(n, f, P_comm, 1, node_availability=[1.0] * n)
+    assert always_online['success_rate'] == pytest.approx(triple_enumeration(n, f, P_comm, 1), abs=1e-12)
@@ -0,0 +1,50 @@
+"""链路灵敏度：解析偏导与精确引擎的中心差分一致"""
+import numpy as np
+import pytest
+
+from main import (
+    poisson_binomial_tail,
+    poisson_binomial_tail_with_grad,
+    theory_engine_custom_matrix,
+    theory_gradient_custom_matrix,
+)
+
+STEP = 1e-5
+
+
+def random_comm_matrix(n: int, seed: int):
+    P_comm = np.random.default_rng(seed).uniform(0.6, 0.95, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    return P_comm
+
+
+@pytest.mark.parametrize("n, f, proposer_id, with_availability", [(4, 1, 0, False), (7, 2, 3, False), (7, 2, 1, True)])
+def test_gradient_matches_finite_differences(n, f, proposer_id, with_availability):
+    P_comm = random_comm_matrix(n, n + proposer_id)
+    availability = list(np.random.default_rng(n).uniform(0.7, 1.0, n)) if with_availability else None
+    result = theory_gradient_custom_matrix(n, f, P_comm, proposer_id, availability)
+    exact = theory_engine_custom_matrix(n, f, P_comm, proposer_id, node_availability=availability)
+    assert result['success_rate'] == pytest.approx(exact['success_rate'], abs=1e-12)
+    for i in range(n):
+        for j in range(n):
+            if i == j:
+                continue
+            plus, minus = P_comm.copy(), P_comm.copy()
+            plus[i, j] += STEP
+            minus[i, j] -= STEP
+            numeric = (theory_engine_custom_matrix(n, f, plus, proposer_id, node_availability=availability)['success_rate']
+                       - theory_engine_custom_matrix(n, f, minus, proposer_id, node_availability=availability)['success_rate']) \
+                / (2 * STEP)
+            assert result['gradient'][i, j] == pytest.approx(numeric, abs=1e-8), (i, j)
+
+
+def test_tail_gradient_matches_finite_differences():
+    probs = np.random.default_rng(0).uniform(0.3, 0.9, (3, 8))
+    tail, grad = poisson_binomial_tail_with_grad(probs, 5)
+    np.testing.assert_allclose(tail, poisson_binomial_tail(probs, 5), atol=1e-12)
+    for s in range(8):
+        plus, minus = probs.copy(), probs.copy()
+        plus[:, s] += STEP
+        minus[:, s] -= STEP
+        numeric = (poisson_binomial_tail(plus, 5) - poisson_binomial_tail(minus, 5)) / (2 * STEP)
+        np.testing.assert_allclose(grad[:, s], numeric, atol=1e-8)
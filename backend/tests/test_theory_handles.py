@@ -0,0 +1,68 @@
+"""矩阵句柄：增量修改后的结果与按修改后矩阵重新创建的句柄完全一致"""
+import copy
+
+import numpy as np
+import pytest
+
+from main import close_theory_matrix_handle, open_theory_matrix_handle, update_theory_matrix_handle
+
+
+def handle_request(n: int, f: int, seed: int, **extra):
+    P_comm = np.random.default_rng(seed).uniform(0.6, 1.0, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    request = {"nodeCount": n, "faultyNodes": f, "reliabilityMatrix": P_comm.tolist(),
+               "nodeAvailability": None, "mcTrials": None, "mcSeed": 0, "version": 0}
+    request.update(extra)
+    return request
+
+
+def apply_patch(stored: dict, updates, theory_mode=None):
+    """与 PATCH /api/theory/handles/{handle} 相同地更新主进程保存的请求"""
+    for update in updates:
+        stored["reliabilityMatrix"][update["i"]][update["j"]] = update["value"]
+    if theory_mode is not None:
+        stored["theoryMode"] = theory_mode
+    stored["version"] += 1
+
+
+def assert_same_results(actual, expected):
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert a["theoryMethod"] == e["theoryMethod"] and a["exact"] == e["exact"]
+        if e["theoreticalSuccessRate"] is None:
+            assert a["theoreticalSuccessRate"] is None
+        else:
+            assert a["theoreticalSuccessRate"] == pytest.approx(e["theoreticalSuccessRate"], abs=1e-9)
+        for name, value in e["metrics"].items():
+            np.testing.assert_allclose(a["metrics"][name], value, atol=1e-9, err_msg=name)
+
+
+@pytest.mark.parametrize("theory_mode", ["bounds", "auto", "none"])
+def test_patch_matches_fresh_handle(theory_mode):
+    stored = handle_request(7, 2, 0, theoryMode=theory_mode)
+    open_theory_matrix_handle("patched", stored)
+    for updates in ([{"i": 1, "j": 3, "value": 0.2}], [{"i": 0, "j": 5, "value": 0.95}, {"i": 4, "j": 0, "value": 0.5}]):
+        apply_patch(stored, updates)
+        patched = update_theory_matrix_handle("patched", stored, updates)
+        assert not patched["rebuilt"]
+        fresh = open_theory_matrix_handle("fresh", copy.deepcopy(stored))
+        assert_same_results(patched["results"], fresh["results"])
+    close_theory_matrix_handle("patched")
+    close_theory_matrix_handle("fresh")
+
+
+def test_default_mode_is_bounds_and_switches_on_demand():
+    stored = handle_request(7, 2, 1)
+    opened = open_theory_matrix_handle("switch", stored)
+    assert {result["theoryMethod"] for result in opened["results"]} == {"bounds"}
+    assert not any(result["exact"] for result in opened["results"])
+
+    apply_patch(stored, [], "auto")
+    switched = update_theory_matrix_handle("switch", stored, [])
+    assert {result["theoryMethod"] for result in switched["results"]} == {"exact"}
+    fresh = open_theory_matrix_handle("fresh", copy.deepcopy(stored))
+    assert_same_results(switched["results"], fresh["results"])
+    for exact, bounds in zip(switched["results"], opened["results"]):
+        assert bounds["bounds"]["lower"] - 1e-9 <= exact["theoreticalSuccessRate"] <= bounds["bounds"]["upper"] + 1e-9
+    close_theory_matrix_handle("switch")
+    close_theory_matrix_handle("fresh")
@@ -0,0 +1,50 @@
+"""蒙特卡洛估计：置信区间的覆盖率达到名义置信度，固定种子可复现"""
+import numpy as np
+import pytest
+
+import main
+from main import (
+    calculate_theoretical_success_custom_matrix_auto,
+    theory_engine_custom_matrix,
+    theory_monte_carlo_custom_matrix,
+)
+
+RUNS = 200
+TRIALS = 2000
+
+
+def random_comm_matrix(n: int, seed: int):
+    P_comm = np.random.default_rng(seed).uniform(0.7, 1.0, (n, n))
+    np.fill_diagonal(P_comm, 1.0)
+    return P_comm
+
+
+@pytest.mark.parametrize("with_availability", [False, True])
+def test_interval_coverage(with_availability):
+    P_comm = random_comm_matrix(7, 0)
+    availability = [1.0, 0.95, 0.9, 0.85, 1.0, 0.9, 0.95] if with_availability else None
+    exact = theory_engine_custom_matrix(7, 2, P_comm, 1, node_availability=availability)['success_rate']
+    wilson = clopper_pearson = 0
+    for seed in range(RUNS):
+        result = theory_monte_carlo_custom_matrix(7, 2, P_comm, 1, TRIALS, seed, node_availability=availability)
+        assert result['complete'] and result['trials'] == TRIALS
+        wilson += result['lower'] <= exact <= result['upper']
+        clopper_pearson += result['clopper_pearson'][0] <= exact <= result['clopper_pearson'][1]
+    # 名义 95%：200 次中覆盖不足 180 次的概率可以忽略（种子固定，结果确定）
+    assert wilson >= 0.9 * RUNS
+    assert clopper_pearson >= 0.9 * RUNS
+
+
+def test_fixed_seed_is_reproducible():
+    P_comm = random_comm_matrix(10, 1)
+    first = theory_monte_carlo_custom_matrix(10, 3, P_comm, 0, TRIALS, 7)
+    second = theory_monte_carlo_custom_matrix(10, 3, P_comm, 0, TRIALS, 7)
+    assert first['successes'] == second['successes'] and first['seed'] == 7
+
+
+def test_auto_falls_back_to_monte_carlo_above_branch_limit(monkeypatch):
+    monkeypatch.setattr(main, "THEORY_EXACT_MAX_BRANCHES", 10)
+    P_comm = random_comm_matrix(7, 2)
+    result = calculate_theoretical_success_custom_matrix_auto(7, 2, P_comm, 0, trials=TRIALS, seed=3)
+    assert result['method'] == "monte-carlo" and result['monteCarlo']['trials'] == TRIALS
+    assert result['rate'] == result['monteCarlo']['success_rate']
@@ -0,0 +1,73 @@
+"""理论结果缓存：规范化键与"只缓存可复现结果"的规则"""
+import pytest
+
+from main import (
+    theory_result_cache,
+    theory_result_cache_get,
+    theory_result_cache_key,
+    theory_result_cache_put,
+    theory_result_is_deterministic,
+)
+
+
+def base_request(**extra):
+    request = {"nodeCount": 30, "faultyNodes": 9, "reliability": 0.9, "mcSeed": 1}
+    request.update(extra)
+    return request
+
+
+@pytest.mark.parametrize("extra", [
+    {"nodeAvailability": [0.9] * 30},
+    {"reliabilityMatrix": [[1.0 if i == j else 0.9 for j in range(30)] for i in range(30)]},
+])
+def test_key_separates_methods_on_matrix_engine_path(extra):
+    monte_carlo = theory_result_cache_key("calculate", base_request(method="monte-carlo", mcTrials=1000, **extra))
+    exact = theory_result_cache_key("calculate", base_request(method="exact", mcTrials=50000, **extra))
+    auto = theory_result_cache_key("calculate", base_request(**extra))
+    assert len({monte_carlo, exact, auto}) == 3
+    assert theory_result_cache_key("calculate-all", base_request(method="monte-carlo", **extra)) != \
+        theory_result_cache_key("calculate-all", base_request(method="exact", **extra))
+
+
+def test_key_ignores_field_order_and_timeout():
+    request = base_request(nodeAvailability=[0.8] * 30, method="auto")
+    reordered = dict(reversed(list(request.items())), timeout=5)
+    assert theory_result_cache_key("calculate", request) == theory_result_cache_key("calculate", reordered)
+
+
+def test_key_ignores_method_for_uniform_closed_form():
+    # 均匀可靠度且全部在线时走闭式解，method / mcTrials 不影响结果
+    assert theory_result_cache_key("calculate", base_request(method="exact")) == \
+        theory_result_cache_key("calculate", base_request(method="monte-carlo", mcTrials=10))
+
+
+def test_key_rejects_non_numeric_fields():
+    from fastapi import HTTPException
+    with pytest.raises(HTTPException) as excinfo:
+        theory_result_cache_key("calculate", base_request(nodeAvailability=["x"] * 30))
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.parametrize("result, expected", [
+    ({"theoryMethod": "exact"}, True),
+    ({"theoryMethod": "closed-form"}, True),
+    ({"theoryMethod": "bounds", "bounds": {"converged": True}}, True),
+    ({"theoryMethod": "bounds", "bounds": {"converged": False}}, False),
+    ({"theoryMethod": "monte-carlo", "monteCarlo": {"seed": 1, "complete": True}}, True),
+    ({"theoryMethod": "monte-carlo", "monteCarlo": {"seed": None, "complete": True}}, False),
+    ({"theoryMethod": "monte-carlo", "monteCarlo": {"seed": 1, "complete": False}}, False),
+    ({"theoryMethod": "gaussian", "fast": {"checkComplete": False}}, False),
+    ({"results": [{"theoryMethod": "exact"}, {"proposerId": 1, "error": "MemoryError: "}]}, False),
+])
+def test_determinism_rules(result, expected):
+    assert theory_result_is_deterministic(result) == expected
+
+
+def test_only_deterministic_results_are_cached():
+    stored_key = theory_result_cache_key("calculate", base_request(reliability=0.91))
+    skipped_key = theory_result_cache_key("calculate", base_request(reliability=0.92))
+    theory_result_cache_put(stored_key, {"theoryMethod": "exact", "theoreticalSuccessRate": 50.0})
+    theory_result_cache_put(skipped_key, {"theoryMethod": "monte-carlo", "monteCarlo": {"seed": None}})
+    assert theory_result_cache_get(stored_key)["theoreticalSuccessRate"] == 50.0
+    assert theory_result_cache_get(skipped_key) is None
+    theory_result_cache.pop(stored_key, None)
@@ -0,0 +1,19 @@
+"""精确两端可靠度（前沿 BDD）与穷举链路状态（benchmarks/bench_two_terminal.py 的 brute_force）一致"""
+import numpy as np
+import pytest
+
+from bench_two_terminal import brute_force
+from main import calculate_comm_reliability_matrix_two_terminal, register_custom_topology
+
+
+@pytest.mark.parametrize("trial", range(6))
+def test_two_terminal_matches_link_state_enumeration(trial):
+    rng = np.random.default_rng(trial)
+    n = int(rng.integers(5, 8))
+    candidates = [(i, j) for i in range(n) for j in range(i + 1, n)]
+    edges = [candidates[i] for i in rng.choice(len(candidates), min(12, len(candidates) - 2), replace=False)]
+    weights = rng.uniform(0.3, 0.99, len(edges)) if trial % 2 else None
+    record = register_custom_topology(n, edges, weights=weights)
+    exact = calculate_comm_reliability_matrix_two_terminal(n, f"custom:{record['id']}", 2, 0.7)
+    expected = brute_force(n, edges, weights if weights is not None else [0.7] * len(edges))
+    np.testing.assert_allclose(exact, expected, atol=1e-9)